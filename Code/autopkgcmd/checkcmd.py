@@ -0,0 +1,70 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+# Limits on the curl processes run at once by check_downloads
+MAX_CONCURRENT_CHECKS = 16
+MAX_CHECKS_PER_HOST = 4
+
+
+async def _run_check(
+    curl_cmd: list[str], host_limit: asyncio.Semaphore, limit: asyncio.Semaphore
+) -> str | None:
+    """Run one curl command and return its output, or None if it failed."""
+    async with host_limit, limit:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *curl_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError:
+            return None
+        stdout, _ = await proc.communicate()
+    if proc.returncode:
+        return None
+    return stdout.decode(errors="ignore")
+
+
+async def _run_checks(
+    checks: dict[str, tuple[str, list[str]]], max_concurrent: int, per_host: int
+) -> dict[str, str | None]:
+    limit = asyncio.Semaphore(max_concurrent)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+    keys = list(checks)
+    results = await asyncio.gather(
+        *(
+            _run_check(curl_cmd, host_limits[urlsplit(url).netloc], limit)
+            for url, curl_cmd in checks.values()
+        )
+    )
+    return dict(zip(keys, results, strict=True))
+
+
+def check_downloads(
+    checks: dict[str, tuple[str, list[str]]],
+    max_concurrent: int = MAX_CONCURRENT_CHECKS,
+    per_host: int = MAX_CHECKS_PER_HOST,
+) -> dict[str, str | None]:
+    """Run the conditional curl requests in checks concurrently.
+
+    checks maps a key to a (url, curl command) tuple. Returns the output of
+    each command by key, or None for commands that failed. At most per_host
+    requests are made to any one host at a time."""
+    if not checks:
+        return {}
+    return asyncio.run(_run_checks(checks, max_concurrent, per_host))
@@ -21,6 +21,7 @@ import shutil
 from glob import glob
 
 from autopkglib import ProcessorError
+from autopkglib.copyengine import copy_item, describe_copy
 from autopkglib.DmgMounter import DmgMounter
 from autopkglib.PkgCreator import PkgCreator
 
@@ -173,13 +174,9 @@ class AppPkgCreator(DmgMounter, PkgCreator):
         source_item = app_path
         dest_item = os.path.join(pkgroot, "Applications", app_name)
         try:
-            if os.path.isdir(source_item):
-                shutil.copytree(source_item, dest_item, symlinks=True)
-            elif not os.path.isdir(dest_item):
-                shutil.copyfile(source_item, dest_item)
-            else:
-                shutil.copy(source_item, dest_item)
+            stats = copy_item(source_item, dest_item)
             self.output(f"Copied {source_item} to {dest_item}")
+            self.output(describe_copy(stats), verbose_level=2)
         except OSError as err:
             raise ProcessorError(
                 f"Can't copy {source_item} to {dest_item}: {err.strerror}"
@@ -199,15 +196,8 @@ class AppPkgCreator(DmgMounter, PkgCreator):
         }
 
         # Send packaging request.
-        try:
-            self.output("Connecting")
-            self.connect()
-            self.output("Sending packaging request")
-            self.env["new_package_request"] = True
-            pkg_path = self.send_request(request)
-        finally:
-            self.output("Disconnecting")
-            self.disconnect()
+        self.env["new_package_request"] = True
+        pkg_path = self.request_package(request)
 
         # Tidy up, deleting the payload dir we created earlier.
         shutil.rmtree(pkgroot)
@@ -24,8 +24,10 @@ from nuget import (
     CHOCO_CHECKSUM_TYPES,
     CHOCO_FILE_TYPES,
     ChocolateyInstallGenerator,
+    NupkgError,
     NuspecDependency,
     NuspecGenerator,
+    pack_nupkg,
 )
 
 __all__ = ["ChocolateyPackager"]
@@ -39,7 +41,8 @@ DefaultValue = VariableSentinel()
 
 
 class ChocolateyPackager(Processor):
-    """Run `choco.exe` to build a single Nuget package."""
+    """Run `choco.exe` to build a single Nuget package. Where `choco.exe` isn't
+    installed, the package is built natively with the same layout."""
 
     description = __doc__
 
@@ -205,10 +208,20 @@ class ChocolateyPackager(Processor):
         "chocoexe_path": {
             "required": False,
             "description": (
-                "The absolute path to `choco.exe` This is not usually needed."
+                "The absolute path to `choco.exe` This is not usually needed. "
+                "If `choco.exe` isn't found, the package is built natively."
             ),
             "default": r"C:\ProgramData\chocolatey\bin\choco.exe",
         },
+        "nupkg_compression_level": {
+            "required": False,
+            "description": (
+                "Deflate compression level, 0-9, used when building the package "
+                "without `choco.exe`. Lower levels are faster; large installers "
+                "are compressed in parallel regardless."
+            ),
+            "default": 6,
+        },
         "additional_install_actions": {
             "required": False,
             "description": (
@@ -289,9 +302,14 @@ class ChocolateyPackager(Processor):
             if k not in self.env:
                 continue
             if k == "dependencies":
-                def_args[k] = list(
-                    map(lambda dep_args: NuspecDependency(**dep_args), self.env[k])
-                )
+                try:
+                    def_args[k] = list(
+                        map(lambda dep_args: NuspecDependency(**dep_args), self.env[k])
+                    )
+                except TypeError as err:
+                    raise ProcessorError(
+                        f"Invalid dependency in 'dependencies': {err}"
+                    ) from err
             else:
                 def_args[k] = self.env[k]
         return NuspecGenerator(**def_args)
@@ -393,6 +411,22 @@ class ChocolateyPackager(Processor):
         os.stat(expected_nupkg_path)  # Test for package existence, or raise.
         return expected_nupkg_path
 
+    def native_pack(self, build_dir: str, output_dir: str) -> str:
+        """Build the Nupkg without `choco.exe`, laid out as `choco.exe pack`
+        would, and return its absolute path, or raise an exception."""
+        self.log(
+            f"Building package {self.env['id']} version {self.env['version']} "
+            "without choco.exe"
+        )
+        try:
+            return pack_nupkg(
+                self._nuspec_path(build_dir),
+                output_dir,
+                level=int(self.env["nupkg_compression_level"]),
+            )
+        except (NupkgError, OSError) as err:
+            raise ProcessorError(f"Failed to build Nuget package: {err}") from err
+
     def log(self, msgs: list[str] | str, verbose_level: int = 0) -> None:
         if isinstance(msgs, list):
             for m in msgs:
@@ -402,7 +436,21 @@ class ChocolateyPackager(Processor):
 
     def main(self) -> None:
         # Validate arguments, apply dynamic defaults as needed.
-        self._ensure_path_var("chocoexe_path")
+        chocoexe_path = self.env.get("chocoexe_path")
+        use_choco = bool(chocoexe_path) and os.path.exists(chocoexe_path)
+        if use_choco:
+            self._ensure_path_var("chocoexe_path")
+        else:
+            self.log(f"choco.exe not found at {chocoexe_path}", 1)
+        try:
+            compression_level = int(self.env.get("nupkg_compression_level", 6))
+        except (TypeError, ValueError):
+            compression_level = -1
+        if compression_level not in range(10):
+            raise ProcessorError(
+                "Variable `nupkg_compression_level` must be an integer from 0 to 9"
+            )
+        self.env["nupkg_compression_level"] = compression_level
         if (
             self.env.get("installer_url") is not None
             and self.env["installer_path"] != DefaultValue
@@ -455,7 +503,10 @@ class ChocolateyPackager(Processor):
             build_dir = mkdtemp(prefix=f"{self.env['id']}.", dir=build_dir_base)
 
             self.write_build_configs(build_dir)
-            nuget_package_path = self.choco_pack(build_dir, output_dir)
+            if use_choco:
+                nuget_package_path = self.choco_pack(build_dir, output_dir)
+            else:
+                nuget_package_path = self.native_pack(build_dir, output_dir)
             self.log(f"Wrote Nuget package to: {nuget_package_path}")
             self.env["nuget_package_path"] = nuget_package_path
             self.env["choco_build_directory"] = build_dir
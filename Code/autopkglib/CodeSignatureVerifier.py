@@ -15,19 +15,26 @@
 # limitations under the License.
 """See docstring for CodeSignatureVerifier class"""
 
+import hashlib
+import json
 import os.path
+import plistlib
 import re
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import StrictVersion
-from glob import glob
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, globengine
 from autopkglib.DmgMounter import DmgMounter
 
 __all__ = ["CodeSignatureVerifier"]
 
 RE_AUTHORITY_PKGUTIL = re.compile(r"\s+[1-9]+\. (?P<authority>.*)\n")
 
+INSTALLER_EXTENSIONS = (".pkg", ".mpkg", ".xip")
+VERIFICATION_CACHE_FILE = "CodeSignatureVerifier.json"
+
 
 class CodeSignatureVerifier(DmgMounter):
     """Verifies application bundle or installer package signature."""
@@ -95,9 +102,81 @@ class CodeSignatureVerifier(DmgMounter):
                 "Array of additional argument strings to pass to codesign."
             ),
         },
+        "verify_all_matches": {
+            "required": False,
+            "description": (
+                "Boolean value to verify every path matched by the 'input_path' "
+                "glob instead of only the first. Paths are verified concurrently "
+                "and the step fails if any of them fails verification."
+            ),
+            "default": False,
+        },
+        "verify_nested": {
+            "required": False,
+            "description": (
+                "Boolean value to also verify application bundles and installer "
+                "packages found inside the matched paths, such as helper apps "
+                "inside an app bundle. Implies 'verify_all_matches'. Nested code "
+                "is verified with 'codesign --deep --strict' and checked against "
+                "'nested_requirement' and 'nested_expected_authority_names' "
+                "rather than the requirement of the matched paths."
+            ),
+            "default": False,
+        },
+        "nested_requirement": {
+            "required": False,
+            "description": (
+                "A requirement string that nested application bundles must "
+                "satisfy when 'verify_nested' is set. If not defined, nested "
+                "bundles only need a valid signature."
+            ),
+        },
+        "nested_expected_authority_names": {
+            "required": False,
+            "description": (
+                "An array of strings defining the certificate authority name "
+                "chain of nested installer packages when 'verify_nested' is set. "
+                "If not defined, nested packages only need a valid signature."
+            ),
+        },
+        "verification_workers": {
+            "required": False,
+            "description": (
+                "Maximum number of verifications to run at once when verifying "
+                "more than one path. Defaults to 4."
+            ),
+            "default": 4,
+        },
+        "cache_verification_results": {
+            "required": False,
+            "description": (
+                "Boolean value to remember successful verifications in the "
+                "recipe cache directory. A path is not verified again while the "
+                "verification options and its contents are unchanged. Bundles "
+                "are identified by their _CodeSignature/CodeResources, main "
+                "executable and file sizes and modification times, and are not "
+                "cached if they have no CodeResources. Caching is disabled if "
+                "RECIPE_CACHE_DIR is not set."
+            ),
+            "default": False,
+        },
     }
     output_variables = {}
 
+    def __init__(self, data=None, infile=None, outfile=None):
+        super().__init__(data, infile, outfile)
+        # Output from verifications running in worker threads is collected per
+        # path, so that it isn't interleaved with other paths' output.
+        self._buffered_output = threading.local()
+
+    def output(self, msg, verbose_level=1) -> None:
+        """Print msg, or collect it if called from a verification worker."""
+        lines = getattr(self._buffered_output, "lines", None)
+        if lines is not None:
+            lines.append((msg, verbose_level))
+        else:
+            super().output(msg, verbose_level)
+
     def codesign_verify(
         self,
         path,
@@ -207,10 +286,29 @@ class CodeSignatureVerifier(DmgMounter):
         # a list with certificate authority names
         return proc.returncode == 0, authority_name_chain
 
-    def process_code_signature(self, path):
-        """Verifies the code signature for a path"""
+    def process_code_signature(self, path, nested=False):
+        """Verifies the code signature for a path. Nested code is verified
+        deeply and strictly against 'nested_requirement'."""
         self.output("Verifying code signature...")
 
+        if nested:
+            if self.codesign_verify(
+                path,
+                self.env.get("nested_requirement"),
+                strict_verification=True,
+                deep_verification=True,
+                codesign_additional_arguments=self.env.get(
+                    "codesign_additional_arguments", []
+                ),
+            ):
+                self.output("Signature is valid")
+                return
+            raise ProcessorError(
+                "Code signature verification failed. Note that "
+                "all verifications can be disabled by setting the variable "
+                "DISABLE_CODE_SIGNATURE_VERIFICATION to a non-empty value."
+            )
+
         if self.env.get("requirements") and not self.env.get("requirement"):
             self.output(
                 "WARNING: This recipe is using 'requirements' when it "
@@ -258,8 +356,9 @@ class CodeSignatureVerifier(DmgMounter):
                 "to a non-empty value."
             )
 
-    def process_installer_package(self, path):
-        """Verifies the signature for an installer pkg"""
+    def process_installer_package(self, path, nested=False):
+        """Verifies the signature for an installer pkg. Nested packages are
+        checked against 'nested_expected_authority_names'."""
         self.output("Verifying installer package signature...")
         # The first step is to run 'pkgutil --check-signature <path>'
         pkgutil_succeeded, authority_names = self.pkgutil_check_signature(path)
@@ -273,6 +372,12 @@ class CodeSignatureVerifier(DmgMounter):
                 "DISABLE_CODE_SIGNATURE_VERIFICATION to a non-empty value."
             )
 
+        if nested:
+            expected_authority_names = self.env.get("nested_expected_authority_names")
+            if expected_authority_names:
+                self.check_authority_names(authority_names, expected_authority_names)
+            return
+
         if self.env.get("expected_authorities") and not self.env.get(
             "expected_authority_names"
         ):
@@ -283,18 +388,253 @@ class CodeSignatureVerifier(DmgMounter):
             )
             self.env["expected_authority_names"] = self.env["expected_authorities"]
         if self.env.get("expected_authority_names"):
-            expected_authority_names = self.env["expected_authority_names"]
-            if authority_names != expected_authority_names:
-                self.output("Mismatch in authority names")
-                self.output(f"Expected: {' -> '.join(expected_authority_names)}")
-                self.output(f"Found:    {' -> '.join(authority_names)}")
-                raise ProcessorError(
-                    "Mismatch in authority names. Note that all "
-                    "verification can be disabled by setting the variable "
-                    "DISABLE_CODE_SIGNATURE_VERIFICATION to a non-empty value."
+            self.check_authority_names(
+                authority_names, self.env["expected_authority_names"]
+            )
+
+    def check_authority_names(self, authority_names, expected_authority_names):
+        """Raises ProcessorError if authority_names isn't the expected chain."""
+        if authority_names != expected_authority_names:
+            self.output("Mismatch in authority names")
+            self.output(f"Expected: {' -> '.join(expected_authority_names)}")
+            self.output(f"Found:    {' -> '.join(authority_names)}")
+            raise ProcessorError(
+                "Mismatch in authority names. Note that all "
+                "verification can be disabled by setting the variable "
+                "DISABLE_CODE_SIGNATURE_VERIFICATION to a non-empty value."
+            )
+        else:
+            self.output("Authority name chain is valid")
+
+    def find_nested_items(self, path: str) -> list[str]:
+        """Return app bundles and installer packages inside path. Flat and
+        bundle packages are not descended into."""
+        nested = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            for dirname in list(dirnames):
+                if os.path.islink(os.path.join(dirpath, dirname)):
+                    dirnames.remove(dirname)
+                elif dirname.endswith(".app"):
+                    nested.append(os.path.join(dirpath, dirname))
+                elif dirname.endswith(INSTALLER_EXTENSIONS):
+                    nested.append(os.path.join(dirpath, dirname))
+                    dirnames.remove(dirname)
+            nested.extend(
+                os.path.join(dirpath, filename)
+                for filename in filenames
+                if filename.endswith(INSTALLER_EXTENSIONS)
+            )
+        return sorted(nested)
+
+    def bundle_digest(self, path: str) -> str | None:
+        """Return a digest of a bundle's code directory: its CodeResources,
+        main executable and the size and modification time of every file.
+        Returns None if the bundle has no CodeResources."""
+        contents = os.path.join(path, "Contents")
+        if not os.path.isdir(contents):
+            # Shallow bundles, as used on iOS and by some frameworks.
+            contents = path
+        code_resources = os.path.join(contents, "_CodeSignature", "CodeResources")
+        if not os.path.isfile(code_resources):
+            return None
+        digest = hashlib.sha256()
+        with open(code_resources, "rb") as f:
+            digest.update(f.read())
+        try:
+            with open(os.path.join(contents, "Info.plist"), "rb") as f:
+                executable = plistlib.load(f).get("CFBundleExecutable")
+        except (OSError, plistlib.InvalidFileException, AttributeError):
+            executable = None
+        if executable:
+            if contents != path:
+                executable = os.path.join("MacOS", executable)
+            try:
+                with open(os.path.join(contents, executable), "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+            except OSError:
+                return None
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(dirpath, filename)
+                info = os.lstat(file_path)
+                digest.update(
+                    f"{os.path.relpath(file_path, path)}\0{info.st_size}\0"
+                    f"{info.st_mtime_ns}\0".encode()
+                )
+        return digest.hexdigest()
+
+    def verification_cache_key(
+        self, path: str, mount_point: str | None, dmg_path: str, nested: bool = False
+    ) -> str | None:
+        """Return a key identifying path's current contents and the options
+        used to verify it, or None if path's contents can't be identified."""
+        info = os.stat(path)
+        if os.path.isdir(path):
+            fingerprint = self.bundle_digest(path)
+            if fingerprint is None:
+                return None
+        else:
+            fingerprint = f"{info.st_ino}:{info.st_size}:{info.st_mtime_ns}"
+        if mount_point:
+            # dmgs are mounted at a different place on every run.
+            path = os.path.join(dmg_path, os.path.relpath(path, mount_point))
+        options = json.dumps(
+            [
+                self.env.get(key)
+                for key in (
+                    "requirement",
+                    "requirements",
+                    "strict_verification",
+                    "deep_verification",
+                    "codesign_additional_arguments",
+                    "expected_authority_names",
+                    "expected_authorities",
+                    "nested_requirement",
+                    "nested_expected_authority_names",
                 )
+            ]
+            + [nested],
+            sort_keys=True,
+        )
+        return ":".join(
+            [path, fingerprint, hashlib.sha256(options.encode()).hexdigest()]
+        )
+
+    def verification_cache_path(self) -> str | None:
+        """Return the path of the verification cache, or None if caching is
+        disabled."""
+        if not self.env.get("cache_verification_results"):
+            return None
+        if not self.env.get("RECIPE_CACHE_DIR"):
+            self.output(
+                "WARNING: RECIPE_CACHE_DIR is not set, not caching verification "
+                "results",
+                verbose_level=2,
+            )
+            return None
+        return os.path.join(self.env["RECIPE_CACHE_DIR"], VERIFICATION_CACHE_FILE)
+
+    def load_verification_cache(self) -> dict[str, bool]:
+        """Return cached verification results."""
+        cache_path = self.verification_cache_path()
+        if not cache_path:
+            return {}
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def save_verification_cache(self, cache: dict[str, bool]) -> None:
+        """Store verification results."""
+        cache_path = self.verification_cache_path()
+        if not cache_path:
+            return
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cache, f, indent=2, sort_keys=True)
+        except OSError as err:
+            self.output(f"WARNING: Could not save verification cache: {err}")
+
+    def verify_path(self, path: str, nested: bool = False) -> None:
+        """Verify the signature of an app bundle or installer package. Nested
+        items are checked against the nested verification options."""
+        # Get current Darwin kernel version
+        darwin_version = os.uname()[2]
+
+        # Get the input file extension and use pkgutil
+        # for .pkg, .mpkg and .xip files.
+        file_extension = os.path.splitext(path)[1]
+        if file_extension in INSTALLER_EXTENSIONS:
+            # Check the kernel version to make sure we're running on
+            # 10.7 or later (10.6.8 == Darwin Kernel Version 10.8.0)
+            if StrictVersion(darwin_version) >= StrictVersion("11.0"):
+                self.process_installer_package(path, nested)
             else:
-                self.output("Authority name chain is valid")
+                self.output(
+                    "WARNING: Installer package signature "
+                    "verification not supported on Mac OS X 10.6"
+                )
+
+        # For everything else, use /usr/bin/codesign.
+        else:
+            self.process_code_signature(path, nested)
+
+    def verify_paths(
+        self,
+        paths: list[str],
+        mount_point: str | None = None,
+        dmg_path: str = "",
+        nested_paths: set[str] | frozenset[str] = frozenset(),
+    ) -> None:
+        """Verify paths, concurrently if there's more than one, skipping those
+        with a cached result. Paths in nested_paths are verified as nested
+        code. Raises ProcessorError naming every path that failed once all
+        verifications are done."""
+        caching = self.verification_cache_path() is not None
+        cache = self.load_verification_cache()
+        pending = []
+        for path in paths:
+            cache_key = None
+            if caching:
+                cache_key = self.verification_cache_key(
+                    path, mount_point, dmg_path, path in nested_paths
+                )
+                if cache_key and cache.get(cache_key):
+                    self.output(f"Signature of {path} previously verified, skipping")
+                    continue
+            pending.append((path, cache_key))
+
+        if len(paths) == 1:
+            # Keep the plain single path behaviour and error message.
+            for path, cache_key in pending:
+                self.verify_path(path, path in nested_paths)
+                if cache_key:
+                    cache[cache_key] = True
+                    self.save_verification_cache(cache)
+            return
+        if not pending:
+            return
+
+        def verify(path: str) -> tuple[list, ProcessorError | None]:
+            self._buffered_output.lines = []
+            try:
+                self.verify_path(path, path in nested_paths)
+                error = None
+            except ProcessorError as err:
+                error = err
+            finally:
+                lines = self._buffered_output.lines
+                self._buffered_output.lines = None
+            return lines, error
+
+        workers = max(1, int(self.env.get("verification_workers", 4)))
+        self.output(f"Verifying {len(pending)} paths with up to {workers} workers...")
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(verify, [path for path, _ in pending])
+            for (path, cache_key), (lines, error) in zip(pending, results, strict=True):
+                self.output(f"{path}:")
+                for msg, verbose_level in lines:
+                    self.output(f"  {msg}", verbose_level)
+                if error:
+                    self.output(f"  {error}")
+                    failed.append(path)
+                elif cache_key:
+                    cache[cache_key] = True
+
+        if caching:
+            self.save_verification_cache(cache)
+        if failed:
+            raise ProcessorError(
+                "Code signature verification failed for: "
+                f"{', '.join(failed)}. Note that all verifications can be "
+                "disabled by setting the variable "
+                "DISABLE_CODE_SIGNATURE_VERIFICATION to a non-empty value."
+            )
 
     def main(self) -> None:
         if self.env.get("DISABLE_CODE_SIGNATURE_VERIFICATION"):
@@ -308,46 +648,44 @@ class CodeSignatureVerifier(DmgMounter):
                 # Mount dmg and copy path inside.
                 mount_point = self.mount(dmg_path)
                 input_path = os.path.join(mount_point, dmg_source_path)
-            # process path with glob.glob
-            matches = glob(input_path)
+            # process path with globbing
+            matches = globengine.glob(
+                input_path, cache_scope=globengine.cache_scope(self.env)
+            )
             if len(matches) == 0:
                 raise ProcessorError(
                     f"Error processing path '{input_path}' with glob. "
                 )
             matched_input_path = matches[0]
-            if len(matches) > 1:
-                self.output(
-                    f"WARNING: Multiple paths match 'input_path' glob '{input_path}':"
-                )
-                for match in matches:
-                    self.output(f"  - {match}")
-
-            if [c for c in "*?[]!" if c in input_path]:
-                self.output(
-                    f"Using path '{matched_input_path}' matched from "
-                    f"globbed '{input_path}'."
-                )
+            verify_nested = self.env.get("verify_nested")
+            nested_paths = set()
+            if verify_nested or self.env.get("verify_all_matches"):
+                paths = matches
+                if verify_nested:
+                    paths = []
+                    for match in matches:
+                        nested_items = self.find_nested_items(match)
+                        paths.extend([match] + nested_items)
+                        nested_paths.update(nested_items)
+            else:
+                paths = [matched_input_path]
+                if len(matches) > 1:
+                    self.output(
+                        "WARNING: Multiple paths match 'input_path' glob "
+                        f"'{input_path}':"
+                    )
+                    for match in matches:
+                        self.output(f"  - {match}")
 
-            # Get current Darwin kernel version
-            darwin_version = os.uname()[2]
-
-            # Get the input file extension and use pkgutil
-            # for .pkg, .mpkg and .xip files.
-            file_extension = os.path.splitext(matched_input_path)[1]
-            if file_extension in [".pkg", ".mpkg", ".xip"]:
-                # Check the kernel version to make sure we're running on
-                # 10.7 or later (10.6.8 == Darwin Kernel Version 10.8.0)
-                if StrictVersion(darwin_version) >= StrictVersion("11.0"):
-                    self.process_installer_package(matched_input_path)
-                else:
+                if [c for c in "*?[]!" if c in input_path]:
                     self.output(
-                        "WARNING: Installer package signature "
-                        "verification not supported on Mac OS X 10.6"
+                        f"Using path '{matched_input_path}' matched from "
+                        f"globbed '{input_path}'."
                     )
 
-            # For everything else, use /usr/bin/codesign.
-            else:
-                self.process_code_signature(matched_input_path)
+            self.verify_paths(
+                paths, mount_point if dmg else None, dmg_path, nested_paths
+            )
 
         finally:
             if dmg:
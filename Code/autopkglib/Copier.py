@@ -15,11 +15,11 @@
 # limitations under the License.
 """See docstring for Copier class"""
 
-import glob
 import os.path
 import shutil
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, globengine
+from autopkglib.copyengine import copy_item, describe_copy
 from autopkglib.DmgMounter import DmgMounter
 
 __all__ = ["Copier"]
@@ -66,13 +66,9 @@ class Copier(DmgMounter):
 
         # Copy file or directory.
         try:
-            if os.path.isdir(source_item):
-                shutil.copytree(source_item, dest_item, symlinks=True)
-            elif not os.path.isdir(dest_item):
-                shutil.copyfile(source_item, dest_item)
-            else:
-                shutil.copy(source_item, dest_item)
+            stats = copy_item(source_item, dest_item)
             self.output(f"Copied {source_item} to {dest_item}")
+            self.output(describe_copy(stats), verbose_level=2)
         except BaseException as err:
             raise ProcessorError(f"Can't copy {source_item} to {dest_item}: {err}")
 
@@ -90,8 +86,12 @@ class Copier(DmgMounter):
                 # Mount dmg and copy path inside.
                 mount_point = self.mount(dmg_path)
                 source_path = os.path.join(mount_point, dmg_source_path)
-            # process path with glob.glob
-            matches = glob.glob(source_path, recursive=True)
+            # process path with globbing
+            matches = globengine.glob(
+                source_path,
+                recursive=True,
+                cache_scope=globengine.cache_scope(self.env),
+            )
             if len(matches) == 0:
                 raise ProcessorError(
                     f"Error processing path '{source_path}' with glob. "
@@ -16,9 +16,8 @@
 """See docstring for FileFinder class"""
 
 import os.path
-from glob import glob
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, globengine
 from autopkglib.DmgMounter import DmgMounter
 
 __all__ = ["FileFinder"]
@@ -56,14 +55,14 @@ class FileFinder(DmgMounter):
         """If multiple files are found the last alphanumerically sorted found
         file is returned"""
 
-        glob_matches = glob(pattern, recursive=True)
+        match = globengine.last_match(
+            pattern, recursive=True, cache_scope=globengine.cache_scope(self.env)
+        )
 
-        if len(glob_matches) < 1:
+        if match is None:
             raise ProcessorError("No matching filename found")
 
-        glob_matches.sort()
-
-        return glob_matches[-1]
+        return match
 
     def main(self) -> None:
         pattern = self.env.get("pattern")
@@ -16,12 +16,35 @@
 """See docstring for GitHubReleasesInfoProvider class"""
 
 import re
+from datetime import datetime
+from urllib.parse import quote
 
 import autopkglib.github
 from autopkglib import APLooseVersion, Processor, ProcessorError
 
 __all__ = ["GitHubReleasesInfoProvider"]
 
+# Fetches only what's needed to choose a release; the chosen release's full
+# details are then fetched from the REST API.
+GRAPHQL_RELEASES_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    releases(
+      first: $first, after: $after,
+      orderBy: {field: CREATED_AT, direction: DESC}
+    ) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        tagName
+        isDraft
+        isPrerelease
+        releaseAssets(first: 100) { nodes { name } }
+      }
+    }
+  }
+}
+"""
+
 
 class NoMatchingReleaseError(ProcessorError):
     """Raised when no release matches the regular expression."""
@@ -107,6 +130,26 @@ class GitHubReleasesInfoProvider(Processor):
             "default": 30,
             "description": "Number of releases to fetch per page, defaults to 30.",
         },
+        "GITHUB_PREFETCH_PAGES": {
+            "required": False,
+            "default": 0,
+            "description": (
+                "Number of further pages of releases to request concurrently "
+                "while a page is searched for a matching asset. Prefetched "
+                "pages that turn out not to be needed still count against the "
+                "API rate limit. Defaults to 0."
+            ),
+        },
+        "GITHUB_USE_GRAPHQL": {
+            "required": False,
+            "default": False,
+            "description": (
+                "If set to True or a non-empty value, list releases with a "
+                "single GraphQL query per page that fetches only tag and asset "
+                "names, then fetch only the chosen release from the REST API. "
+                "Requires a GitHub token."
+            ),
+        },
     }
     output_variables = {
         "release_notes": {
@@ -131,19 +174,65 @@ class GitHubReleasesInfoProvider(Processor):
             )
         },
         "asset_created_at": {"description": ("The release time of the asset.")},
+        "github_api_summary_result": {
+            "description": (
+                "Description of GitHub API requests made, how many were "
+                "answered from the local cache and the remaining rate limit."
+            )
+        },
     }
 
+    github = None
+
+    def get_session(self) -> autopkglib.github.GitHubSession:
+        """Return the GitHub session shared by all requests in this step."""
+        if not self.github:
+            self.github = autopkglib.github.GitHubSession(
+                self.env["CURL_PATH"],
+                self.env.get("curl_opts"),
+                self.env["GITHUB_URL"],
+                self.env["GITHUB_TOKEN_PATH"],
+            )
+        return self.github
+
+    def report_api_usage(self) -> None:
+        """Record GitHub API usage for the run summary."""
+        github = self.github
+        if not github or not github.request_count:
+            return
+        rate_limit = github.rate_limit
+        reset = ""
+        if "reset" in rate_limit:
+            reset = datetime.fromtimestamp(rate_limit["reset"]).isoformat(" ")
+        self.env["github_api_summary_result"] = {
+            "summary_text": "The following GitHub API requests were made:",
+            "report_fields": [
+                "github_repo",
+                "requests",
+                "not_modified",
+                "retries",
+                "rate_limit_remaining",
+                "rate_limit_reset",
+            ],
+            "data": {
+                "github_repo": self.env["github_repo"],
+                "requests": str(github.request_count),
+                "not_modified": str(github.cache_hits),
+                "retries": str(len(github.download_retries)),
+                "rate_limit_remaining": (
+                    f"{rate_limit['remaining']}/{rate_limit['limit']}"
+                    if "remaining" in rate_limit and "limit" in rate_limit
+                    else ""
+                ),
+                "rate_limit_reset": reset,
+            },
+        }
+
     def get_releases(self, repo, page=1, per_page=30, latest_only=False):
         """Return a list of releases dicts for a given GitHub repo. repo must
         be of the form 'user/repo'"""
         releases = None
-        curl_opts = self.env.get("curl_opts")
-        github = autopkglib.github.GitHubSession(
-            self.env["CURL_PATH"],
-            curl_opts,
-            self.env["GITHUB_URL"],
-            self.env["GITHUB_TOKEN_PATH"],
-        )
+        github = self.get_session()
         releases_uri = f"/repos/{repo}/releases"
         if latest_only:
             releases_uri += "/latest"
@@ -161,6 +250,91 @@ class GitHubReleasesInfoProvider(Processor):
 
         return releases
 
+    def iter_release_pages(self):
+        """Yield (page number, list of releases) for each page of releases,
+        newest first, until there are no more."""
+        repo = self.env["github_repo"]
+        per_page = int(
+            self.env.get("GITHUB_RELEASES_PER_PAGE") or self.env.get("per_page", 30)
+        )
+        if self.env.get("latest_only"):
+            yield 1, self.get_releases(repo, latest_only=True)
+        elif self.env.get("GITHUB_USE_GRAPHQL"):
+            yield from self.iter_graphql_release_pages(repo, per_page)
+        else:
+            github = self.get_session()
+            pages = github.iter_pages(
+                f"/repos/{repo}/releases",
+                per_page=per_page,
+                prefetch=int(self.env.get("GITHUB_PREFETCH_PAGES") or 0),
+            )
+            try:
+                for page, releases in pages:
+                    if not releases:
+                        return
+                    yield page, releases
+            except autopkglib.github.GitHubAPIError as err:
+                raise ProcessorError(str(err)) from err
+            finally:
+                pages.close()
+
+    def iter_graphql_release_pages(self, repo, per_page):
+        """Yield (page number, list of partial releases) using the GraphQL
+        API. Releases only have the keys needed by select_asset."""
+        github = self.get_session()
+        if not github.token:
+            raise ProcessorError("GITHUB_USE_GRAPHQL requires a GitHub token.")
+        owner, _, name = repo.partition("/")
+        variables = {"owner": owner, "name": name, "first": min(per_page, 100)}
+        page = 0
+        while True:
+            resp, status = github.graphql(GRAPHQL_RELEASES_QUERY, variables)
+            if status != 200 or not isinstance(resp, dict):
+                raise ProcessorError(f"Unexpected GitHub API status code {status}.")
+            if resp.get("errors"):
+                messages = ", ".join(e.get("message", "") for e in resp["errors"])
+                raise ProcessorError(f"GitHub GraphQL query failed: {messages}")
+            repository = (resp.get("data") or {}).get("repository")
+            if not repository:
+                raise ProcessorError(f"Repo {repo!r} not found")
+            releases = repository["releases"]
+            page += 1
+            nodes = [node for node in releases["nodes"] if not node["isDraft"]]
+            if nodes:
+                yield page, [
+                    {
+                        "name": node["tagName"],
+                        "tag_name": node["tagName"],
+                        "prerelease": node["isPrerelease"],
+                        "assets": [
+                            {"name": asset["name"]}
+                            for asset in node["releaseAssets"]["nodes"]
+                        ],
+                    }
+                    for node in nodes
+                ]
+            if not releases["pageInfo"]["hasNextPage"]:
+                return
+            variables["after"] = releases["pageInfo"]["endCursor"]
+
+    def fetch_selected_release(self, repo):
+        """Replace the partial release and asset chosen from GraphQL results
+        with their full details from the REST API."""
+        tag = self.selected_release["tag_name"]
+        release, status = self.get_session().call_api(
+            f"/repos/{repo}/releases/tags/{quote(tag, safe='')}"
+        )
+        if status != 200 or not isinstance(release, dict):
+            raise ProcessorError(f"Unexpected GitHub API status code {status}.")
+        for asset in release.get("assets") or []:
+            if asset["name"] == self.selected_asset["name"]:
+                self.selected_release = release
+                self.selected_asset = asset
+                return
+        raise ProcessorError(
+            f"Asset {self.selected_asset['name']!r} not found in release {tag!r}"
+        )
+
     def select_asset(self, releases, regex):
         """Iterates through the releases in order and determines the first
         eligible asset that matches the criteria. Sets the selected release
@@ -209,27 +383,42 @@ class GitHubReleasesInfoProvider(Processor):
         )
 
     def main(self) -> None:
+        if "github_api_summary_result" in self.env:
+            del self.env["github_api_summary_result"]
+        self.github = None
+
         # Iterate through our list of releases
-        page = 1
-        while True:
-            self.output(f"Fetching page {page} of GitHub releases")
-            releases = self.get_releases(
-                self.env["github_repo"],
-                latest_only=self.env.get("latest_only"),
-                page=page,
-                per_page=self.env.get("per_page", 30),
-            )
-            if self.env.get("sort_by_highest_tag_names"):
-                releases = sorted(
-                    releases, key=lambda a: APLooseVersion(a["tag_name"]), reverse=True
+        page = 0
+        pages = self.iter_release_pages()
+        try:
+            for page, releases in pages:
+                self.output(f"Searching page {page} of GitHub releases")
+                if self.env.get("sort_by_highest_tag_names"):
+                    releases = sorted(
+                        releases,
+                        key=lambda a: APLooseVersion(a["tag_name"]),
+                        reverse=True,
+                    )
+                try:
+                    # Stop searching if we've found the first eligible one
+                    self.select_asset(releases, self.env.get("asset_regex"))
+                    break
+                except NoMatchingReleaseError:
+                    self.output(f"No releases found on page {page}")
+            else:
+                if not page:
+                    raise ProcessorError(
+                        f"No releases found for repo {self.env['github_repo']!r}"
+                    )
+                raise NoMatchingReleaseError(
+                    "No release assets were found that satisfy the criteria."
                 )
-            try:
-                # Stop searching if we've found the first eligible one
-                self.select_asset(releases, self.env.get("asset_regex"))
-                break
-            except NoMatchingReleaseError:
-                self.output(f"No releases found on page {page}")
-            page += 1
+        finally:
+            # Cancel any prefetched pages we no longer need.
+            pages.close()
+
+        if self.env.get("GITHUB_USE_GRAPHQL") and not self.env.get("latest_only"):
+            self.fetch_selected_release(self.env["github_repo"])
 
         # Record the url
         self.env["url"] = self.selected_asset["browser_download_url"]
@@ -254,6 +443,8 @@ class GitHubReleasesInfoProvider(Processor):
         if not self.env["release_notes"]:
             self.env["release_notes"] = ""
 
+        self.report_api_usage()
+
 
 if __name__ == "__main__":
     PROCESSOR = GitHubReleasesInfoProvider()
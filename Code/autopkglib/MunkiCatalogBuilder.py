@@ -15,22 +15,265 @@
 # limitations under the License.
 """See docstring for MunkiCatalogBuilder class"""
 
-from autopkglib import Processor
+import hashlib
+import os
+import plistlib
+import tempfile
+
+from autopkglib import Processor, ProcessorError, get_pref
 
 __all__ = ["MunkiCatalogBuilder"]
 
+# Bumped when the manifest format changes so older manifests are ignored
+MANIFEST_VERSION = 1
+
 
 class MunkiCatalogBuilder(Processor):
-    """DEPRECATED. This processor now emits a warning and performs no function. Previously it rebuilt Munki catalogs."""
+    """DEPRECATED. As a recipe step, this processor now emits a warning and
+    performs no function. Catalogs are instead rebuilt once at the end of an
+    autopkg run when the MUNKI_REBUILD_CATALOGS preference is set."""
 
     description = __doc__
     lifecycle = {"introduced": "0.1.0", "deprecated": "2.7.5"}
-    input_variables = {}
-    output_variables = {}
+    input_variables = {
+        "MUNKI_REPO": {
+            "required": False,
+            "description": (
+                "Path to a mounted Munki repo. Only used when catalogs are "
+                "rebuilt at the end of an autopkg run."
+            ),
+        },
+        "MUNKI_REPO_PLUGIN": {
+            "required": False,
+            "description": (
+                "Munki repo plugin. Only FileRepo repos can be rebuilt; for "
+                "other plugins the processor does nothing."
+            ),
+            "default": "FileRepo",
+        },
+    }
+    output_variables = {
+        "munki_catalogs_rebuilt": {
+            "description": "List of the catalogs that were rewritten."
+        },
+        "munki_catalog_builder_summary_result": {
+            "description": "Description of interesting results."
+        },
+    }
+
+    def manifest_path(self) -> str:
+        """Return the path of the pkginfo manifest kept for this repo."""
+        cache_dir = self.env.get("CACHE_DIR") or get_pref("CACHE_DIR")
+        cache_dir = os.path.expanduser(cache_dir or "~/Library/AutoPkg/Cache")
+        repo = os.path.realpath(self.env["MUNKI_REPO"])
+        repo_key = hashlib.sha256(repo.encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, "MunkiCatalogBuilder", f"{repo_key}.plist")
+
+    def load_manifest(self) -> dict | None:
+        """Return the pkginfo manifest from the last build, keyed by path
+        relative to pkgsinfo, or None if there isn't a usable one."""
+        try:
+            with open(self.manifest_path(), "rb") as f:
+                manifest = plistlib.load(f)
+        except (OSError, plistlib.InvalidFileException, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest.get("pkginfos", {})
+
+    def write_plist(self, path, data) -> None:
+        """Atomically write data to path as a property list."""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        except OSError as err:
+            raise ProcessorError(f"Could not write {path}: {err}") from err
+        try:
+            with os.fdopen(fd, "wb") as f:
+                plistlib.dump(data, f)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except (OSError, TypeError) as err:
+            os.unlink(temp_path)
+            raise ProcessorError(f"Could not write {path}: {err}") from err
+
+    def scan_pkginfos(self, pkgsinfo_dir) -> dict:
+        """Return the stat results of the pkginfo files under pkgsinfo_dir,
+        keyed by relative path in sorted order. Hidden files, and files that
+        vanish or can't be stat'ed, such as dangling symlinks, are skipped."""
+
+        def walk_error(err):
+            raise ProcessorError(f"Could not read {err.filename}: {err.strerror}")
+
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(
+            pkgsinfo_dir, onerror=walk_error, followlinks=True
+        ):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, pkgsinfo_dir)
+                try:
+                    found[relpath] = os.stat(path)
+                except OSError as err:
+                    self.output(f"WARNING: Skipping pkgsinfo/{relpath}: {err.strerror}")
+        return found
+
+    def read_pkginfo(self, path, relpath, stat, previous) -> dict | None:
+        """Return the manifest entry for a changed pkginfo file, or None if
+        it vanished or can't be read. The file is only parsed if its contents
+        differ from the previous entry."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as err:
+            self.output(f"WARNING: Skipping pkgsinfo/{relpath}: {err.strerror}")
+            return None
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "catalogs": [],
+        }
+        if previous and previous["sha256"] == entry["sha256"]:
+            return {**previous, **entry, "catalogs": previous["catalogs"]}
+        try:
+            pkginfo = plistlib.loads(data)
+        except (plistlib.InvalidFileException, ValueError) as err:
+            self.output(f"WARNING: Could not read pkgsinfo/{relpath}: {err}")
+            return entry
+        if not isinstance(pkginfo, dict):
+            self.output(f"WARNING: pkgsinfo/{relpath} is not a pkginfo dictionary")
+            return entry
+        # admin notes aren't copied to catalogs
+        pkginfo.pop("notes", None)
+        catalogs = pkginfo.get("catalogs", [])
+        if not catalogs:
+            self.output(
+                f"WARNING: pkgsinfo/{relpath} isn't in any catalog", verbose_level=2
+            )
+        entry["catalogs"] = [name for name in catalogs if isinstance(name, str)]
+        entry["item"] = pkginfo
+        return entry
 
     def main(self) -> None:
         pass
 
+    def rebuild_catalogs(self) -> None:
+        """Rebuild the catalogs of a file-based Munki repo from its pkginfo
+        files, as makecatalogs does. Only pkginfo files that changed since the
+        last build are read, and only the catalogs they belong to are
+        rewritten. Called by autopkg run when MUNKI_REBUILD_CATALOGS is set."""
+        if self.env.get("MUNKI_REPO_PLUGIN", "FileRepo") != "FileRepo":
+            self.output(
+                f"Catalogs of {self.env['MUNKI_REPO_PLUGIN']} repos can't be "
+                "rebuilt natively; run makecatalogs instead."
+            )
+            return
+        munki_repo = self.env["MUNKI_REPO"]
+        pkgsinfo_dir = os.path.join(munki_repo, "pkgsinfo")
+        catalogs_dir = os.path.join(munki_repo, "catalogs")
+        if not os.path.isdir(pkgsinfo_dir):
+            raise ProcessorError(f"No pkgsinfo directory in Munki repo {munki_repo}")
+
+        previous = self.load_manifest()
+        old_entries = previous or {}
+        entries = {}
+        affected = set()
+        read_count = 0
+        for relpath, stat in self.scan_pkginfos(pkgsinfo_dir).items():
+            entry = old_entries.get(relpath)
+            if (
+                entry
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+            ):
+                entries[relpath] = entry
+                continue
+            read_count += 1
+            path = os.path.join(pkgsinfo_dir, relpath)
+            new_entry = self.read_pkginfo(path, relpath, stat, entry)
+            if new_entry is None:
+                continue
+            entries[relpath] = new_entry
+            if entry and entry["sha256"] == new_entry["sha256"]:
+                continue
+            affected.add("all")
+            affected.update(entries[relpath]["catalogs"])
+            if entry:
+                affected.update(entry["catalogs"])
+        for relpath in old_entries.keys() - entries.keys():
+            affected.add("all")
+            affected.update(old_entries[relpath]["catalogs"])
+
+        catalogs = {"all": []}
+        for entry in entries.values():
+            if "item" not in entry:
+                continue
+            catalogs["all"].append(entry["item"])
+            for name in entry["catalogs"]:
+                catalogs.setdefault(name, []).append(entry["item"])
+
+        try:
+            existing = {
+                name for name in os.listdir(catalogs_dir) if not name.startswith(".")
+            }
+        except FileNotFoundError:
+            existing = set()
+        except OSError as err:
+            raise ProcessorError(
+                f"Could not read {catalogs_dir}: {err.strerror}"
+            ) from err
+        if previous is None:
+            # without a manifest, every catalog is rebuilt and stale ones removed
+            affected.update(existing)
+            affected.add("all")
+        # catalogs deleted from the repo since the last build are restored
+        affected.update(catalogs.keys() - existing)
+
+        rebuilt = []
+        for name in sorted(affected):
+            path = os.path.join(catalogs_dir, name)
+            if name in catalogs:
+                self.write_plist(path, catalogs[name])
+                rebuilt.append(name)
+            elif name in existing:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as err:
+                    raise ProcessorError(
+                        f"Could not remove {path}: {err.strerror}"
+                    ) from err
+                rebuilt.append(name)
+        self.write_plist(
+            self.manifest_path(),
+            {"version": MANIFEST_VERSION, "repo": munki_repo, "pkginfos": entries},
+        )
+
+        self.env["munki_catalogs_rebuilt"] = rebuilt
+        if "munki_catalog_builder_summary_result" in self.env:
+            del self.env["munki_catalog_builder_summary_result"]
+        if rebuilt:
+            self.output(
+                f"Rebuilt catalogs {', '.join(rebuilt)} after reading "
+                f"{read_count} of {len(entries)} pkginfo files"
+            )
+            self.env["munki_catalog_builder_summary_result"] = {
+                "summary_text": "The following Munki catalogs were rebuilt:",
+                "report_fields": ["munki_repo", "catalogs", "pkginfos_read"],
+                "data": {
+                    "munki_repo": munki_repo,
+                    "catalogs": ", ".join(rebuilt),
+                    "pkginfos_read": str(read_count),
+                },
+            }
+        else:
+            self.output("Catalogs are up to date")
+
 
 if __name__ == "__main__":
     PROCESSOR = MunkiCatalogBuilder()
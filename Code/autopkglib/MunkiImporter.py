@@ -22,7 +22,13 @@ from datetime import datetime
 
 from autopkglib import Processor, ProcessorError
 from autopkglib.munkirepolibs.AutoPkgLib import AutoPkgLib
+from autopkglib.munkirepolibs.CatalogDB import (
+    add_catalog_item,
+    matching_indexes,
+    run_catalog_db,
+)
 from autopkglib.munkirepolibs.MunkiLib import MunkiLib
+from autopkglib.URLDownloader import stored_sha256
 
 __all__ = ["MunkiImporter"]
 
@@ -60,10 +66,40 @@ class MunkiImporter(Processor):
             ),
             "default": False,
         },
+        "MUNKI_IMPORT_HARDLINK": {
+            "required": False,
+            "description": (
+                "When True and the installer item can't be cloned, hard link it "
+                "into a FileRepo repo instead of copying it, if both are on the "
+                "same filesystem."
+            ),
+            "default": False,
+        },
+        "MUNKI_REPO_LOCK": {
+            "required": False,
+            "description": (
+                "When True, hold a lock on a FileRepo repo while copying the "
+                "installer item and writing the pkginfo into it, so several "
+                "autopkg processes can import into the same repo at once. "
+                "Pkginfo files are always written atomically under a unique "
+                "name."
+            ),
+            "default": False,
+        },
         "pkg_path": {
             "required": True,
             "description": "Path to a pkg or dmg to import.",
         },
+        "pkg_sha256": {
+            "required": False,
+            "description": (
+                "SHA-256 digest of pkg_path, if already known. When pkg_path is "
+                "the file downloaded by URLDownloader or URLDownloaderPython, the "
+                "digest computed while downloading is used by default. An item "
+                "with the same hash already in the repo is found without running "
+                "makepkginfo."
+            ),
+        },
         "munkiimport_pkgname": {
             "required": False,
             "description": "Corresponds to --pkgname option to munkiimport.",
@@ -163,30 +199,41 @@ class MunkiImporter(Processor):
         munkilib_dir,
         repo_subdirectory,
         force_munki_lib,
+        allow_hardlink=False,
+        lock_repo=False,
     ):
         if munki_repo_plugin == "FileRepo" and not force_munki_lib:
-            return AutoPkgLib(munki_repo, repo_subdirectory)
+            return AutoPkgLib(munki_repo, repo_subdirectory, allow_hardlink, lock_repo)
         else:
             return MunkiLib(
                 munki_repo, munki_repo_plugin, munkilib_dir, repo_subdirectory
             )
 
+    def _catalog_db(self, repo_library):
+        """Returns the catalog database for the repo. Within an autopkg run
+        it is built once and shared by every MunkiImporter step."""
+        return run_catalog_db(
+            self.env.get("RUN_ID"),
+            (
+                self.env.get("MUNKI_REPO"),
+                self.env.get("MUNKI_REPO_PLUGIN"),
+                repo_library.__class__.__name__,
+            ),
+            repo_library,
+        )
+
     def _find_matching_pkginfo(self, repo_library, pkginfo):
         """Looks through all catalog for items matching the one
         described by pkginfo. Returns a list of matching items if found."""
         if not pkginfo.get("installer_item_hash"):
             return None
 
-        pkgdb = repo_library.make_catalog_db()
+        pkgdb = self._catalog_db(repo_library)
         # match hashes for the pkg or dmg
-        if "installer_item_hash" in pkginfo:
-            matchingindexes = pkgdb["hashes"].get(pkginfo["installer_item_hash"])
-            if matchingindexes:
-                # we have an item with the exact same checksum hash in the repo
-                return [
-                    pkgdb["items"][matchingindex]
-                    for matchingindex in list(matchingindexes)
-                ]
+        matchingindexes = pkgdb["hashes"].get(pkginfo["installer_item_hash"])
+        if matchingindexes:
+            # we have an item with the exact same checksum hash in the repo
+            return [pkgdb["items"][index] for index in matchingindexes]
 
         # try to match against installed applications
         applist = [
@@ -195,106 +242,145 @@ class MunkiImporter(Processor):
             if item.get("type") in ("application", "bundle") and "path" in item
         ]
         if applist:
-            matching_indexes = []
+            app_matches = []
             for app in applist:
-                app_path = app["path"]
                 if "version_comparison_key" in app:
                     app_version = app[app["version_comparison_key"]]
                 else:
                     app_version = app["CFBundleShortVersionString"]
-                match = pkgdb["applications"].get(app_path, {}).get(app_version)
-                if not match:
-                    # no entry for app['path'] and app['version']
-                    # no point in continuing
-                    return None
-                else:
-                    if not matching_indexes:
-                        # store the array of matching item indexes
-                        matching_indexes = set(match)
-                    else:
-                        # we're only interested in items that match
-                        # all applications
-                        matching_indexes = matching_indexes.intersection(set(match))
-
-            # did we find any matches?
-            if matching_indexes:
-                return [
-                    pkgdb["items"][matching_index]
-                    for matching_index in list(matching_indexes)
-                ]
+                app_matches.append(
+                    pkgdb["applications"].get(app["path"], {}).get(app_version)
+                )
+            # we're only interested in items that match all applications
+            indexes = matching_indexes(app_matches)
+            if indexes is None:
+                # no entry for some app path and version
+                return None
+            if indexes:
+                return [pkgdb["items"][index] for index in indexes]
 
         # fall back to matching against receipts
-        matching_indexes = []
-        for item in pkginfo.get("receipts", []):
-            pkgid = item.get("packageid")
-            vers = item.get("version")
-            if pkgid and vers:
-                match = pkgdb["receipts"].get(pkgid, {}).get(vers)
-                if not match:
-                    # no entry for pkgid and vers
-                    # no point in continuing
-                    return None
-                else:
-                    if not matching_indexes:
-                        # store the array of matching item indexes
-                        matching_indexes = set(match)
-                    else:
-                        # we're only interested in items that match
-                        # all receipts
-                        matching_indexes = matching_indexes.intersection(set(match))
-
-        # did we find any matches?
-        if matching_indexes:
-            return [
-                pkgdb["items"][matching_index]
-                for matching_index in list(matching_indexes)
-            ]
-
-        # try to match against install md5checksums
-        filelist = [
-            item
-            for item in pkginfo.get("installs", [])
-            if item["type"] == "file" and "path" in item and "md5checksum" in item
+        receipt_matches = [
+            pkgdb["receipts"].get(item["packageid"], {}).get(item["version"])
+            for item in pkginfo.get("receipts", [])
+            if item.get("packageid") and item.get("version")
         ]
-        if filelist:
-            for fileitem in filelist:
-                cksum = fileitem["md5checksum"]
-                if cksum in pkgdb["checksums"]:
-                    cksum_matches = pkgdb["checksums"][cksum]
-                    for cksum_match in cksum_matches:
-                        if cksum_match["path"] == fileitem["path"]:
-                            matching_pkg = pkgdb["items"][cksum_match["index"]]
+        if receipt_matches:
+            # we're only interested in items that match all receipts
+            indexes = matching_indexes(receipt_matches)
+            if indexes is None:
+                # no entry for some pkgid and version
+                return None
+            if indexes:
+                return [pkgdb["items"][index] for index in indexes]
 
-                            # TODO: maybe match pkg name, too?
-                            # if matching_pkg['name'] == pkginfo['name']:
-
-                            return [matching_pkg]
+        # try to match against install md5checksums
+        for fileitem in pkginfo.get("installs", []):
+            if (
+                fileitem["type"] == "file"
+                and "path" in fileitem
+                and "md5checksum" in fileitem
+            ):
+                indexes = (
+                    pkgdb["checksums"]
+                    .get(fileitem["md5checksum"], {})
+                    .get(fileitem["path"])
+                )
+                if indexes:
+                    # TODO: maybe match pkg name, too?
+                    return [pkgdb["items"][indexes[0]]]
 
         # Try to match against a simple list of files and paths
         # where our pkginfo version also matches
-        path_only_filelist = [
-            item
-            for item in pkginfo.get("installs", [])
-            if item.get("type") == "file"
-            and "path" in item
-            and "md5checksum" not in item
-        ]
-        if path_only_filelist:
-            for pathitem in path_only_filelist:
-                path = pathitem["path"]
-                if path in pkgdb["files"]:
-                    path_matches = pkgdb["files"][path]
-                    for path_match in path_matches:
-                        if path_match["path"] == pathitem["path"]:
-                            matching_pkg = pkgdb["items"][path_match["index"]]
-                            # make sure we do this only for items that also
-                            # match our pkginfo version
-                            if matching_pkg["version"] == pkginfo["version"]:
-                                return [matching_pkg]
+        for pathitem in pkginfo.get("installs", []):
+            if (
+                pathitem.get("type") == "file"
+                and "path" in pathitem
+                and "md5checksum" not in pathitem
+            ):
+                for index in pkgdb["files"].get(pathitem["path"], []):
+                    matching_pkg = pkgdb["items"][index]
+                    # make sure we do this only for items that also
+                    # match our pkginfo version
+                    if matching_pkg["version"] == pkginfo["version"]:
+                        return [matching_pkg]
 
         # if we get here, we found no matches
         return None
 
+    def _known_pkg_sha256(self):
+        """Returns the SHA-256 digest of pkg_path if it's already known,
+        without reading the file"""
+        if self.env.get("pkg_sha256"):
+            return self.env["pkg_sha256"].strip().lower()
+        pkg_path = self.env["pkg_path"]
+        download_path = self.env.get("pathname")
+        try:
+            if (
+                self.env.get("download_sha256")
+                and download_path
+                and os.path.samefile(pkg_path, download_path)
+            ):
+                return self.env["download_sha256"]
+        except OSError:
+            return None
+        return stored_sha256(pkg_path)
+
+    def _find_items_by_hash(self, repo_library):
+        """Looks up items in the repo with the precomputed hash of pkg_path.
+        Returns the matching items and the supported_architectures that
+        makepkginfo would give pkg_path, or None if that can't be known
+        without running it."""
+        pkg_sha256 = self._known_pkg_sha256()
+        if not pkg_sha256:
+            return None
+        pkgdb = self._catalog_db(repo_library)
+        matchingitems = [
+            pkgdb["items"][index] for index in pkgdb["hashes"].get(pkg_sha256, [])
+        ]
+        if not matchingitems:
+            return None
+        if "supported_architectures" in self.env.get("pkginfo", {}):
+            return matchingitems, self.env["pkginfo"]["supported_architectures"]
+        # makepkginfo gives the same file the same architectures every time
+        archs = [item.get("supported_architectures") for item in matchingitems]
+        if any(arch != archs[0] for arch in archs):
+            return None
+        return matchingitems, archs[0]
+
+    def _use_existing_item(self, matchingitems, supported_architectures):
+        """Reports the matching item with the same supported_architectures as
+        already being in the repo. Returns False if there isn't one."""
+        if not matchingitems:
+            return False
+        archs = [
+            matchingitem.get("supported_architectures")
+            for matchingitem in matchingitems
+        ]
+        if supported_architectures not in archs:
+            return False
+        if None not in archs:
+            installer_item_location = [
+                matchingitem.get("installer_item_location")
+                for matchingitem in matchingitems
+                if supported_architectures
+                == matchingitem.get("supported_architectures")
+            ][0]
+        else:
+            installer_item_location = matchingitems[0]["installer_item_location"]
+        self.env["pkginfo_repo_path"] = ""
+        self.env["pkg_repo_path"] = os.path.join(
+            self.env["MUNKI_REPO"], "pkgs", installer_item_location
+        )
+        self.env["munki_info"] = {}
+        self.env["munki_repo_changed"] = False
+
+        self.output(
+            f"Item {os.path.basename(self.env['pkg_path'])} already exists in the "
+            f"munki repo as pkgs/{installer_item_location}."
+        )
+        return True
+
     def main(self) -> None:
         library = self._fetch_repo_library(
             self.env["MUNKI_REPO"],
@@ -302,6 +388,8 @@ class MunkiImporter(Processor):
             self.env["MUNKILIB_DIR"],
             self.env.get("repo_subdirectory"),
             self.env["force_munki_repo_lib"],
+            self.env.get("MUNKI_IMPORT_HARDLINK", False),
+            self.env.get("MUNKI_REPO_LOCK", False),
         )
 
         self.output(f"Using repo lib: {library.__class__.__name__}")
@@ -311,6 +399,14 @@ class MunkiImporter(Processor):
         # clear any pre-existing summary result
         if "munki_importer_summary_result" in self.env:
             del self.env["munki_importer_summary_result"]
+
+        # an item already in the repo can be found from a hash computed while
+        # downloading, without makepkginfo reading the whole installer again
+        if not self.env.get("force_munkiimport"):
+            found = self._find_items_by_hash(library)
+            if found and self._use_existing_item(*found):
+                return
+
         # Generate arguments for makepkginfo.
         args = ["/usr/local/munki/makepkginfo", self.env["pkg_path"]]
         if self.env.get("munkiimport_pkgname"):
@@ -391,34 +487,9 @@ class MunkiImporter(Processor):
         else:
             matchingitems = self._find_matching_pkginfo(library, pkginfo)
 
-        archs = []
-        if matchingitems:
-            archs = [
-                matchingitem.get("supported_architectures")
-                for matchingitem in matchingitems
-            ]
-
-        if matchingitems and (pkginfo.get("supported_architectures") in archs):
-            if archs and None not in archs:
-                installer_item_location = [
-                    matchingitem.get("installer_item_location")
-                    for matchingitem in list(matchingitems)
-                    if pkginfo.get("supported_architectures")
-                    == matchingitem.get("supported_architectures")
-                ][0]
-            else:
-                installer_item_location = matchingitems[0]["installer_item_location"]
-            self.env["pkginfo_repo_path"] = ""
-            self.env["pkg_repo_path"] = os.path.join(
-                self.env["MUNKI_REPO"], "pkgs", installer_item_location
-            )
-            self.env["munki_info"] = {}
-            self.env["munki_repo_changed"] = False
-
-            self.output(
-                f"Item {os.path.basename(self.env['pkg_path'])} already exists in the "
-                f"munki repo as pkgs/{installer_item_location}."
-            )
+        if self._use_existing_item(
+            matchingitems, pkginfo.get("supported_architectures")
+        ):
             return
 
         # import pkg
@@ -428,6 +499,16 @@ class MunkiImporter(Processor):
             install_path, install_prefix
         )
         self.env["pkg_repo_path"] = install_path
+        copy_stats = library.copy_stats if isinstance(library, AutoPkgLib) else {}
+        copy_throughput = ""
+        if copy_stats:
+            rate = copy_stats["bytes"] / max(copy_stats["seconds"], 0.001)
+            copy_throughput = f"{rate / 1024**2:.1f} MB/s"
+            self.output(
+                f"Copied {copy_stats['bytes']} bytes to the repo using "
+                f"{copy_stats['strategy']} ({copy_throughput})",
+                verbose_level=2,
+            )
 
         if self.env.get("uninstaller_pkg_path"):
             uninstall_path = library.copy_pkg_to_repo(
@@ -473,6 +554,11 @@ class MunkiImporter(Processor):
 
         self.env["pkginfo_repo_path"] = pkginfo_path
 
+        # later steps in this run should match the new item without waiting
+        # for the catalogs to be rebuilt
+        if self.env.get("RUN_ID"):
+            add_catalog_item(self._catalog_db(library), pkginfo)
+
         # update env["pkg_path"] to match env["pkg_repo_path"]
         # this allows subsequent recipe steps to reuse the uploaded
         # pkg/dmg instead of re-uploading
@@ -491,6 +577,8 @@ class MunkiImporter(Processor):
                 "pkginfo_path",
                 "pkg_repo_path",
                 "icon_repo_path",
+                "copy_method",
+                "copy_throughput",
             ],
             "data": {
                 "name": pkginfo["name"],
@@ -501,6 +589,8 @@ class MunkiImporter(Processor):
                 ),
                 "pkg_repo_path": os.path.relpath(self.env["pkg_repo_path"], pkg_prefix),
                 "icon_repo_path": rel_icon_path,  # can be path or ""
+                "copy_method": copy_stats.get("strategy", ""),
+                "copy_throughput": copy_throughput,
             },
         }
 
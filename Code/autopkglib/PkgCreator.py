@@ -22,23 +22,36 @@ import subprocess
 from xml.etree import ElementTree as ET
 
 from autopkglib import Processor, ProcessorError
+from autopkglib.flatpkg import FlatPackageBuilder, FlatPackageError, XarReader
 
 AUTO_PKG_SOCKET = "/var/run/autopkgserver"
+PKGBUILD = "/usr/bin/pkgbuild"
+XAR = "/usr/bin/xar"
 
 __all__ = ["PkgCreator"]
 
 
 class PkgCreator(Processor):
-    """Calls autopkgserver to create a package."""
+    """Calls autopkgserver to create a package. If pkgbuild is not available
+    (for example on Linux), the flat package is built natively instead."""
 
     description = __doc__
     lifecycle = {"introduced": "0.1.0"}
     input_variables = {
         "pkg_request": {
-            "required": True,
+            "required": False,
             "description": (
                 "A package request dictionary. See "
-                "Code/autopkgserver/autopkgserver for more details."
+                "Code/autopkgserver/autopkgserver for more details. "
+                "Required unless pkg_requests is set."
+            ),
+        },
+        "pkg_requests": {
+            "required": False,
+            "description": (
+                "An array of package request dictionaries. Packages that "
+                "need building are sent to autopkgserver as a single batch. "
+                "Takes precedence over pkg_request."
             ),
         },
         "force_pkg_build": {
@@ -52,7 +65,15 @@ class PkgCreator(Processor):
         },
     }
     output_variables = {
-        "pkg_path": {"description": "The created package."},
+        "pkg_path": {
+            "description": (
+                "The created package. With pkg_requests, the package for the "
+                "last request."
+            )
+        },
+        "pkg_paths": {
+            "description": "The created packages, in request order.",
+        },
         "new_package_request": {
             "description": (
                 "True if a new package was actually requested to be built. "
@@ -89,10 +110,21 @@ class PkgCreator(Processor):
         raise ProcessorError(f"Can't find {relpath}")
 
     def xar_expand(self, source_path) -> None:
-        """Uses xar to expand an archive"""
+        """Uses xar to expand an archive. Where xar isn't available (e.g. on
+        Linux build hosts), PackageInfo is read with the native xar reader."""
+        if not os.path.exists(XAR):
+            try:
+                XarReader(source_path).extract(
+                    "PackageInfo", self.env.get("RECIPE_CACHE_DIR")
+                )
+            except (FlatPackageError, ET.ParseError, OSError, ValueError) as err:
+                raise ProcessorError(
+                    f"extraction of {source_path} failed: {err}"
+                ) from err
+            return
         try:
             xarcmd = [
-                "/usr/bin/xar",
+                XAR,
                 "-x",
                 "-C",
                 self.env.get("RECIPE_CACHE_DIR"),
@@ -157,15 +189,9 @@ class PkgCreator(Processor):
                 return True
         return False
 
-    def package(self) -> None:
-        """Build a packaging request, send it to the autopkgserver and get the
-        constructed package."""
-
-        # clear any pre-existing summary result
-        if "pkg_creator_summary_result" in self.env:
-            del self.env["pkg_creator_summary_result"]
-
-        request = self.env["pkg_request"]
+    def prepare_request(self, request) -> dict:
+        """Fill in defaults for a packaging request and check that all keys
+        are present."""
         if "pkgdir" not in request:
             request["pkgdir"] = self.env["RECIPE_CACHE_DIR"]
 
@@ -201,6 +227,21 @@ class PkgCreator(Processor):
                 if value and not value.startswith("/"):
                     # search for it
                     request[key] = self.find_path_for_relpath(value)
+        return request
+
+    def package(self) -> None:
+        """Build a packaging request, send it to the autopkgserver and get the
+        constructed package."""
+
+        # clear any pre-existing summary result
+        if "pkg_creator_summary_result" in self.env:
+            del self.env["pkg_creator_summary_result"]
+
+        if self.env.get("pkg_requests"):
+            self.package_batch(self.env["pkg_requests"])
+            return
+
+        request = self.prepare_request(self.env["pkg_request"])
 
         # Check for an existing flat package in the output dir and compare its
         # identifier and version to the one we're going to build.
@@ -210,22 +251,16 @@ class PkgCreator(Processor):
                 "Existing package matches version and identifier, not building."
             )
             self.env["pkg_path"] = pkg_path
+            self.env["pkg_paths"] = [pkg_path]
             self.env["new_package_request"] = False
             return
 
-        # Send packaging request.
-        try:
-            self.output("Connecting")
-            self.connect()
-            self.output("Sending packaging request")
-            self.env["new_package_request"] = True
-            pkg_path = self.send_request(request)
-        finally:
-            self.output("Disconnecting")
-            self.disconnect()
+        self.env["new_package_request"] = True
+        pkg_path = self.request_package(request)
 
         # Return path to pkg.
         self.env["pkg_path"] = pkg_path
+        self.env["pkg_paths"] = [pkg_path]
         self.env["pkg_creator_summary_result"] = {
             "summary_text": "The following packages were built:",
             "report_fields": ["identifier", "version", "pkg_path"],
@@ -236,6 +271,86 @@ class PkgCreator(Processor):
             },
         }
 
+    def package_batch(self, requests: list[dict]) -> None:
+        """Build several packages, sending every request that still needs a
+        build to the autopkgserver in one batch."""
+        requests = [self.prepare_request(request) for request in requests]
+        pkg_paths = []
+        to_build = []
+        for index, request in enumerate(requests):
+            pkg_path = os.path.join(request["pkgdir"], request["pkgname"] + ".pkg")
+            if self.pkg_already_exists(pkg_path, request["id"], request["version"]):
+                self.output(
+                    f"Existing package {pkg_path} matches version and identifier, "
+                    "not building."
+                )
+            else:
+                to_build.append(index)
+            pkg_paths.append(pkg_path)
+
+        self.env["new_package_request"] = bool(to_build)
+        if to_build:
+            built = self.request_packages([requests[index] for index in to_build])
+            for index, pkg_path in zip(to_build, built, strict=True):
+                pkg_paths[index] = pkg_path
+            self.env["pkg_creator_summary_result"] = {
+                "summary_text": "The following packages were built:",
+                "report_fields": ["identifier", "version", "pkg_path"],
+                "data": {
+                    "identifier": ", ".join(requests[i]["id"] for i in to_build),
+                    "version": ", ".join(requests[i]["version"] for i in to_build),
+                    "pkg_path": ", ".join(pkg_paths[i] for i in to_build),
+                },
+            }
+        self.env["pkg_paths"] = pkg_paths
+        self.env["pkg_path"] = pkg_paths[-1]
+
+    def request_package(self, request) -> str:
+        """Build the package described by request and return its path.
+        The request is sent to autopkgserver, or built in-process if pkgbuild
+        is unavailable (e.g. on Linux build hosts)."""
+        if not os.path.exists(PKGBUILD):
+            self.output("pkgbuild not available, building flat package natively")
+            return self.build_native_package(request)
+
+        try:
+            self.output("Connecting")
+            self.connect()
+            self.output("Sending packaging request")
+            return self.send_request(request)
+        finally:
+            self.output("Disconnecting")
+            self.disconnect()
+
+    def request_packages(self, requests: list[dict]) -> list[str]:
+        """Build the packages described by requests and return their paths,
+        in order. All requests are sent to autopkgserver over a single
+        connection, falling back to one connection per request for servers
+        that don't support batches."""
+        if not os.path.exists(PKGBUILD):
+            self.output("pkgbuild not available, building flat packages natively")
+            return [self.build_native_package(request) for request in requests]
+
+        try:
+            self.output("Connecting")
+            self.connect()
+            self.output(f"Sending batch of {len(requests)} packaging requests")
+            pkg_paths = self.send_requests(requests)
+        finally:
+            self.output("Disconnecting")
+            self.disconnect()
+        if pkg_paths is None:
+            self.output("autopkgserver doesn't support batches, sending one by one")
+            pkg_paths = [self.request_package(request) for request in requests]
+        return pkg_paths
+
+    def build_native_package(self, request) -> str:
+        """Build a flat package without autopkgserver or pkgbuild."""
+        try:
+            return FlatPackageBuilder(request, log=self.output).build()
+        except (FlatPackageError, OSError) as err:
+            raise ProcessorError(f"Native package build failed: {err}") from err
+
     def connect(self) -> None:
         """Connect to autopkgserver"""
         try:
@@ -261,6 +376,49 @@ class PkgCreator(Processor):
             errors = ["ERROR:No reply from server (crash?), check system logs"]
         raise ProcessorError(", ".join([s.replace("ERROR:", "") for s in errors]))
 
+    def send_requests(self, requests: list[dict]) -> list[str] | None:
+        """Send a batch of packaging requests to the autopkgserver and return
+        the package paths in request order. Results are read as the server
+        streams them back. Returns None if the server doesn't support
+        batches."""
+        data = plistlib.dumps(requests)
+        try:
+            self.socket.sendall(b"BATCH %d\n" % len(data) + data)
+        except OSError:
+            # Older servers read a single message and may close the connection
+            # before a large batch is sent; their reply is still readable.
+            pass
+
+        replies: dict[int, list[str]] = {}
+        with self.socket.makefile(mode="r") as fileref:
+            for line in fileref:
+                line = line.rstrip("\n")
+                if line == "DONE":
+                    break
+                index, _, reply = line.partition(":")
+                if not index.isdigit():
+                    if not replies and line == "ERROR:Malformed request":
+                        return None
+                    raise ProcessorError(line.replace("ERROR:", ""))
+                replies.setdefault(int(index), []).append(reply)
+                if reply.startswith("OK:"):
+                    self.output(f"Built {reply[3:]}", verbose_level=2)
+
+        pkg_paths = []
+        errors = []
+        for index, request in enumerate(requests):
+            reply = replies.get(index)
+            if not reply:
+                reply = ["ERROR:No reply from server (crash?), check system logs"]
+            if reply[0].startswith("OK:"):
+                pkg_paths.append(reply[0][3:])
+            else:
+                message = ", ".join([s.replace("ERROR:", "") for s in reply])
+                errors.append(f"{request.get('pkgname')}: {message}")
+        if errors:
+            raise ProcessorError("; ".join(errors))
+        return pkg_paths
+
     def disconnect(self) -> None:
         """Disconnect from the autopkgserver"""
         try:
@@ -17,6 +17,7 @@
 
 """See docstring for SparkleUpdateInfoProvider class"""
 
+import heapq
 import os
 from urllib.parse import quote, urlencode, urlsplit, urlunsplit
 from xml.etree import ElementTree
@@ -28,6 +29,10 @@ __all__ = ["SparkleUpdateInfoProvider"]
 
 DEFAULT_XMLNS = "http://www.andymatuschak.org/xml-namespaces/sparkle"
 SUPPORTED_ADDITIONAL_PKGINFO_KEYS = ["description", "minimum_os_version"]
+# Appcasts are fed to the parser in chunks of this many characters or bytes.
+FEED_CHUNK_SIZE = 64 * 1024
+# Number of newest items kept while scanning a feed.
+LATEST_ITEMS_KEPT = 5
 
 
 class SparkleUpdateInfoProvider(URLGetter):
@@ -147,7 +152,7 @@ class SparkleUpdateInfoProvider(URLGetter):
         dictionary of header-name/value mappings."""
 
         curl_cmd = self.prepare_curl_cmd(url, headers)
-        content = self.download_with_curl(curl_cmd)
+        content = self.download_with_curl_cached(curl_cmd)
         return content
 
     def get_feed_data(self, url):
@@ -219,70 +224,107 @@ class SparkleUpdateInfoProvider(URLGetter):
         metadata we're never going to use. If it's a URL, this must be handled
         by whoever calls this function."""
 
-        try:
-            xmldata = ElementTree.fromstring(data)
-        except Exception:
-            raise ProcessorError("Error parsing XML from appcast feed.")
+        return list(self.iter_feed_items(data))
+
+    def iter_feed_items(self, data, descriptions=True):
+        """Yields a dict for each update item in the feed, structured as
+        described in parse_feed_data. The feed is parsed incrementally and
+        each item's elements are discarded once read, so memory use doesn't
+        grow with the size of the feed. With descriptions set to False,
+        description_data is omitted."""
 
-        items = xmldata.findall("channel/item")
-        if not items:
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        stack = []
+        item_count = 0
+        try:
+            for offset in range(0, len(data), FEED_CHUNK_SIZE):
+                parser.feed(data[offset : offset + FEED_CHUNK_SIZE])
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        stack.append(elem)
+                        continue
+                    stack.pop()
+                    # Only rss/channel/item elements are update items.
+                    if (
+                        elem.tag != "item"
+                        or len(stack) != 2
+                        or stack[1].tag != "channel"
+                    ):
+                        continue
+                    item_count += 1
+                    item = self.parse_item(elem, descriptions)
+                    stack[1].remove(elem)
+                    if item is not None:
+                        yield item
+            parser.close()
+        except ElementTree.ParseError as err:
+            raise ProcessorError("Error parsing XML from appcast feed.") from err
+
+        if not item_count:
             raise ProcessorError("No channel items were found in appcast feed.")
 
-        versions = []
-        for item_elem in items:
-            # Skip items with no enclosure
-            enclosure = item_elem.find("enclosure")
-            if enclosure is None:
-                continue
-
-            # Skip enclosures with no URL
-            if not enclosure.get("url"):
-                continue
-
-            item = {}
-            item["url"] = self.build_url(enclosure)
-
-            # version and shortVersionString can be either in item or in enclosure
-            # https://sparkle-project.org/documentation/publishing/#update-your-appcast
-            version = item_elem.find(f"{{{self.xmlns}}}version")
-            if version is not None:
-                item["version"] = version.text
-            else:
-                item["version"] = self.determine_version(enclosure, item["url"])
-            human_version = item_elem.find(f"{{{self.xmlns}}}shortVersionString")
+    def parse_item(self, item_elem, descriptions=True):
+        """Returns a dict for a single appcast item element, or None if the
+        item has no enclosure URL."""
+
+        # Skip items with no enclosure
+        enclosure = item_elem.find("enclosure")
+        if enclosure is None:
+            return None
+
+        # Skip enclosures with no URL
+        if not enclosure.get("url"):
+            return None
+
+        item = {}
+        item["url"] = self.build_url(enclosure)
+
+        # version and shortVersionString can be either in item or in enclosure
+        # https://sparkle-project.org/documentation/publishing/#update-your-appcast
+        version = item_elem.find(f"{{{self.xmlns}}}version")
+        if version is not None:
+            item["version"] = version.text
+        else:
+            item["version"] = self.determine_version(enclosure, item["url"])
+        human_version = item_elem.find(f"{{{self.xmlns}}}shortVersionString")
+        if human_version is not None:
+            item["human_version"] = human_version.text
+        else:
+            human_version = enclosure.get(f"{{{self.xmlns}}}shortVersionString")
             if human_version is not None:
-                item["human_version"] = human_version.text
-            else:
-                human_version = enclosure.get(f"{{{self.xmlns}}}shortVersionString")
-                if human_version is not None:
-                    item["human_version"] = human_version
+                item["human_version"] = human_version
 
-            min_version = item_elem.find(f"{{{self.xmlns}}}minimumSystemVersion")
-            if min_version is not None:
-                item["minimum_os_version"] = min_version.text
+        min_version = item_elem.find(f"{{{self.xmlns}}}minimumSystemVersion")
+        if min_version is not None:
+            item["minimum_os_version"] = min_version.text
 
-            channel = item_elem.find(f"{{{self.xmlns}}}channel")
-            if channel is not None:
-                item["channel"] = channel.text
+        channel = item_elem.find(f"{{{self.xmlns}}}channel")
+        if channel is not None:
+            item["channel"] = channel.text
 
-            description_elem = item_elem.find(f"{{{self.xmlns}}}releaseNotesLink")
-            # Strip possible surrounding whitespace around description_url
-            # element text as we'll be passing this as an argument to a
-            # curl process
-            if description_elem is not None:
-                item["description_url"] = description_elem.text
+        description_elem = item_elem.find(f"{{{self.xmlns}}}releaseNotesLink")
+        # Strip possible surrounding whitespace around description_url
+        # element text as we'll be passing this as an argument to a
+        # curl process
+        if description_elem is not None:
+            item["description_url"] = description_elem.text
 
-            if item_elem.find("description") is not None:
-                item["description_data"] = item_elem.find("description").text
+        if descriptions and item_elem.find("description") is not None:
+            item["description_data"] = item_elem.find("description").text
 
-            # Strip values
-            for k, v in item.items():
-                if v is not None:
-                    item[k] = v.strip()
+        # Strip values
+        for k, v in item.items():
+            if v is not None:
+                item[k] = v.strip()
 
-            versions.append(item)
+        return item
 
-        return versions
+    def latest_items(self, items, count=LATEST_ITEMS_KEPT):
+        """Returns the count items with the highest versions, highest first,
+        keeping no more than count items in memory. Items with equal versions
+        keep their feed order."""
+
+        return heapq.nlargest(count, items, key=lambda x: APLooseVersion(x["version"]))
 
     def handle_pkginfo(self, latest):
         """Handles any keys we may have defined"""
@@ -339,20 +381,39 @@ class SparkleUpdateInfoProvider(URLGetter):
         self.xmlns = self.env.get("alternate_xmlns_url", DEFAULT_XMLNS)
 
         data = self.get_feed_data(self.env.get("appcast_url"))
-        items = self.parse_feed_data(data)
-        self.output(f"Items in feed: {len(items)}", verbose_level=1)
-
-        # Filter items to desired channel
+        # Descriptions can be large, so only keep them if they're wanted.
+        descriptions = "description" in (
+            self.env.get("pkginfo_keys_to_copy_from_sparkle_feed") or []
+        )
+        counts = {"feed": 0, "channel": 0}
         channel_name = self.env.get("update_channel") or "default"
-        if self.env.get("update_channel"):
-            items = [x for x in items if x.get("channel") == self.env["update_channel"]]
-        else:
-            items = [x for x in items if not x.get("channel")]
-        self.output(f"Items in {channel_name} channel: {len(items)}", verbose_level=1)
-        if not items:
+
+        def channel_items():
+            """Yield the feed's items in the desired channel."""
+            for item in self.iter_feed_items(data, descriptions=descriptions):
+                counts["feed"] += 1
+                if self.env.get("update_channel"):
+                    in_channel = item.get("channel") == self.env["update_channel"]
+                else:
+                    in_channel = not item.get("channel")
+                if in_channel:
+                    counts["channel"] += 1
+                    yield item
+
+        latest_items = self.latest_items(channel_items())
+        self.output(f"Items in feed: {counts['feed']}", verbose_level=1)
+        self.output(
+            f"Items in {channel_name} channel: {counts['channel']}", verbose_level=1
+        )
+        if not latest_items:
             raise ProcessorError(f"No items were found in {channel_name} channel.")
+        self.output(
+            "Latest versions in channel: "
+            f"{', '.join(item['version'] for item in latest_items)}",
+            verbose_level=2,
+        )
 
-        latest = max(items, key=lambda x: APLooseVersion(x["version"]))
+        latest = latest_items[0]
         self.output(f"Version retrieved from appcast: {latest['version']}")
         if latest.get("human_version"):
             self.output(
@@ -16,15 +16,125 @@
 # limitations under the License.
 """See docstring for URLDownloader class"""
 
+import hashlib
 import os.path
 import platform
+import sys
 import tempfile
+import threading
 
-from autopkglib import BUNDLE_ID, ProcessorError, xattr
+from autopkglib import BUNDLE_ID, RE_KEYREF, ProcessorError, xattr
 from autopkglib.URLGetter import URLGetter
 
 __all__ = ["URLDownloader"]
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, algorithms=("sha256",)) -> dict[str, str]:
+    """Return the hex digests of a file by algorithm name."""
+    hashes = {name: hashlib.new(name, usedforsecurity=False) for name in algorithms}
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            for a_hash in hashes.values():
+                a_hash.update(chunk)
+    return {name: a_hash.hexdigest() for name, a_hash in hashes.items()}
+
+
+def sha256_xattr_value(path, digest) -> bytes:
+    """Return the xattr value recording digest as the SHA-256 digest of path,
+    along with path's current size and modification time."""
+    info = os.stat(path)
+    return f"{digest} {info.st_size} {info.st_mtime_ns}".encode()
+
+
+def stored_sha256(path) -> str | None:
+    """Return the SHA-256 digest stored in path's extended attributes when
+    URLDownloader downloaded it, or None. The digest is ignored if path's
+    size or modification time has changed since it was stored."""
+    attr = f"{BUNDLE_ID}.sha256"
+    if sys.platform.startswith("linux"):
+        attr = f"user.{attr}"
+    try:
+        if attr not in xattr.listxattr(path):
+            return None
+        value = xattr.getxattr(path, attr).decode()
+        info = os.stat(path)
+    except OSError:
+        return None
+    digest, _, stamp = value.partition(" ")
+    if stamp != f"{info.st_size} {info.st_mtime_ns}":
+        return None
+    return digest
+
+
+class DownloadHasher(threading.Thread):
+    """Hashes a file while curl writes it, so the download is hashed from the
+    page cache instead of being read back once it's complete.
+
+    The streamed digests are only trusted if the file still has the size,
+    modification time and inode it had after the last chunk was read, and the
+    transfer wasn't restarted. Otherwise the finished file is hashed again."""
+
+    def __init__(self, path, algorithms=("sha256",)):
+        super().__init__(daemon=True)
+        self.path = path
+        self.algorithms = algorithms
+        self.finished = threading.Event()
+        self.reset()
+
+    def reset(self) -> None:
+        self.hashes = {
+            name: hashlib.new(name, usedforsecurity=False) for name in self.algorithms
+        }
+        self.size = 0
+        self.stat = None
+
+    def run(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    # Only stop after a read that started once curl had exited
+                    done = self.finished.is_set()
+                    chunk = f.read(HASH_CHUNK_SIZE)
+                    if chunk:
+                        self.size += len(chunk)
+                        for a_hash in self.hashes.values():
+                            a_hash.update(chunk)
+                        self.stat = os.fstat(f.fileno())
+                    elif done:
+                        break
+                    elif os.fstat(f.fileno()).st_size < self.size:
+                        # curl truncated the file to start over, e.g. on retry
+                        f.seek(0)
+                        self.reset()
+                    else:
+                        self.finished.wait(0.05)
+        except OSError:
+            self.size = -1
+
+    def hexdigests(self, restarted=False) -> dict[str, str]:
+        """Stop following the file and return its digests by algorithm name.
+        Set restarted if curl may have truncated the file and written it again,
+        as the hasher could have read some of the first attempt's bytes."""
+        self.finished.set()
+        self.join()
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return {}
+        if (
+            restarted
+            or self.stat is None
+            or self.size != info.st_size
+            or (self.stat.st_ino, self.stat.st_mtime_ns)
+            != (info.st_ino, info.st_mtime_ns)
+        ):
+            # The file was replaced or rewritten rather than appended to; read
+            # it again
+            return hash_file(self.path, self.algorithms)
+        return {name: a_hash.hexdigest() for name, a_hash in self.hashes.items()}
+
 
 class URLDownloader(URLGetter):
     """Downloads a URL to the specified download_dir using curl."""
@@ -59,8 +169,8 @@ class URLDownloader(URLGetter):
         "prefetch_filename": {
             "required": False,
             "description": (
-                "If True, URLDownloader attempts to determine filename from HTTP "
-                "headers downloaded before the file itself. 'prefetch_filename' "
+                "If True, URLDownloader determines the filename from the HTTP "
+                "headers of the download response itself. 'prefetch_filename' "
                 "overrides 'filename' option. Filename is determined from the first "
                 "available source of information in this order:\n"
                 "\t1. Content-Disposition header\n"
@@ -93,6 +203,21 @@ class URLDownloader(URLGetter):
                 "this package or disk image."
             ),
         },
+        "expected_sha256": {
+            "required": False,
+            "description": (
+                "SHA-256 digest the download must have. If it doesn't match, "
+                "the download is discarded and the processor fails."
+            ),
+        },
+        "COMPUTE_HASHES": {
+            "required": False,
+            "description": (
+                "Also compute md5 and sha1 digests of the download. The sha256 "
+                "digest is always computed."
+            ),
+            "default": False,
+        },
     }
     output_variables = {
         "pathname": {"description": "Path to the downloaded file."},
@@ -100,6 +225,18 @@ class URLDownloader(URLGetter):
             "description": "last-modified header for the downloaded item."
         },
         "etag": {"description": "etag header for the downloaded item."},
+        "download_sha256": {
+            "description": (
+                "SHA-256 digest of the downloaded item, computed while it was "
+                "downloaded. Also stored in an extended attribute."
+            )
+        },
+        "download_sha1": {
+            "description": "SHA-1 digest of the download, if COMPUTE_HASHES is set."
+        },
+        "download_md5": {
+            "description": "MD5 digest of the download, if COMPUTE_HASHES is set."
+        },
         "download_changed": {
             "description": (
                 "Boolean indicating if the download has changed since the "
@@ -162,22 +299,21 @@ class URLDownloader(URLGetter):
         if platform.platform().startswith("Linux"):
             self.xattr_etag = f"user.{BUNDLE_ID}.etag"
             self.xattr_last_modified = f"user.{BUNDLE_ID}.last-modified"
+            self.xattr_url = f"user.{BUNDLE_ID}.url"
+            self.xattr_sha256 = f"user.{BUNDLE_ID}.sha256"
         else:
             self.xattr_etag = f"{BUNDLE_ID}.etag"
             self.xattr_last_modified = f"{BUNDLE_ID}.last-modified"
+            self.xattr_url = f"{BUNDLE_ID}.url"
+            self.xattr_sha256 = f"{BUNDLE_ID}.sha256"
 
         self.env["last_modified"] = ""
         self.env["etag"] = ""
+        self.env["download_sha256"] = ""
         self.existing_file_size = None
 
-    def prefetch_filename(self) -> str | None:
-        """Attempt to find filename in HTTP headers."""
-        curl_cmd = self.prepare_base_curl_cmd()
-        curl_cmd.extend(["--head"])
-
-        raw_headers = self.download_with_curl(curl_cmd)
-        header = self.parse_headers(raw_headers)
-
+    def filename_from_headers(self, header) -> str | None:
+        """Attempt to find filename in parsed HTTP headers."""
         if "filename=" in header.get("content-disposition", ""):
             filename = (
                 header["content-disposition"]
@@ -185,24 +321,56 @@ class URLDownloader(URLGetter):
                 .replace('"', "")
             )
             self.output(
-                f"Filename prefetched from the HTTP Content-Disposition header: {filename}",
+                f"Filename found in the HTTP Content-Disposition header: {filename}",
                 verbose_level=2,
             )
         elif header.get("http_redirected", None):
             filename = header["http_redirected"].rpartition("/")[2]
             self.output(
-                f"Filename prefetched from the HTTP Location header: {filename}",
+                f"Filename found in the HTTP Location header: {filename}",
                 verbose_level=2,
             )
         else:
-            self.output(
-                "Unable to find filename in the HTTP headers during prefetch",
-                verbose_level=2,
-            )
+            self.output("Unable to find filename in the HTTP headers", verbose_level=2)
             return None
 
         return filename
 
+    def find_previous_download(self, download_dir) -> str | None:
+        """Return the newest file in download_dir that was downloaded from url
+        with prefetch_filename, or None."""
+        matches = []
+        try:
+            for entry in os.scandir(download_dir):
+                if not entry.is_file() or self.xattr_url not in xattr.listxattr(
+                    entry.path
+                ):
+                    continue
+                if (
+                    xattr.getxattr(entry.path, self.xattr_url).decode()
+                    == self.env["url"]
+                ):
+                    matches.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return None
+        return max(matches)[1] if matches else None
+
+    def resolve_pathname(self, header, filename) -> None:
+        """Point pathname at the filename named by the response headers,
+        falling back to filename."""
+        if header["http_result_code"] == "304":
+            # The previous download is unchanged, so keep its name
+            return
+        pathname = os.path.join(
+            os.path.dirname(self.env["pathname"]),
+            self.filename_from_headers(header) or filename,
+        )
+        if pathname != self.env["pathname"]:
+            self.env["pathname"] = pathname
+            self.existing_file_size = (
+                os.path.getsize(pathname) if os.path.exists(pathname) else None
+            )
+
     def get_filename(self) -> str | None:
         """Obtain filename from PKG variable or URL."""
         if "PKG" in self.env:
@@ -211,11 +379,6 @@ class URLDownloader(URLGetter):
             self.output(f"Given {self.env['pathname']}, no download needed.")
             return None
 
-        if self.env.get("prefetch_filename", False):
-            filename = self.prefetch_filename()
-            if filename:
-                return filename
-
         if "filename" in self.env:
             filename = self.env["filename"]
         else:
@@ -224,6 +387,55 @@ class URLDownloader(URLGetter):
 
         return filename
 
+    def initial_pathname(self, download_dir, filename) -> str:
+        """Return the path the download is expected at before the request."""
+        pathname = os.path.join(download_dir, filename)
+        if self.env.get("prefetch_filename", False):
+            # The real filename is only known once the response arrives, so
+            # make the request conditional on what this URL was last saved as
+            pathname = self.find_previous_download(download_dir) or pathname
+        return pathname
+
+    def prepare_check_curl_cmd(self) -> list[str] | None:
+        """Return a curl command that asks whether the download has changed
+        without downloading it, or None if that can't be known before the
+        recipe runs."""
+        self.clear_vars()
+        url = self.env.get("url")
+        if (
+            not url
+            or RE_KEYREF.search(url)
+            or "PKG" in self.env
+            or self.env.get("CHECK_FILESIZE_ONLY")
+        ):
+            return None
+        filename = self.get_filename()
+        download_dir = self.get_download_dir()
+        self.env["pathname"] = self.initial_pathname(download_dir, filename)
+        headers = self.produce_etag_headers(self.env["pathname"])
+        if not headers:
+            return None
+        curl_cmd = self.prepare_base_curl_cmd()
+        curl_cmd.append("--head")
+        self.add_curl_common_opts(curl_cmd)
+        self.add_curl_headers(curl_cmd, headers)
+        return curl_cmd
+
+    def checked_unchanged(self) -> bool:
+        """Return True if a check made before the recipe ran found the download
+        at pathname unchanged."""
+        check = self.env.get("DOWNLOAD_CHECK_RESULT") or {}
+        if (
+            check.get("url") != self.env["url"]
+            or check.get("pathname") != self.env["pathname"]
+            or check.get("http_result_code") != "304"
+        ):
+            return False
+        self.env["download_changed"] = False
+        self.output("Item at URL is unchanged (checked before the run).")
+        self.output(f"Using existing {self.env['pathname']}")
+        return True
+
     def get_download_dir(self) -> str:
         """Create download dir and return its path."""
         download_dir = self.env.get("download_dir") or os.path.join(
@@ -292,6 +504,48 @@ class URLDownloader(URLGetter):
                 f"Can't move {pathname_temporary} to {self.env['pathname']}"
             )
 
+    def hash_algorithms(self) -> tuple[str, ...]:
+        """Return the digests to compute for a download."""
+        if self.env.get("COMPUTE_HASHES"):
+            return ("sha256", "sha1", "md5")
+        return ("sha256",)
+
+    def store_digests(self, digests) -> None:
+        """Set the download_* digest variables and store the sha256 digest in
+        pathname's xattr."""
+        for name, digest in digests.items():
+            self.env[f"download_{name}"] = digest
+        xattr.setxattr(
+            self.env["pathname"],
+            self.xattr_sha256,
+            sha256_xattr_value(self.env["pathname"], digests["sha256"]),
+        )
+        self.output(f"SHA-256 digest: {digests['sha256']}", verbose_level=2)
+
+    def verify_sha256(self, digest, path) -> None:
+        """Raise ProcessorError if digest doesn't match expected_sha256."""
+        expected = self.env.get("expected_sha256")
+        if expected and digest.lower() != expected.strip().lower():
+            raise ProcessorError(
+                f"SHA-256 digest of {path} is {digest}, but {expected} " "was expected."
+            )
+
+    def use_existing_download(self) -> None:
+        """Set download_sha256 for an unchanged download at pathname from the
+        digest stored when it was downloaded."""
+        digest = stored_sha256(self.env["pathname"])
+        if digest:
+            self.env["download_sha256"] = digest
+        elif os.path.exists(self.env["pathname"]) and (
+            self.env.get("expected_sha256") or self.getxattr(self.xattr_sha256)
+        ):
+            # Downloaded before digests were stored, or changed since; only
+            # read it back when the digest has to be checked or was known
+            digest = hash_file(self.env["pathname"])["sha256"]
+            self.store_digests({"sha256": digest})
+        if digest:
+            self.verify_sha256(digest, self.env["pathname"])
+
     def store_headers(self, header) -> None:
         """Store last-modified and etag headers in pathname xattr."""
         if header.get("last-modified"):
@@ -322,28 +576,57 @@ class URLDownloader(URLGetter):
         if filename is None:
             return
         download_dir = self.get_download_dir()
-        self.env["pathname"] = os.path.join(download_dir, filename)
+        self.env["pathname"] = self.initial_pathname(download_dir, filename)
+        if self.checked_unchanged():
+            self.use_existing_download()
+            return
+        prefetch_filename = self.env.get("prefetch_filename", False)
         pathname_temporary = self.create_temp_file(download_dir)
 
         # Prepare curl command
         curl_cmd = self.prepare_download_curl_cmd(pathname_temporary)
 
-        # Execute curl command and parse headers
-        raw_headers = self.download_with_curl(curl_cmd)
+        # Execute curl command and parse headers, hashing the download as it's
+        # written
+        hasher = DownloadHasher(pathname_temporary, self.hash_algorithms())
+        retries = len(self.download_retries)
+        hasher.start()
+        try:
+            raw_headers = self.download_with_curl(curl_cmd)
+        finally:
+            # Retries, including curl's own, start the file over
+            digests = hasher.hexdigests(
+                restarted=len(self.download_retries) > retries
+                or any(arg.startswith("--retry") for arg in curl_cmd)
+            )
         header = self.parse_headers(raw_headers)
+        if prefetch_filename:
+            self.resolve_pathname(header, filename)
 
         if self.download_changed(header):
             self.env["download_changed"] = True
         else:
             # Discard the temp file
             os.remove(pathname_temporary)
+            self.use_existing_download()
             return
 
+        try:
+            self.verify_sha256(digests.get("sha256", ""), self.env["url"])
+        except ProcessorError:
+            os.remove(pathname_temporary)
+            raise
+
         # New resource was downloaded. Move the temporary download file to the pathname
         self.move_temp_file(pathname_temporary)
+        self.store_digests(digests)
 
         # Save last-modified and etag headers to files xattr
         self.store_headers(header)
+        if prefetch_filename:
+            xattr.setxattr(
+                self.env["pathname"], self.xattr_url, self.env["url"].encode()
+            )
 
         # Generate output messages and variables
         self.output(f"Downloaded {self.env['pathname']}")
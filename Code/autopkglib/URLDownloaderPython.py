@@ -18,7 +18,9 @@
 import json
 import os
 import ssl
+import time
 from hashlib import md5, sha1, sha256
+from urllib.error import HTTPError, URLError
 from urllib.request import Request, urlopen
 
 import certifi
@@ -95,11 +97,18 @@ class URLDownloaderPython(URLDownloader):
         "COMPUTE_HASHES": {
             "required": False,
             "description": (
-                "Determine whether to compute md5, sha1, and sha256 hashes of "
-                "the downloaded file."
+                "Determine whether to also compute md5 and sha1 hashes of "
+                "the downloaded file. The sha256 hash is always computed."
             ),
             "default": False,
         },
+        "expected_sha256": {
+            "required": False,
+            "description": (
+                "SHA-256 digest the download must have. If it doesn't match, "
+                "the download is discarded and the processor fails."
+            ),
+        },
         "HEADERS_TO_TEST": {
             "required": False,
             "description": (
@@ -116,6 +125,12 @@ class URLDownloaderPython(URLDownloader):
             "description": "last-modified header for the downloaded item."
         },
         "etag": {"description": "etag header for the downloaded item."},
+        "download_sha256": {
+            "description": (
+                "SHA-256 digest of the downloaded item, computed while it was "
+                "downloaded. Also stored in the download's .info.json file."
+            )
+        },
         "download_changed": {
             "description": (
                 "Boolean indicating if the download has changed since the "
@@ -254,6 +269,27 @@ class URLDownloaderPython(URLDownloader):
             ctx.load_verify_locations(cafile=cafile)
         return ctx
 
+    def open_url(self, request_obj):
+        """Open request_obj, retrying transient failures with the same policy
+        URLGetter applies to curl."""
+        policy = self.retry_policy()
+        attempt = 1
+        while True:
+            try:
+                return urlopen(request_obj, context=self.ssl_context_certifi())
+            except HTTPError as err:
+                if err.code not in policy.status_codes or attempt >= policy.attempts:
+                    raise
+                reason, headers = f"HTTP {err.code}", str(err.headers or "")
+            except (URLError, ConnectionError, TimeoutError) as err:
+                if attempt >= policy.attempts:
+                    raise
+                reason, headers = str(getattr(err, "reason", err)), ""
+            delay = policy.delay(attempt, headers)
+            self.record_retry([request_obj.full_url], attempt, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+
     def download_and_hash(self, file_save_path) -> dict | None:
         """stream down file from url and calculate size & hashes"""
         # it is much more efficient to calculate hashes WHILE downloading
@@ -262,21 +298,19 @@ class URLDownloaderPython(URLDownloader):
         url = self.env.get("url")
         download_dictionary = {}
 
-        hashes = None
+        # sha256 is always computed so it can be checked against
+        # expected_sha256 and reused by later steps
+        hashes = {"sha256": sha256(usedforsecurity=False)}
         if self.env.get("COMPUTE_HASHES", None):
-            hashes = (
-                sha1(usedforsecurity=False),
-                sha256(usedforsecurity=False),
-                md5(usedforsecurity=False),
-            )
+            hashes["sha1"] = sha1(usedforsecurity=False)
+            hashes["md5"] = md5(usedforsecurity=False)
 
         # chunksize seems like it could be anything
         #   it is probably best if it is a multiple of a typical hash block_size
         #   a larger chunksize is probably best for faster downloads
         #   chunksize should be evenly divisible by 4096 due to 4k blocks of storage
         chunksize = 4096 * 100
-        if hashes:
-            chunksize = max(chunksize, max(a_hash.block_size for a_hash in hashes))
+        chunksize = max(chunksize, max(a_hash.block_size for a_hash in hashes.values()))
 
         size = 0
 
@@ -298,7 +332,7 @@ class URLDownloaderPython(URLDownloader):
         request_obj = Request(url, headers=normalised_headers)
 
         # get http headers
-        response = urlopen(request_obj, context=self.ssl_context_certifi())
+        response = self.open_url(request_obj)
         response_headers = response.info()
 
         self.env["download_changed"] = self.download_changed(response_headers)
@@ -316,9 +350,8 @@ class URLDownloaderPython(URLDownloader):
             # get size of chunk and add to existing size
             size += len(chunk)
             # add chunk to hash computations
-            if hashes:
-                for a_hash in hashes:
-                    a_hash.update(chunk)
+            for a_hash in hashes.values():
+                a_hash.update(chunk)
             # save file if handler
             if file_save:
                 file_save.write(chunk)
@@ -329,10 +362,9 @@ class URLDownloaderPython(URLDownloader):
 
         download_dictionary["file_name"] = self.env.get("filename", "")
         download_dictionary["file_size"] = size
-        if hashes:
-            download_dictionary["file_sha1"] = hashes[0].hexdigest()
-            download_dictionary["file_sha256"] = hashes[1].hexdigest()
-            download_dictionary["file_md5"] = hashes[2].hexdigest()
+        for name, a_hash in hashes.items():
+            download_dictionary[f"file_{name}"] = a_hash.hexdigest()
+            self.env[f"download_{name}"] = a_hash.hexdigest()
         download_dictionary["download_url"] = url
         # download_dictionary['http_headers'] = response.info()
         try:
@@ -358,6 +390,11 @@ class URLDownloaderPython(URLDownloader):
             return None
 
         if self.env.get("download_changed", None):
+            try:
+                self.verify_sha256(download_dictionary["file_sha256"], url)
+            except ProcessorError:
+                os.remove(file_save_path)
+                raise
             # Move the new temporary download file to the pathname
             self.move_temp_file(file_save_path)
 
@@ -382,8 +419,6 @@ class URLDownloaderPython(URLDownloader):
         # Clear and initialize data structures
         self.clear_vars()
 
-        # self.prefetch_filename()
-
         # Ensure existence of necessary files, directories and paths
         filename = self.get_filename()
         if filename is None:
@@ -414,6 +449,13 @@ class URLDownloaderPython(URLDownloader):
         # clear temp file if 0 size
         self.clear_zero_file(pathname_temporary)
 
+        if not self.env.get("download_changed", None):
+            # reuse the digest recorded when the file was downloaded
+            info_json = self.get_download_info_json() or {}
+            self.env["download_sha256"] = info_json.get("file_sha256", "")
+            if self.env["download_sha256"]:
+                self.verify_sha256(self.env["download_sha256"], self.env["pathname"])
+
         if self.env.get("download_changed", None):
             # store download info for checking for existing download
             self.store_download_info_json(download_dictionary)
@@ -16,13 +16,364 @@
 # limitations under the License.
 """See docstring for URLGetter class"""
 
+import hashlib
+import json
 import os.path
+import random
+import re
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
-from autopkglib import Processor, ProcessorError, find_binary, is_windows
+from autopkglib import (
+    Processor,
+    ProcessorError,
+    find_binary,
+    get_pref,
+    is_windows,
+    log_err,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 __all__ = ["URLGetter"]
 
+# Bytes read from curl at a time when streaming its output
+CURL_CHUNK_SIZE = 64 * 1024
+# Seconds a cached response stays fresh, unless URL_RESPONSE_CACHE_TTL is set
+DEFAULT_RESPONSE_CACHE_TTL = 300
+# Multipliers for the suffixes accepted in DOWNLOAD_BANDWIDTH_LIMIT, as in curl
+RATE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+# Seconds of DOWNLOAD_BANDWIDTH_LIMIT that transfers may use in a burst
+BANDWIDTH_BURST = 0.25
+# Seconds between checks of how much a throttled curl has written
+THROTTLE_INTERVAL = 0.05
+# Defaults for retrying failed curl commands, unless overridden with the
+# DOWNLOAD_RETRY_* preferences
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+DEFAULT_RETRY_MAX_DELAY = 30.0
+# HTTP status codes worth retrying, whether or not curl is run with --fail
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# curl exit codes for transient failures: resolving or connecting to the
+# host, partial transfers, timeouts, SSL handshakes and dropped connections
+RETRY_EXIT_CODES = (5, 6, 7, 16, 18, 28, 35, 52, 55, 56, 92)
+
+
+def parse_rate(value) -> int:
+    """Return a bytes per second rate given as a number or with a K, M or G
+    suffix, as curl's --limit-rate accepts."""
+    value = str(value or "0").strip().upper()
+    multiplier = RATE_SUFFIXES.get(value[-1:], 1)
+    if value[-1:] in RATE_SUFFIXES:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError as err:
+        raise ProcessorError(f"Invalid download bandwidth limit: {value}") from err
+
+
+def curl_url(curl_cmd) -> str:
+    """Return the URL a curl command requests."""
+    if "--url" in curl_cmd:
+        return curl_cmd[curl_cmd.index("--url") + 1]
+    return next((arg for arg in reversed(curl_cmd) if "://" in arg), "")
+
+
+def curl_header_dump(curl_cmd) -> str | None:
+    """Return where a curl command dumps response headers, with "-" meaning
+    its output, if anywhere."""
+    if "-i" in curl_cmd or "--include" in curl_cmd:
+        return "-"
+    for option in ("--dump-header", "-D"):
+        if option in curl_cmd[:-1]:
+            return curl_cmd[curl_cmd.index(option) + 1]
+    return None
+
+
+@contextmanager
+def dumped_headers(curl_cmd) -> Iterator[tuple[list[str], Callable]]:
+    """Yield curl_cmd, made to dump response headers to a temporary file if
+    it doesn't dump them already, and a function that returns the headers
+    given the command's output so far."""
+
+    def read_file(path):
+        try:
+            with open(path, errors="ignore") as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def read_output(output):
+        if isinstance(output, bytes):
+            return output.decode(errors="ignore")
+        return output or ""
+
+    target = curl_header_dump(curl_cmd)
+    if target == "-":
+        yield curl_cmd, read_output
+    elif target:
+        yield curl_cmd, lambda _: read_file(target)
+    else:
+        fd, path = tempfile.mkstemp(prefix="autopkg-headers-")
+        os.close(fd)
+        try:
+            yield curl_cmd + ["--dump-header", path], lambda _: read_file(path)
+        finally:
+            os.unlink(path)
+
+
+def curl_output_file(curl_cmd) -> str | None:
+    """Return the file a curl command writes its output to, if any."""
+    for option in ("--output", "-o"):
+        if option in curl_cmd[:-1]:
+            return curl_cmd[curl_cmd.index(option) + 1]
+    return None
+
+
+class URLResponseCache:
+    """On-disk cache of text responses, scoped to a single AutoPkg run.
+
+    Entries live in CACHE_DIR/URLResponses/<run id>, so every recipe in a run
+    (and any other autopkg process given the same AUTOPKG_RUN_ID) shares them.
+    Each entry is keyed by the whole curl command, which covers the URL,
+    request headers and curl options."""
+
+    def __init__(self, run_id: str, cache_dir: str | None = None, ttl=None):
+        if not cache_dir:
+            cache_dir = get_pref("CACHE_DIR") or "~/Library/AutoPkg/Cache"
+        self.root = os.path.join(os.path.expanduser(cache_dir), "URLResponses")
+        self.cache_dir = os.path.join(self.root, run_id)
+        self.ttl = DEFAULT_RESPONSE_CACHE_TTL if ttl is None else float(ttl)
+
+    @staticmethod
+    def key(curl_cmd: list[str]) -> str:
+        """Return the cache key for a curl command."""
+        return hashlib.sha256(json.dumps(curl_cmd).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response for key if it hasn't expired."""
+        path = os.path.join(self.cache_dir, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, content: str) -> None:
+        """Store a response."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                f.write(content)
+            os.replace(f.name, os.path.join(self.cache_dir, key))
+        except OSError as err:
+            log_err(f"Couldn't write URL response cache: {err}")
+
+    def lock(self, key: str):
+        """Return an open lock file held exclusively for key, or None.
+
+        Holding the lock while fetching makes concurrent processes wait for
+        the first fetch instead of repeating it."""
+        if fcntl is None:
+            return None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            lock_file = open(os.path.join(self.cache_dir, f"{key}.lock"), "w")
+        except OSError:
+            return None
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def clear(self) -> None:
+        """Remove every response cached for this run."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def prune(self, max_age: float = 86400) -> None:
+        """Remove caches left behind by runs that ended more than max_age ago."""
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if time.time() - entry.stat().st_mtime > max_age:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                pass
+
+
+class RetryPolicy:
+    """Decides whether a failed curl command is run again, and how long to
+    wait first.
+
+    Delays grow exponentially from backoff seconds with full jitter, capped
+    at max_delay. A Retry-After header in the failed response sets the
+    minimum delay, within the same cap."""
+
+    def __init__(
+        self,
+        attempts=DEFAULT_RETRY_ATTEMPTS,
+        backoff=DEFAULT_RETRY_BACKOFF,
+        max_delay=DEFAULT_RETRY_MAX_DELAY,
+        status_codes=RETRY_STATUS_CODES,
+        exit_codes=RETRY_EXIT_CODES,
+    ):
+        self.attempts = max(1, int(attempts))
+        self.backoff = float(backoff)
+        self.max_delay = float(max_delay)
+        self.status_codes = self.codes(status_codes)
+        self.exit_codes = self.codes(exit_codes)
+
+    @staticmethod
+    def codes(value) -> set[int]:
+        """Return a set of codes given as a list or a comma-separated string."""
+        if isinstance(value, str):
+            value = value.replace(",", " ").split()
+        return {int(code) for code in value}
+
+    @staticmethod
+    def status_code(headers: str, stderr: str = "") -> int | None:
+        """Return the HTTP status of the last response in headers, or the one
+        curl --fail reported in stderr, if any."""
+        statuses = re.findall(r"(?m)^HTTP/[\d.]+ (\d{3})", headers or "")
+        if statuses:
+            return int(statuses[-1])
+        match = re.search(r"returned error: (\d{3})", stderr or "")
+        return int(match.group(1)) if match else None
+
+    def reason(self, returncode: int, stderr: str, headers: str = "") -> str | None:
+        """Return why a request is worth retrying, or None if it isn't."""
+        status = self.status_code(headers, stderr)
+        if status in self.status_codes:
+            return f"HTTP {status}"
+        if returncode == 22:
+            return None
+        if returncode in self.exit_codes:
+            return f"curl exit code {returncode}"
+        return None
+
+    @staticmethod
+    def retry_after(headers: str) -> float:
+        """Return the seconds requested by the last Retry-After header in
+        headers, or 0."""
+        values = re.findall(r"(?im)^retry-after:\s*(.+?)\s*$", headers or "")
+        if not values:
+            return 0
+        try:
+            return max(0.0, float(values[-1]))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(values[-1]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+
+    def delay(self, attempt: int, headers: str = "") -> float:
+        """Return the seconds to wait before the attempt after this one."""
+        delay = random.uniform(
+            0, min(self.max_delay, self.backoff * 2 ** (attempt - 1))
+        )
+        return min(self.max_delay, max(delay, self.retry_after(headers)))
+
+
+class DownloadScheduler:
+    """Limits transfers across every autopkg process sharing a CACHE_DIR.
+
+    At most max_per_host transfers to one host run at once; further requests
+    for that host queue on a lock and take slots as they free up. The
+    bandwidth limit (bytes per second) is a token bucket shared through a
+    file: transfers take tokens for the bytes they receive and pause while the
+    bucket is empty, so the total stays within the limit as transfers start
+    and finish. Each curl is also passed the whole limit as --limit-rate.
+    Locks are held with flock, so slots held by a process that dies are
+    released with it."""
+
+    def __init__(self, cache_dir=None, max_per_host=0, bandwidth=0):
+        if not cache_dir:
+            cache_dir = get_pref("CACHE_DIR") or "~/Library/AutoPkg/Cache"
+        self.root = os.path.join(os.path.expanduser(cache_dir), "DownloadScheduler")
+        self.max_per_host = max_per_host
+        self.bandwidth = bandwidth
+
+    def lock_file(self, *path_parts, blocking=True):
+        """Open and lock a file under root, returning it or None if it's
+        locked and blocking is False."""
+        path = os.path.join(self.root, *path_parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_file = open(path, "a+")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def acquire_slot(self, host: str):
+        """Wait for a free connection slot for host and return its lock."""
+        host_key = hashlib.sha256(host.encode()).hexdigest()[:16]
+        delay = 0.05
+        with self.lock_file(host_key, "queue"):
+            while True:
+                for index in range(self.max_per_host):
+                    slot = self.lock_file(host_key, f"slot{index}", blocking=False)
+                    if slot:
+                        return slot
+                time.sleep(delay)
+                delay = min(delay * 2, 1)
+
+    def consume(self, nbytes: int) -> float:
+        """Take nbytes from the bandwidth token bucket and return the seconds
+        the transfer should pause for the total rate to stay within the
+        bandwidth limit."""
+        capacity = self.bandwidth * BANDWIDTH_BURST
+        with self.lock_file("bandwidth") as bucket:
+            bucket.seek(0)
+            now = time.time()
+            try:
+                tokens, last = (float(value) for value in bucket.read().split())
+                tokens = min(capacity, tokens + max(0, now - last) * self.bandwidth)
+            except ValueError:
+                tokens = capacity
+            tokens -= nbytes
+            bucket.truncate(0)
+            bucket.write(f"{tokens} {now}")
+        return max(0.0, -tokens / self.bandwidth)
+
+    @contextmanager
+    def transfer(self, url: str) -> Iterator[dict]:
+        """Wait until a transfer from url may start, then yield its record
+        with 'host', 'queue_wait' and 'limit_rate' keys. With a bandwidth
+        limit, its 'throttle' is called with the bytes received and returns
+        the seconds to pause."""
+        host = urlsplit(url).netloc or "localhost"
+        start = time.monotonic()
+        slot = self.acquire_slot(host) if self.max_per_host else None
+        record = {"host": host, "limit_rate": self.bandwidth, "throttle": None}
+        if self.bandwidth:
+            record["throttle"] = self.consume
+        try:
+            record["queue_wait"] = time.monotonic() - start
+            yield record
+        finally:
+            if slot:
+                slot.close()
+
 
 class URLGetter(Processor):
     """Handles curl HTTP operations. Serves only as superclass. Not for direct use."""
@@ -33,6 +384,8 @@ class URLGetter(Processor):
         super().__init__(env, infile, outfile)
         if not self.env:
             self.env = {}
+        self.download_metrics = {}
+        self.download_retries = []
 
     def curl_binary(self) -> str:
         """Return a path to a curl binary, priority in the order below.
@@ -167,22 +520,203 @@ class URLGetter(Processor):
                     self.clear_header(header)
         return header
 
+    def download_scheduler(self) -> DownloadScheduler | None:
+        """Return the scheduler for this processor's transfers, or None if
+        neither DOWNLOAD_MAX_PER_HOST nor DOWNLOAD_BANDWIDTH_LIMIT is set."""
+        max_per_host = int(self.env.get("DOWNLOAD_MAX_PER_HOST") or 0)
+        bandwidth = parse_rate(self.env.get("DOWNLOAD_BANDWIDTH_LIMIT"))
+        if fcntl is None or (max_per_host <= 0 and bandwidth <= 0):
+            return None
+        return DownloadScheduler(
+            self.env.get("CACHE_DIR"), max(max_per_host, 0), max(bandwidth, 0)
+        )
+
+    @contextmanager
+    def scheduled_transfer(self, curl_cmd) -> Iterator[dict]:
+        """Wait until the download scheduler lets curl_cmd run, then yield a
+        record whose 'curl_cmd' is the command to run. Callers set 'bytes' to
+        the size of the output when it isn't written to a file."""
+        scheduler = self.download_scheduler()
+        if scheduler is None:
+            yield {"curl_cmd": curl_cmd}
+            return
+        with scheduler.transfer(curl_url(curl_cmd)) as record:
+            if record["limit_rate"]:
+                curl_cmd = curl_cmd + ["--limit-rate", str(record["limit_rate"])]
+            record.update(curl_cmd=curl_cmd, bytes=0)
+            start = time.monotonic()
+            try:
+                yield record
+            finally:
+                record["seconds"] = time.monotonic() - start
+                output_file = curl_output_file(curl_cmd)
+                if output_file and os.path.isfile(output_file):
+                    record["bytes"] = os.path.getsize(output_file)
+                self.record_transfer(record)
+
+    def record_transfer(self, record) -> None:
+        """Add a scheduled transfer to this processor's download metrics and
+        report them in the run summary."""
+        metrics = self.download_metrics.setdefault(
+            record["host"], {"requests": 0, "bytes": 0, "seconds": 0, "queue_wait": 0}
+        )
+        metrics["requests"] += 1
+        for key in ("bytes", "seconds", "queue_wait"):
+            metrics[key] += record[key]
+        self.output(
+            f"Transfer from {record['host']} waited {record['queue_wait']:.2f}s "
+            f"and took {record['seconds']:.2f}s",
+            verbose_level=2,
+        )
+
+        hosts = sorted(self.download_metrics)
+        self.env["download_scheduler_summary_result"] = {
+            "summary_text": "The following downloads were scheduled:",
+            "report_fields": ["hosts", "requests", "queue_wait", "throughput"],
+            "data": {
+                "hosts": ", ".join(hosts),
+                "requests": str(
+                    sum(m["requests"] for m in self.download_metrics.values())
+                ),
+                "queue_wait": ", ".join(
+                    f"{self.download_metrics[h]['queue_wait']:.1f}s" for h in hosts
+                ),
+                "throughput": ", ".join(
+                    f"{m['bytes'] / max(m['seconds'], 0.001) / 1024**2:.2f} MB/s"
+                    for m in (self.download_metrics[h] for h in hosts)
+                ),
+            },
+        }
+
+    def retry_policy(self) -> RetryPolicy:
+        """Return the retry policy set by the DOWNLOAD_RETRY_* preferences."""
+        settings = {
+            "attempts": "DOWNLOAD_RETRY_ATTEMPTS",
+            "backoff": "DOWNLOAD_RETRY_BACKOFF",
+            "max_delay": "DOWNLOAD_RETRY_MAX_DELAY",
+            "status_codes": "DOWNLOAD_RETRY_STATUS_CODES",
+            "exit_codes": "DOWNLOAD_RETRY_EXIT_CODES",
+        }
+        options = {}
+        for option, name in settings.items():
+            value = self.env[name] if name in self.env else get_pref(name)
+            if value is not None:
+                options[option] = value
+        try:
+            return RetryPolicy(**options)
+        except (TypeError, ValueError) as err:
+            raise ProcessorError(f"Invalid download retry setting: {err}") from err
+
+    def record_retry(self, curl_cmd, attempt: int, reason: str, delay: float) -> None:
+        """Record a retried curl command and report retries in the run
+        summary."""
+        url = curl_url(curl_cmd)
+        self.output(
+            f"Retrying {url} in {delay:.1f}s after attempt {attempt} failed "
+            f"({reason})"
+        )
+        self.download_retries.append({"url": url, "reason": reason, "delay": delay})
+        self.env["download_retries_summary_result"] = {
+            "summary_text": "The following downloads were retried:",
+            "report_fields": ["retries", "reasons", "delay"],
+            "data": {
+                "retries": str(len(self.download_retries)),
+                "reasons": ", ".join(
+                    sorted({retry["reason"] for retry in self.download_retries})
+                ),
+                "delay": f"{sum(r['delay'] for r in self.download_retries):.1f}s",
+            },
+        }
+
     def execute_curl(self, curl_cmd, text=True) -> tuple[str, str, int]:
-        """Execute curl command. Return stdout, stderr and return code."""
+        """Execute curl command, retrying transient failures and retryable
+        HTTP statuses, with or without --fail. Return stdout, stderr and
+        return code."""
+        policy = self.retry_policy()
+        attempt = 1
+        while True:
+            stdout, stderr, returncode, headers = self.execute_curl_attempt(
+                curl_cmd, text
+            )
+            error = stderr if text else (stderr or b"").decode(errors="ignore")
+            reason = policy.reason(returncode, error or "", headers)
+            if reason is None or attempt >= policy.attempts:
+                if returncode:
+                    self.output(f"ERROR: {error.removeprefix('curl: ')}")
+                    raise ProcessorError(error)
+                return stdout, stderr, returncode
+            delay = policy.delay(attempt, headers)
+            self.record_retry(curl_cmd, attempt, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def execute_curl_attempt(self, curl_cmd, text=True) -> tuple[str, str, int, str]:
+        """Run curl command once. Return stdout, stderr, return code and the
+        response headers."""
         errors = "ignore" if text else None
-        try:
+        with (
+            dumped_headers(curl_cmd) as (curl_cmd, read_headers),
+            self.scheduled_transfer(curl_cmd) as transfer,
+        ):
+            curl_cmd = transfer["curl_cmd"]
+            throttle = transfer.get("throttle")
+            output_file = curl_output_file(curl_cmd)
+            if throttle and output_file:
+                proc = subprocess.Popen(
+                    curl_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=text,
+                    errors=errors,
+                )
+                stopped = threading.Event()
+                governor = threading.Thread(
+                    target=self.throttle_output_file,
+                    args=(proc, output_file, throttle, stopped),
+                    daemon=True,
+                )
+                governor.start()
+                try:
+                    stdout, stderr = proc.communicate()
+                finally:
+                    stopped.set()
+                    governor.join()
+                return stdout, stderr, proc.returncode, read_headers(stdout)
             result = subprocess.run(
                 curl_cmd,
                 shell=False,
                 capture_output=True,
-                check=True,
+                check=False,
                 text=text,
                 errors=errors,
             )
-        except subprocess.CalledProcessError as e:
-            self.output(f"ERROR: {e.stderr.removeprefix('curl: ')}")
-            raise ProcessorError(e.stderr) from e
-        return result.stdout, result.stderr, result.returncode
+            transfer["bytes"] = len(result.stdout)
+            if throttle:
+                # Received before it could be throttled; later transfers wait
+                # for it instead.
+                throttle(len(result.stdout))
+            headers = read_headers(result.stdout)
+        return result.stdout, result.stderr, result.returncode, headers
+
+    @staticmethod
+    def throttle_output_file(proc, output_file, throttle, stopped) -> None:
+        """Take tokens for what curl writes to output_file, pausing curl with
+        SIGSTOP while the bandwidth limit is used up."""
+        written = 0
+        while not stopped.wait(THROTTLE_INTERVAL):
+            try:
+                size = os.path.getsize(output_file)
+            except OSError:
+                continue
+            if size < written:
+                # curl truncated the file to start over
+                written = 0
+            pause = throttle(size - written)
+            written = size
+            if pause:
+                proc.send_signal(signal.SIGSTOP)
+                time.sleep(pause)
+                proc.send_signal(signal.SIGCONT)
 
     def download_with_curl(self, curl_cmd, text=True) -> str:
         """Launch curl, return its output, and handle failures."""
@@ -193,6 +727,120 @@ class URLGetter(Processor):
             raise ProcessorError(f"curl failure: {curl_err} (exit code {retcode})")
         return proc_stdout
 
+    def response_cache(self) -> URLResponseCache | None:
+        """Return the cache for this run's text responses, or None if the
+        processor isn't running as part of an autopkg run or caching is off."""
+        run_id = self.env.get("RUN_ID")
+        ttl = self.env.get("URL_RESPONSE_CACHE_TTL", DEFAULT_RESPONSE_CACHE_TTL)
+        try:
+            ttl = float(ttl)
+        except (TypeError, ValueError):
+            ttl = DEFAULT_RESPONSE_CACHE_TTL
+        if not run_id or ttl <= 0:
+            return None
+        return URLResponseCache(run_id, self.env.get("CACHE_DIR"), ttl)
+
+    def download_with_curl_cached(self, curl_cmd) -> str:
+        """Like download_with_curl, but reuse the text response to an identical
+        curl command made earlier in the same run."""
+        cache = self.response_cache()
+        if cache is None:
+            return self.download_with_curl(curl_cmd)
+        key = cache.key(curl_cmd)
+        lock = cache.lock(key)
+        try:
+            content = cache.get(key)
+            if content is not None:
+                self.output(
+                    f"Using response cached earlier in this run for {curl_cmd[-1]}",
+                    verbose_level=2,
+                )
+                return content
+            content = self.download_with_curl(curl_cmd)
+            cache.put(key, content)
+            return content
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def iter_curl_output(self, curl_cmd, chunk_size=CURL_CHUNK_SIZE) -> Iterator[bytes]:
+        """Launch curl and yield its output as it arrives. Closing the generator
+        before the output ends stops curl. Transient failures and retryable
+        HTTP statuses are retried until the first output has been yielded."""
+        self.output(f"Curl command: {curl_cmd}", verbose_level=4)
+        policy = self.retry_policy()
+        attempt = 1
+        while True:
+            # The last attempt yields whatever the server responds with
+            retry_statuses = policy.status_codes if attempt < policy.attempts else ()
+            output = self.iter_curl_output_attempt(curl_cmd, chunk_size, retry_statuses)
+            yielded = False
+            try:
+                for chunk in output:
+                    yielded = True
+                    yield chunk
+                return
+            except subprocess.CalledProcessError as e:
+                curl_err = self.parse_curl_error(e.stderr)
+                headers = e.output or ""
+                reason = policy.reason(e.returncode, e.stderr, headers)
+                if yielded or reason is None or attempt >= policy.attempts:
+                    raise ProcessorError(
+                        f"curl failure: {curl_err} (exit code {e.returncode})"
+                    ) from e
+            finally:
+                output.close()
+            delay = policy.delay(attempt, headers)
+            self.record_retry(curl_cmd, attempt, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def iter_curl_output_attempt(
+        self, curl_cmd, chunk_size, retry_statuses=()
+    ) -> Iterator[bytes]:
+        """Run curl once, yielding its output and raising CalledProcessError
+        with the response headers as its output if it fails. A response with
+        one of retry_statuses is treated as a failure before it's yielded."""
+        with (
+            dumped_headers(curl_cmd) as (curl_cmd, read_headers),
+            self.scheduled_transfer(curl_cmd) as transfer,
+            tempfile.TemporaryFile() as stderr,
+        ):
+            proc = subprocess.Popen(
+                transfer["curl_cmd"], stdout=subprocess.PIPE, stderr=stderr
+            )
+            finished = retrying = False
+            first_chunk = b""
+            try:
+                throttle = transfer.get("throttle")
+                while chunk := proc.stdout.read1(chunk_size):
+                    if not first_chunk:
+                        # curl writes the headers before the body
+                        first_chunk = chunk
+                        status = RetryPolicy.status_code(read_headers(chunk))
+                        if status in retry_statuses:
+                            retrying = True
+                            break
+                    transfer["bytes"] = transfer.get("bytes", 0) + len(chunk)
+                    if throttle and (pause := throttle(len(chunk))):
+                        # curl blocks on the full pipe while we wait
+                        time.sleep(pause)
+                    yield chunk
+                finished = True
+            finally:
+                if not finished:
+                    proc.terminate()
+                proc.stdout.close()
+                proc.wait()
+            if proc.returncode or retrying:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(
+                    proc.returncode,
+                    transfer["curl_cmd"],
+                    output=read_headers(first_chunk),
+                    stderr=stderr.read().decode(errors="ignore"),
+                )
+
     def download(self, url, headers=None, text=False) -> str:
         """Download content with default curl options."""
         curl_cmd = self.prepare_curl_cmd()
@@ -17,6 +17,8 @@
 # limitations under the License.
 """See docstring for URLTextSearcher class"""
 
+import codecs
+import functools
 import re
 
 from autopkglib import ProcessorError
@@ -24,10 +26,19 @@ from autopkglib.URLGetter import URLGetter
 
 MATCH_MESSAGE = "Found matching text"
 NO_MATCH_MESSAGE = "No match found on URL"
+# Characters kept between windows when stream_search is set
+DEFAULT_STREAM_OVERLAP = 4096
 
 __all__ = ["URLTextSearcher"]
 
 
+@functools.lru_cache(maxsize=256)
+def compile_pattern(pattern: str, flags: int) -> re.Pattern:
+    """Return a compiled regular expression, shared by every search in the
+    process."""
+    return re.compile(pattern, flags=flags)
+
+
 class URLTextSearcher(URLGetter):
     """Downloads a URL using curl and performs a regular expression match
     on the text."""
@@ -73,6 +84,25 @@ class URLTextSearcher(URLGetter):
                 "expression flags. E.g. IGNORECASE."
             ),
         },
+        "stream_search": {
+            "required": False,
+            "description": (
+                "Boolean value to search the page while it is downloaded, "
+                "stopping the download as soon as a match is found. Useful for "
+                "very large pages. Streamed pages aren't shared with other "
+                "recipes in the run."
+            ),
+            "default": False,
+        },
+        "stream_search_overlap": {
+            "required": False,
+            "description": (
+                "Number of characters carried over between the windows searched "
+                "when 'stream_search' is set. Matches longer than this may be "
+                f"missed or cut short. Defaults to {DEFAULT_STREAM_OVERLAP}."
+            ),
+            "default": DEFAULT_STREAM_OVERLAP,
+        },
     }
     output_variables = {
         "result_output_var_name": {
@@ -100,18 +130,45 @@ class URLTextSearcher(URLGetter):
                 flag_accumulator += re.__dict__[flag]
         return flag_accumulator
 
-    def re_search(self, content) -> tuple[str, dict[str, str]] | None:
-        """Search for re_pattern in content"""
-
-        re_pattern = re.compile(self.env["re_pattern"], flags=self.prepare_re_flags())
-        match = re_pattern.search(content)
+    def compiled_pattern(self) -> re.Pattern:
+        """Return re_pattern compiled with re_flags."""
+        return compile_pattern(self.env["re_pattern"], self.prepare_re_flags())
 
+    def match_groups(self, match) -> tuple[str, dict[str, str]]:
+        """Return the last matched group with the dict of named groups."""
         if not match:
             raise ProcessorError(f"{NO_MATCH_MESSAGE}: {self.env['url']}")
-
-        # return the last matched group with the dict of named groups
         return (match.group(match.lastindex or 0), match.groupdict())
 
+    def re_search(self, content) -> tuple[str, dict[str, str]] | None:
+        """Search for re_pattern in content"""
+        return self.match_groups(self.compiled_pattern().search(content))
+
+    def stream_search(self, curl_cmd) -> tuple[str, dict[str, str]]:
+        """Search for re_pattern in overlapping windows of the response as it
+        is downloaded, stopping curl at the first match."""
+        pattern = self.compiled_pattern()
+        overlap = int(self.env.get("stream_search_overlap", DEFAULT_STREAM_OVERLAP))
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        window = ""
+        chunks = self.iter_curl_output(curl_cmd)
+        try:
+            for chunk in chunks:
+                window += decoder.decode(chunk)
+                match = pattern.search(window)
+                keep_from = len(window) - overlap
+                if match:
+                    # A match that ends near the end of the window might be
+                    # extended by text that hasn't arrived yet
+                    if match.end() <= keep_from:
+                        return self.match_groups(match)
+                    keep_from = min(keep_from, match.start())
+                window = window[max(keep_from, 0) :]
+            window += decoder.decode(b"", final=True)
+            return self.match_groups(pattern.search(window))
+        finally:
+            chunks.close()
+
     def main(self) -> None:
         output_var_name = self.env["result_output_var_name"]
 
@@ -119,14 +176,22 @@ class URLTextSearcher(URLGetter):
         curl_cmd = self.prepare_curl_cmd()
 
         # Execute curl command and search in content
-        content = self.download_with_curl(curl_cmd)
-        groupmatch, groupdict = self.re_search(content)
+        if self.env.get("stream_search"):
+            groupmatch, groupdict = self.stream_search(curl_cmd)
+        else:
+            content = self.download_with_curl_cached(curl_cmd)
+            groupmatch, groupdict = self.re_search(content)
 
         # favor a named group over a normal group match
         if output_var_name not in groupdict.keys():
             groupdict[output_var_name] = groupmatch
 
-        self.output_variables = {}
+        # Keep any run summary reported while downloading
+        self.output_variables = {
+            key: value
+            for key, value in self.output_variables.items()
+            if key.endswith("_summary_result")
+        }
         for key in groupdict.keys():
             self.env[key] = groupdict[key]
             self.output(f"{MATCH_MESSAGE} ({key}): {self.env[key]}")
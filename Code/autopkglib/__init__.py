@@ -894,6 +894,11 @@ class AutoPackager:
                 # pretty print any defined input variables
                 pprint.pprint({"Input": input_dict})
 
+            summary_results = {
+                key: value
+                for key, value in self.env.items()
+                if key.endswith("_summary_result")
+            }
             try:
                 self.env = processor.process()
             except Exception as err:
@@ -921,6 +926,15 @@ class AutoPackager:
                 #       can dynamically set their output_variables
                 if processor.env.get(key):
                     output_dict[key] = self.env[key]
+            # Summary results set by this step but not declared as output
+            # variables, such as URLGetter's download retries
+            for key, value in self.env.items():
+                if (
+                    key.endswith("_summary_result")
+                    and key not in output_dict
+                    and value is not summary_results.get(key)
+                ):
+                    output_dict[key] = value
             if self.verbose > 1:
                 # pretty print output variables
                 pprint.pprint({"Output": output_dict})
@@ -0,0 +1,273 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Routines for copying files and directory trees, shared by the processors
+that copy items out of disk images and archives.
+
+Each file is cloned where the filesystem supports it (APFS clonefile(2) or
+Linux FICLONE reflinks), and otherwise copied with copy_file_range(2) so the
+kernel moves the data. On macOS a whole directory tree is cloned in a single
+clonefile(2) call. Otherwise the tree is walked once, directories and
+symlinks are created in the calling thread, and file data is copied by a
+bounded thread pool. Modes, timestamps and extended attributes are kept,
+as with shutil.copytree(symlinks=True).
+"""
+
+import ctypes
+import errno
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from autopkglib import xattr
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = [
+    "CopyUnavailable",
+    "clone_file",
+    "copy_item",
+    "copy_tree",
+    "describe_copy",
+    "stream_file",
+]
+
+# Linux ioctl to share a file's extents with another file (a reflink).
+FICLONE = 0x40049409
+
+# Most threads copying file data at once, by default, when copying a tree.
+# No more threads than CPUs are used by default.
+COPY_WORKERS = 8
+
+_libc = None
+
+
+class CopyUnavailable(Exception):
+    """Raised when a copy strategy can't be used for an item."""
+
+    pass
+
+
+def _clonefile():
+    """Returns libc's clonefile(2), or None where it isn't available."""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return getattr(_libc, "clonefile", None)
+
+
+def clone_file(src, dst) -> None:
+    """Clone src to dst without copying data, using clonefile(2) on APFS or
+    a FICLONE reflink on Linux filesystems that support them."""
+    clonefile = _clonefile()
+    if clonefile is not None:
+        if clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise CopyUnavailable(f"clonefile failed: {os.strerror(err)}")
+        return
+    if fcntl is None:
+        raise CopyUnavailable("cloning isn't supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as err:
+            raise CopyUnavailable(f"reflink failed: {err.strerror}") from err
+    shutil.copymode(src, dst)
+
+
+def stream_file(src, dst) -> None:
+    """Copy src to dst, letting the kernel move the data with
+    copy_file_range(2) where it can."""
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        shutil.copy(src, dst)
+        return
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            while copy_file_range(fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL):
+                raise
+            fdst.seek(0)
+            fdst.truncate()
+            fsrc.seek(0)
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copymode(src, dst)
+
+
+def copy_metadata(src, dst) -> None:
+    """Copy the mode, timestamps, flags and extended attributes of src to
+    dst, without following symlinks."""
+    shutil.copystat(src, dst, follow_symlinks=False)
+    if hasattr(os, "listxattr"):
+        # shutil.copystat already copied them
+        return
+    symlink = os.path.islink(dst)
+    for attr in xattr.listxattr(src, symlink=symlink):
+        value = xattr.getxattr(src, attr, symlink=symlink)
+        if value is not None:
+            xattr.setxattr(dst, attr, value, symlink=symlink)
+
+
+class _TreeCopy:
+    """Copies one file or tree, counting what was copied."""
+
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = max(1, workers or min(COPY_WORKERS, os.cpu_count() or 1))
+        self.clone = True
+        self.stats = {"files": 0, "bytes": 0, "cloned": 0, "seconds": 0.0}
+        self.pending = deque()
+        self.executor = None
+
+    def copy_file(self, src, dst) -> bool:
+        """Copy one regular file. Returns True if it was cloned."""
+        cloned = False
+        if self.clone:
+            try:
+                clone_file(src, dst)
+                cloned = True
+            except CopyUnavailable:
+                # every file in a tree is on the same filesystems, so stop
+                # trying once cloning fails
+                self.clone = False
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+        if not cloned:
+            stream_file(src, dst)
+        if not (cloned and _clonefile()):
+            # clonefile(2) already kept the metadata
+            copy_metadata(src, dst)
+        return cloned
+
+    def count(self, size, cloned) -> None:
+        self.stats["files"] += 1
+        self.stats["bytes"] += size
+        self.stats["cloned"] += cloned
+
+    def count_tree(self, top) -> None:
+        """Count the regular files under top."""
+        pending = [top]
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        self.count(entry.stat(follow_symlinks=False).st_size, True)
+
+    def clone_tree(self, src, dst) -> bool:
+        """Clone the whole tree with one clonefile(2) call, if possible."""
+        clonefile = _clonefile()
+        if clonefile is None:
+            return False
+        if clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            return False
+        self.count_tree(dst)
+        return True
+
+    def copy_tree(self, src, dst) -> None:
+        """Copy the tree at src to dst, which must not exist yet."""
+        if self.clone_tree(src, dst):
+            return
+        os.makedirs(dst)
+        directories = [(src, dst)]
+        if self.workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            # directories found while walking are appended to the list
+            for src_dir, dst_dir in directories:
+                with os.scandir(src_dir) as entries:
+                    for entry in sorted(entries, key=lambda e: e.name):
+                        dst_path = os.path.join(dst_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            os.mkdir(dst_path)
+                            directories.append((entry.path, dst_path))
+                        else:
+                            self.copy_entry(entry, dst_path)
+            self.collect(0)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+        # directory timestamps change as their contents are created, so set
+        # them deepest first once everything is copied
+        for src_dir, dst_dir in reversed(directories):
+            copy_metadata(src_dir, dst_dir)
+
+    def copy_entry(self, entry, dst_path) -> None:
+        """Copy a symlink or regular file found while walking a tree."""
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), dst_path)
+            copy_metadata(entry.path, dst_path)
+            return
+        if not entry.is_file():
+            raise shutil.SpecialFileError(f"`{entry.path}` is not a regular file")
+        size = entry.stat().st_size
+        if self.executor is None:
+            self.count(size, self.copy_file(entry.path, dst_path))
+            return
+        future = self.executor.submit(self.copy_file, entry.path, dst_path)
+        self.pending.append((size, future))
+        # bound memory use by collecting finished copies
+        self.collect(self.workers * 4)
+
+    def collect(self, limit) -> None:
+        """Wait for queued file copies until no more than limit remain."""
+        while len(self.pending) > limit:
+            size, future = self.pending.popleft()
+            self.count(size, future.result())
+
+
+def copy_tree(src, dst, workers: int | None = None) -> dict:
+    """Copy the directory tree at src to dst, which must not exist yet.
+    Symlinks are copied as symlinks. File data is copied by up to workers
+    threads. Returns the number of files and bytes copied, how many files
+    were cloned, and the seconds taken."""
+    start = time.monotonic()
+    tree_copy = _TreeCopy(workers)
+    tree_copy.copy_tree(src, dst)
+    tree_copy.stats["seconds"] = time.monotonic() - start
+    return tree_copy.stats
+
+
+def copy_item(src, dst, workers: int | None = None) -> dict:
+    """Copy the file or directory tree at src to dst, like Copier always
+    has: a tree is copied to dst, which must not exist yet, and a file
+    replaces dst, or is copied into dst if it's a directory. Returns the
+    same statistics as copy_tree."""
+    if os.path.isdir(src):
+        return copy_tree(src, dst, workers)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    start = time.monotonic()
+    tree_copy = _TreeCopy(workers)
+    if os.path.lexists(dst):
+        # clonefile(2) won't replace an existing file
+        tree_copy.clone = _clonefile() is None
+    size = os.path.getsize(src)
+    tree_copy.count(size, tree_copy.copy_file(src, dst))
+    tree_copy.stats["seconds"] = time.monotonic() - start
+    return tree_copy.stats
+
+
+def describe_copy(stats) -> str:
+    """Returns a summary of the statistics returned by copy_item."""
+    return (
+        f"Copied {stats['files']} files ({stats['bytes']} bytes, "
+        f"{stats['cloned']} cloned) in {stats['seconds']:.2f} seconds"
+    )
@@ -0,0 +1,852 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Routines for writing and reading flat (xar) installer packages without
+pkgbuild(1) or xar(1).
+
+A component flat package is a xar archive containing:
+
+    Bom          A BOMStore describing every path in the payload.
+    PackageInfo  XML metadata (identifier, version, payload size...).
+    Payload      A gzip-compressed cpio (odc) archive of the package root.
+    Scripts      Optional gzip-compressed cpio archive of install scripts.
+
+The payload is streamed straight from the package root into the compressed
+cpio archive; the package root is never staged or copied. Ownership changes
+requested with "chown" entries are applied to the archive headers rather than
+to files on disk, so no root privileges are needed.
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any
+from xml.etree import ElementTree as ET
+
+try:
+    import grp
+    import pwd
+except ImportError:
+    # Not available on Windows; only numeric and well-known owners resolve.
+    grp = pwd = None
+
+__all__ = [
+    "FlatPackageBuilder",
+    "FlatPackageError",
+    "ParallelDeflateWriter",
+    "ParallelGzipWriter",
+    "XarReader",
+    "posix_cksum",
+]
+
+# Size of uncompressed chunks handed to each compression worker.
+GZIP_CHUNK_SIZE = 1024 * 1024
+# Size of the deflate window used to prime each chunk with its predecessor.
+DEFLATE_WINDOW = 32 * 1024
+# Read size used when streaming files into the payload.
+READ_SIZE = 1024 * 1024
+
+XAR_MAGIC = 0x78617221
+XAR_HEADER = struct.Struct(">IHHQQI")
+XAR_CKSUM_SHA1 = 1
+
+CPIO_MAGIC = b"070707"
+CPIO_TRAILER = "TRAILER!!!"
+# odc headers store the file size in 11 octal digits.
+CPIO_MAX_FILESIZE = 0o77777777777
+# Bom path info stores file sizes and mtimes in 32 bits.
+BOM_MAX_FILESIZE = 0xFFFFFFFF
+
+BOM_TYPE_FILE = 1
+BOM_TYPE_DIR = 2
+BOM_TYPE_LINK = 3
+# Maximum number of path indices that fit in one 4096-byte BOMPaths page.
+BOM_PATHS_PER_PAGE = (4096 - 12) // 8
+
+# The root of the package payload is owned by root:admin, like the temporary
+# pkgroot autopkgserver creates before copying.
+ROOT_UID = 0
+ADMIN_GID = 80
+MACOS_IDS = {"root": 0, "wheel": 0, "admin": 80, "staff": 20}
+
+
+class FlatPackageError(Exception):
+    """Exception class for flat package errors"""
+
+    pass
+
+
+# POSIX cksum(1) is a non-reflected CRC-32. zlib.crc32 computes the reflected
+# variant of the same polynomial, so bit-reversing every input byte (and the
+# final register) yields the POSIX value while keeping the work in C.
+_BITREV8 = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def _bitrev32(value: int) -> int:
+    return int(f"{value:032b}"[::-1], 2)
+
+
+class _PosixCksum:
+    """Incremental POSIX cksum(1) checksum, as stored in Bom files."""
+
+    def __init__(self) -> None:
+        # zlib.crc32 inverts its running value; 0xFFFFFFFF means a zero register.
+        self._crc = 0xFFFFFFFF
+        self.length = 0
+
+    def update(self, data: bytes) -> None:
+        self._crc = zlib.crc32(data.translate(_BITREV8), self._crc)
+        self.length += len(data)
+
+    def value(self) -> int:
+        crc = self._crc
+        length = self.length
+        length_bytes = bytearray()
+        while length:
+            length_bytes.append(length & 0xFF)
+            length >>= 8
+        crc = zlib.crc32(bytes(length_bytes).translate(_BITREV8), crc)
+        return ~_bitrev32(crc ^ 0xFFFFFFFF) & 0xFFFFFFFF
+
+
+def posix_cksum(data: bytes) -> int:
+    """Return the POSIX cksum(1) CRC of data."""
+    cksum = _PosixCksum()
+    cksum.update(data)
+    return cksum.value()
+
+
+class _HashingWriter:
+    """File-like wrapper that tracks the SHA-1 and length of written bytes."""
+
+    def __init__(self, fileobj: IO) -> None:
+        self.fileobj = fileobj
+        self.sha1 = hashlib.sha1()
+        self.length = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha1.update(data)
+        self.length += len(data)
+        return self.fileobj.write(data)
+
+
+def _compress_chunk(data: bytes, zdict: bytes, level: int, last: bool) -> bytes:
+    """Raw-deflate one chunk, primed with the tail of the previous chunk."""
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, 0, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class ParallelDeflateWriter:
+    """Write a raw deflate stream, compressing chunks in parallel.
+
+    Works like pigz: the input is split into chunks that are deflated
+    independently by a thread pool (zlib releases the GIL), each chunk primed
+    with the last 32 KiB of its predecessor and ended with a sync flush so the
+    outputs can simply be concatenated. The CRC and sizes are computed in the
+    writing thread. With workers=1 everything runs in the calling thread.
+    """
+
+    def __init__(
+        self,
+        fileobj: IO,
+        level: int = 6,
+        workers: int | None = None,
+        chunk_size: int = GZIP_CHUNK_SIZE,
+    ) -> None:
+        self.fileobj = fileobj
+        self.level = level
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self._buffer = bytearray()
+        self._zdict = b""
+        self._pending: deque = deque()
+        self._executor = None
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[: self.chunk_size])
+            del self._buffer[: self.chunk_size]
+            self._submit(chunk, last=False)
+        return len(data)
+
+    def _write_compressed(self, data: bytes) -> None:
+        self.compressed_size += len(data)
+        self.fileobj.write(data)
+
+    def _submit(self, chunk: bytes, last: bool) -> None:
+        zdict = self._zdict
+        self._zdict = chunk[-DEFLATE_WINDOW:]
+        if self._executor is None:
+            self._write_compressed(_compress_chunk(chunk, zdict, self.level, last))
+            return
+        self._pending.append(
+            self._executor.submit(_compress_chunk, chunk, zdict, self.level, last)
+        )
+        # Bound memory use by draining completed chunks in order.
+        while len(self._pending) > self.workers * 2:
+            self._write_compressed(self._pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self._write_compressed(self._pending.popleft().result())
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    def __enter__(self) -> "ParallelDeflateWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ParallelGzipWriter(ParallelDeflateWriter):
+    """Write a single-member gzip stream, compressing chunks in parallel with
+    ParallelDeflateWriter."""
+
+    def __init__(self, fileobj: IO, *args, **kwargs) -> None:
+        super().__init__(fileobj, *args, **kwargs)
+        # gzip header: no name, no mtime, OS "unknown"
+        self.fileobj.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+
+
+class _CpioWriter:
+    """Write an odc (070707) cpio archive as used in installer payloads."""
+
+    def __init__(self, fileobj) -> None:
+        self.fileobj = fileobj
+        self._ino = 0
+
+    def _header(self, name: str, mode: int, uid: int, gid: int, mtime: int, size):
+        if size > CPIO_MAX_FILESIZE:
+            raise FlatPackageError(f"{name} is too large for a cpio payload")
+        self._ino += 1
+        encoded = name.encode("utf-8") + b"\0"
+        header = (
+            "%06o%06o%06o%06o%06o%06o%06o%011o%06o%011o"
+            % (
+                0,
+                self._ino & 0o777777,
+                mode & 0o777777,
+                uid & 0o777777,
+                gid & 0o777777,
+                1,
+                0,
+                mtime & 0o77777777777,
+                len(encoded),
+                size,
+            )
+        ).encode()
+        self.fileobj.write(CPIO_MAGIC + header + encoded)
+
+    def add(self, name, mode, uid, gid, mtime, size=0, data=b"") -> None:
+        self._header(name, mode, uid, gid, mtime, size)
+        if data:
+            self.fileobj.write(data)
+
+    def add_file(self, name, mode, uid, gid, mtime, path, size) -> int:
+        """Stream a regular file into the archive; return its POSIX cksum."""
+        self._header(name, mode, uid, gid, mtime, size)
+        cksum = _PosixCksum()
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                cksum.update(data)
+                self.fileobj.write(data)
+        if cksum.length != size:
+            raise FlatPackageError(f"{path} changed size while being archived")
+        return cksum.value()
+
+    def finish(self) -> None:
+        self._header(CPIO_TRAILER, 0, 0, 0, 0, 0)
+
+
+class _BomWriter:
+    """Build a BOMStore ("Bom") file for a list of payload entries."""
+
+    def __init__(self) -> None:
+        # Block 0 is always the null block.
+        self.blocks: list[bytes | None] = [None]
+
+    def add_block(self, data: bytes) -> int:
+        self.blocks.append(data)
+        return len(self.blocks) - 1
+
+    def set_block(self, index: int, data: bytes) -> None:
+        self.blocks[index] = data
+
+    def _tree(self, child: int, block_size: int, path_count: int) -> bytes:
+        return b"tree" + struct.pack(">IIIIB", 1, child, block_size, path_count, 0)
+
+    def _empty_tree(self, block_size: int) -> int:
+        paths = self.add_block(struct.pack(">HHII", 1, 0, 0, 0))
+        return self.add_block(self._tree(paths, block_size, 0))
+
+    def _path_info(self, entry: dict) -> bytes:
+        link = entry.get("link", b"")
+        link_data = link + b"\0" if link else b""
+        return (
+            struct.pack(
+                ">BBHHIIIIBII",
+                entry["type"],
+                1,
+                0,
+                entry["mode"] & 0xFFFF,
+                entry["uid"],
+                entry["gid"],
+                min(max(entry["mtime"], 0), 0xFFFFFFFF),
+                entry["size"],
+                1,
+                entry.get("cksum", 0),
+                len(link_data),
+            )
+            + link_data
+        )
+
+    def _paths_tree(self, entries: list[dict]) -> int:
+        """Store every path and return the block index of the "Paths" tree."""
+        leaves: list[tuple[int, list[tuple[int, int]]]] = []
+        indices: list[tuple[int, int]] = []
+        for path_id, entry in enumerate(entries, start=1):
+            info2 = self.add_block(self._path_info(entry))
+            info1 = self.add_block(struct.pack(">II", path_id, info2))
+            name = self.add_block(
+                struct.pack(">I", entry["parent"]) + entry["name"] + b"\0"
+            )
+            indices.append((info1, name))
+            if len(indices) == BOM_PATHS_PER_PAGE:
+                leaves.append((self.add_block(b""), indices))
+                indices = []
+        if indices or not leaves:
+            leaves.append((self.add_block(b""), indices))
+
+        for position, (block, leaf_indices) in enumerate(leaves):
+            forward = leaves[position + 1][0] if position + 1 < len(leaves) else 0
+            backward = leaves[position - 1][0] if position else 0
+            data = struct.pack(">HHII", 1, len(leaf_indices), forward, backward)
+            data += b"".join(struct.pack(">II", *pair) for pair in leaf_indices)
+            self.set_block(block, data)
+
+        if len(leaves) == 1:
+            root = leaves[0][0]
+        else:
+            # A single branch page keyed by the last path of each leaf.
+            if len(leaves) > BOM_PATHS_PER_PAGE:
+                raise FlatPackageError("Too many paths for a Bom file")
+            data = struct.pack(">HHII", 0, len(leaves), 0, 0)
+            data += b"".join(
+                struct.pack(">II", block, leaf_indices[-1][1])
+                for block, leaf_indices in leaves
+            )
+            root = self.add_block(data)
+        return self.add_block(self._tree(root, 4096, len(entries)))
+
+    def build(self, entries: list[dict]) -> bytes:
+        variables = []
+        info = struct.pack(">III", 1, len(entries) + 1, 1) + bytes(16)
+        variables.append(("BomInfo", self.add_block(info)))
+        variables.append(("Paths", self._paths_tree(entries)))
+        variables.append(("HLIndex", self._empty_tree(4096)))
+        vtree = self._empty_tree(128)
+        variables.append(
+            ("VIndex", self.add_block(struct.pack(">IIIB", 1, vtree, 0, 0)))
+        )
+        variables.append(("Size64", self._empty_tree(128)))
+
+        vars_data = struct.pack(">I", len(variables)) + b"".join(
+            struct.pack(">IB", index, len(name)) + name.encode()
+            for name, index in variables
+        )
+
+        header_size = 512
+        body = bytearray()
+        pointers = []
+        for block in self.blocks:
+            if block is None:
+                pointers.append((0, 0))
+                continue
+            pointers.append((header_size + len(body), len(block)))
+            body += block
+        vars_offset = header_size + len(body)
+        index_offset = vars_offset + len(vars_data)
+        index_data = struct.pack(">I", len(pointers)) + b"".join(
+            struct.pack(">II", *pointer) for pointer in pointers
+        )
+        # An (empty) free list follows the block table.
+        index_data += struct.pack(">I", 2) + bytes(16)
+
+        header = b"BOMStore" + struct.pack(
+            ">IIIIII",
+            1,
+            len(self.blocks) - 1,
+            index_offset,
+            len(index_data),
+            vars_offset,
+            len(vars_data),
+        )
+        header += bytes(header_size - len(header))
+        return header + bytes(body) + vars_data + index_data
+
+
+class _ChownMap:
+    """Resolve the owner and mode to archive for each payload path, applying
+    chown request entries the same way autopkgserver's Packager does."""
+
+    def __init__(self, chown_entries: list[dict]) -> None:
+        self.entries = []
+        for entry in chown_entries:
+            path = entry["path"].strip("/")
+            if not path or any(part in (".", "..") for part in path.split("/")):
+                raise FlatPackageError(f"Invalid chown path {entry['path']}")
+            uid = self._resolve(entry["user"], "user")
+            gid = self._resolve(entry["group"], "group")
+            mode = int(entry["mode"], 8) if "mode" in entry else None
+            self.entries.append((path, uid, gid, mode))
+
+    def verify(self, root: str) -> None:
+        """Check that every chown path exists in root, without passing through
+        a symlink, as autopkgserver's Packager requires."""
+        for path, _, _, _ in self.entries:
+            checkpath = root
+            for part in path.split("/"):
+                checkpath = os.path.join(checkpath, part)
+                relpath = os.path.relpath(checkpath, root)
+                if not os.path.lexists(checkpath):
+                    raise FlatPackageError(f"chown path {relpath} does not exist")
+                if os.path.islink(checkpath):
+                    raise FlatPackageError(f"chown path {relpath} is a soft link")
+
+    @staticmethod
+    def _resolve(value, kind) -> int:
+        if not isinstance(value, str):
+            return int(value)
+        # The package is installed on macOS, so well-known macOS names win over
+        # whatever the build host's account databases say.
+        if value in MACOS_IDS:
+            return MACOS_IDS[value]
+        try:
+            if kind == "user" and pwd is not None:
+                return pwd.getpwnam(value).pw_uid
+            if kind == "group" and grp is not None:
+                return grp.getgrnam(value).gr_gid
+        except KeyError:
+            pass
+        raise FlatPackageError(f"Unknown chown {kind} {value}")
+
+    def apply(self, relpath: str, uid: int, gid: int, mode: int) -> tuple:
+        for path, entry_uid, entry_gid, entry_mode in self.entries:
+            if relpath == path:
+                uid, gid = entry_uid, entry_gid
+                # Packager only changes the mode of the entry itself for files.
+                if entry_mode is not None and not stat.S_ISDIR(mode):
+                    mode = stat.S_IFMT(mode) | entry_mode
+            elif relpath.startswith(path + "/"):
+                uid, gid = entry_uid, entry_gid
+                if entry_mode is not None:
+                    mode = stat.S_IFMT(mode) | entry_mode
+        return uid, gid, mode
+
+
+class FlatPackageBuilder:
+    """Build a component flat package from an autopkgserver package request.
+
+    The request dictionary uses the same keys as autopkgserver requests
+    (pkgroot, pkgdir, pkgname, id, version, infofile, chown, scripts).
+    """
+
+    def __init__(
+        self,
+        request: dict[str, Any],
+        log=None,
+        compression_level: int = 6,
+        workers: int | None = None,
+    ) -> None:
+        self.request = request
+        self.log = log or (lambda msg, verbose_level=1: None)
+        self.compression_level = compression_level
+        self.workers = workers
+
+    def _walk(self, root: str):
+        """Yield (relpath, fullpath, lstat) for root and its contents, parents
+        before children, siblings sorted by name."""
+        yield "", root, os.lstat(root)
+        stack = [("", root)]
+        while stack:
+            relpath, path = stack.pop()
+            with os.scandir(path) as it:
+                children = sorted(it, key=lambda e: e.name)
+            subdirs = []
+            for child in children:
+                child_rel = f"{relpath}/{child.name}" if relpath else child.name
+                info = child.stat(follow_symlinks=False)
+                yield child_rel, child.path, info
+                if stat.S_ISDIR(info.st_mode):
+                    subdirs.append((child_rel, child.path))
+            # Depth-first, in sorted order.
+            stack.extend(reversed(subdirs))
+
+    def write_cpio(
+        self, root: str, fileobj: IO, chown: _ChownMap | None = None
+    ) -> tuple[list[dict], int]:
+        """Stream root into fileobj as a cpio archive.
+
+        Returns the Bom entries for every archived path and the total size of
+        the archived files in bytes."""
+        cpio = _CpioWriter(fileobj)
+        entries: list[dict] = []
+        ids: dict[str, int] = {}
+        total_size = 0
+        for relpath, path, info in self._walk(root):
+            mode = info.st_mode
+            if relpath:
+                uid, gid = info.st_uid, info.st_gid
+            else:
+                uid, gid = ROOT_UID, ADMIN_GID
+            if chown is not None:
+                uid, gid, mode = chown.apply(relpath, uid, gid, mode)
+            name = f"./{relpath}" if relpath else "."
+            mtime = int(info.st_mtime)
+            entry = {
+                "parent": ids.get(os.path.dirname(relpath), 0) if relpath else 0,
+                "name": (os.path.basename(relpath) or ".").encode("utf-8"),
+                "mode": mode,
+                "uid": uid,
+                "gid": gid,
+                "mtime": mtime,
+                "size": 0,
+            }
+            if stat.S_ISDIR(mode):
+                entry["type"] = BOM_TYPE_DIR
+                cpio.add(name, mode, uid, gid, mtime)
+            elif stat.S_ISLNK(mode):
+                target = os.readlink(path).encode("utf-8")
+                entry.update(
+                    type=BOM_TYPE_LINK,
+                    size=len(target),
+                    cksum=posix_cksum(target),
+                    link=target,
+                )
+                cpio.add(name, mode, uid, gid, mtime, len(target), target)
+            elif stat.S_ISREG(mode):
+                if info.st_size > BOM_MAX_FILESIZE:
+                    raise FlatPackageError(
+                        f"{path} is too large for a flat package Bom "
+                        f"({info.st_size} bytes)"
+                    )
+                entry.update(
+                    type=BOM_TYPE_FILE,
+                    size=info.st_size,
+                    cksum=cpio.add_file(
+                        name, mode, uid, gid, mtime, path, info.st_size
+                    ),
+                )
+                total_size += info.st_size
+            else:
+                raise FlatPackageError(f"Unsupported file type at {path}")
+            entries.append(entry)
+            ids[relpath] = len(entries)
+        cpio.finish()
+        return entries, total_size
+
+    def _compressed_cpio(self, root, output, chown=None):
+        """Write a gzip-compressed cpio archive of root to output."""
+        hashed = _HashingWriter(output)
+        with ParallelGzipWriter(
+            hashed, level=self.compression_level, workers=self.workers
+        ) as gz:
+            entries, total_size = self.write_cpio(root, gz, chown)
+        return entries, total_size, hashed
+
+    def package_info(self, entries: list[dict], total_size: int) -> bytes:
+        """Generate PackageInfo, merging in the request's infofile if set."""
+        pkg_info = ET.Element(
+            "pkg-info",
+            {
+                "overwrite-permissions": "true",
+                "relocatable": "false",
+                "identifier": self.request["id"],
+                "postinstall-action": "none",
+                "version": self.request["version"],
+                "format-version": "2",
+                "generator-version": "AutoPkg",
+                "install-location": "/",
+                "auth": "root",
+            },
+        )
+        ET.SubElement(
+            pkg_info,
+            "payload",
+            {
+                "numberOfFiles": str(len(entries)),
+                "installKBytes": str((total_size + 1023) // 1024),
+            },
+        )
+        for tag in (
+            "bundle-version",
+            "upgrade-bundle",
+            "update-bundle",
+            "atomic-update-bundle",
+            "strict-identifier",
+            "relocate",
+        ):
+            ET.SubElement(pkg_info, tag)
+        scripts_dir = self.request.get("scripts")
+        if scripts_dir:
+            scripts = ET.SubElement(pkg_info, "scripts")
+            for script in ("preinstall", "postinstall"):
+                if os.path.exists(os.path.join(scripts_dir, script)):
+                    ET.SubElement(scripts, script, {"file": f"./{script}"})
+
+        if self.request.get("infofile"):
+            try:
+                template = ET.parse(self.request["infofile"]).getroot()
+            except (OSError, ET.ParseError) as err:
+                raise FlatPackageError(f"Can't read infofile: {err}") from err
+            # Like pkgbuild --info, the template's attributes and elements take
+            # precedence over generated ones, except identifier and version.
+            for key, value in template.attrib.items():
+                if key not in ("identifier", "version"):
+                    pkg_info.set(key, value)
+            for child in template:
+                existing = pkg_info.find(child.tag)
+                if existing is not None:
+                    pkg_info.remove(existing)
+                pkg_info.append(child)
+
+        ET.indent(pkg_info)
+        return ET.tostring(pkg_info, encoding="utf-8", xml_declaration=True)
+
+    def build(self) -> str:
+        """Build the package and return its path."""
+        request = self.request
+        pkgroot = request["pkgroot"]
+        if not os.path.isdir(pkgroot) or os.path.islink(pkgroot):
+            raise FlatPackageError(f"{pkgroot} is not a directory")
+        chown = _ChownMap(request.get("chown", []))
+        chown.verify(pkgroot)
+        pkgpath = os.path.join(request["pkgdir"], request["pkgname"] + ".pkg")
+
+        start = time.time()
+        with tempfile.TemporaryDirectory(dir=request["pkgdir"]) as workdir:
+            payload_path = os.path.join(workdir, "Payload")
+            with open(payload_path, "wb") as f:
+                entries, total_size, payload = self._compressed_cpio(pkgroot, f, chown)
+            self.log(
+                f"Wrote payload of {len(entries)} paths ({total_size} bytes) in "
+                f"{time.time() - start:.1f}s",
+                verbose_level=2,
+            )
+
+            members = [
+                ("Bom", _BomWriter().build(entries)),
+                ("PackageInfo", self.package_info(entries, total_size)),
+            ]
+            streams = []
+            if request.get("scripts"):
+                scripts_path = os.path.join(workdir, "Scripts")
+                with open(scripts_path, "wb") as f:
+                    _, _, scripts = self._compressed_cpio(
+                        request["scripts"], f, _ChownMap([])
+                    )
+                streams.append(("Scripts", scripts_path, scripts))
+            streams.append(("Payload", payload_path, payload))
+
+            temppkgpath = os.path.join(workdir, os.path.basename(pkgpath))
+            with open(temppkgpath, "wb") as f:
+                write_xar(f, members, streams)
+            if os.path.isdir(pkgpath) and not os.path.islink(pkgpath):
+                shutil.rmtree(pkgpath)
+            os.replace(temppkgpath, pkgpath)
+
+        self.log(f"Built {pkgpath} in {time.time() - start:.1f}s", verbose_level=2)
+        return pkgpath
+
+
+def write_xar(fileobj: IO, members: list, streams: list = ()) -> None:
+    """Write a flat xar archive.
+
+    members is a list of (name, bytes) stored zlib-compressed. streams is a
+    list of (name, path, hashed) for already-compressed files copied as is,
+    where hashed carries the SHA-1 and length of the file at path."""
+    heap: list[tuple[str, Any, int, int, str, str, str]] = []
+    offset = 20  # the TOC checksum comes first in the heap
+    for name, data in members:
+        archived = zlib.compress(data)
+        heap.append(
+            (
+                name,
+                archived,
+                len(archived),
+                len(data),
+                "application/x-gzip",
+                hashlib.sha1(archived).hexdigest(),
+                hashlib.sha1(data).hexdigest(),
+            )
+        )
+    for name, path, hashed in streams:
+        digest = hashed.sha1.hexdigest()
+        heap.append(
+            (
+                name,
+                path,
+                hashed.length,
+                hashed.length,
+                "application/octet-stream",
+                digest,
+                digest,
+            )
+        )
+
+    xar = ET.Element("xar")
+    toc = ET.SubElement(xar, "toc")
+    checksum = ET.SubElement(toc, "checksum", {"style": "sha1"})
+    ET.SubElement(checksum, "offset").text = "0"
+    ET.SubElement(checksum, "size").text = "20"
+    ET.SubElement(toc, "creation-time").text = time.strftime(
+        "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+    )
+    for file_id, (name, _, length, size, encoding, archived, extracted) in enumerate(
+        heap, start=1
+    ):
+        file_elem = ET.SubElement(toc, "file", {"id": str(file_id)})
+        data_elem = ET.SubElement(file_elem, "data")
+        ET.SubElement(data_elem, "length").text = str(length)
+        ET.SubElement(data_elem, "offset").text = str(offset)
+        ET.SubElement(data_elem, "size").text = str(size)
+        ET.SubElement(data_elem, "encoding", {"style": encoding})
+        ET.SubElement(data_elem, "extracted-checksum", {"style": "sha1"}).text = (
+            extracted
+        )
+        ET.SubElement(data_elem, "archived-checksum", {"style": "sha1"}).text = archived
+        ET.SubElement(file_elem, "name").text = name
+        ET.SubElement(file_elem, "type").text = "file"
+        ET.SubElement(file_elem, "mode").text = "0644"
+        offset += length
+
+    toc_data = ET.tostring(xar, encoding="utf-8", xml_declaration=True)
+    toc_compressed = zlib.compress(toc_data)
+    fileobj.write(
+        XAR_HEADER.pack(
+            XAR_MAGIC,
+            XAR_HEADER.size,
+            1,
+            len(toc_compressed),
+            len(toc_data),
+            XAR_CKSUM_SHA1,
+        )
+    )
+    fileobj.write(toc_compressed)
+    fileobj.write(hashlib.sha1(toc_compressed).digest())
+    for _, data, *_ in heap:
+        if isinstance(data, bytes):
+            fileobj.write(data)
+        else:
+            with open(data, "rb") as f:
+                shutil.copyfileobj(f, fileobj, READ_SIZE)
+
+
+class XarReader:
+    """Minimal reader for xar archives, enough to inspect flat packages."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(XAR_HEADER.size)
+            if len(header) < XAR_HEADER.size:
+                raise FlatPackageError(f"{path} is not a xar archive")
+            magic, header_size, _, toc_length, _, _ = XAR_HEADER.unpack(header)
+            if magic != XAR_MAGIC:
+                raise FlatPackageError(f"{path} is not a xar archive")
+            f.seek(header_size)
+            try:
+                toc_data = zlib.decompress(f.read(toc_length))
+            except zlib.error as err:
+                raise FlatPackageError(f"Can't read xar TOC in {path}: {err}") from err
+        self.heap_offset = header_size + toc_length
+        self.toc = ET.fromstring(toc_data)
+        self.files: dict[str, ET.Element] = {}
+        self._index(self.toc.find("toc"), "")
+
+    def _index(self, parent, prefix: str) -> None:
+        for file_elem in parent.findall("file"):
+            name = prefix + (file_elem.findtext("name") or "")
+            self.files[name] = file_elem
+            self._index(file_elem, name + "/")
+
+    def names(self) -> list[str]:
+        return list(self.files)
+
+    def read(self, name: str) -> bytes:
+        """Return the extracted contents of the archive member name."""
+        try:
+            data_elem = self.files[name].find("data")
+        except KeyError:
+            raise FlatPackageError(f"{name} not found in {self.path}") from None
+        if data_elem is None:
+            return b""
+        offset = int(data_elem.findtext("offset"))
+        length = int(data_elem.findtext("length"))
+        encoding = data_elem.find("encoding")
+        with open(self.path, "rb") as f:
+            f.seek(self.heap_offset + offset)
+            data = f.read(length)
+        style = encoding.get("style") if encoding is not None else ""
+        if style == "application/x-gzip":
+            return zlib.decompress(data)
+        if style == "application/x-bzip2":
+            import bz2
+
+            return bz2.decompress(data)
+        return data
+
+    def extract(self, name: str, dest_dir: str) -> str:
+        """Extract member name into dest_dir and return the path written."""
+        dest = os.path.join(dest_dir, os.path.basename(name))
+        with open(dest, "wb") as f:
+            f.write(self.read(name))
+        return dest
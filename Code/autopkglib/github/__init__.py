@@ -16,11 +16,17 @@
 # limitations under the License.
 """Routines for working with the GitHub API"""
 
+import copy
+import hashlib
 import json
 import os
 import re
 import tempfile
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List
+from urllib.parse import parse_qs, urlsplit
 
 from autopkglib import get_pref, log, log_err
 from autopkglib.URLGetter import URLGetter
@@ -28,13 +34,123 @@ from autopkglib.URLGetter import URLGetter
 BASE_URL = "https://api.github.com"
 TOKEN_LOCATION = os.path.expanduser("~/.autopkg_gh_token")
 DEFAULT_SEARCH_USER = "autopkg"
+RE_LINK = re.compile(r'<(?P<url>[^>]*)>\s*;\s*rel="(?P<rel>[^"]+)"')
+RATE_LIMIT_HEADERS = {
+    "x-ratelimit-limit": "limit",
+    "x-ratelimit-remaining": "remaining",
+    "x-ratelimit-used": "used",
+    "x-ratelimit-reset": "reset",
+}
+
+# GitHubResponseCache directories already pruned by this process.
+PRUNED_CACHE_DIRS: set[str] = set()
+
+
+def parse_link_header(value: str | None) -> dict[str, str]:
+    """Return the URLs in an HTTP Link header, keyed by their rel."""
+    return {m.group("rel"): m.group("url") for m in RE_LINK.finditer(value or "")}
+
+
+def page_number(url: str) -> int | None:
+    """Return the page query parameter of a paginated API URL."""
+    try:
+        return int(parse_qs(urlsplit(url).query)["page"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+class GitHubResponseCache:
+    """On-disk cache of GitHub API responses, revalidated with ETags.
+
+    Entries are keyed by URL, Accept header and a hash of the token in use,
+    since GitHub's responses (and their ETags) vary on all three. Requests
+    answered with 304 Not Modified don't count against the API rate limit.
+    Entries are touched when read, so pruning removes the least recently used
+    ones."""
+
+    def __init__(self, cache_dir: str | None = None):
+        if not cache_dir:
+            cache_dir = get_pref("CACHE_DIR") or "~/Library/AutoPkg/Cache"
+        self.cache_dir = os.path.join(os.path.expanduser(cache_dir), "GitHubAPI")
+
+    @staticmethod
+    def key(url: str, accept: str, token: str | None) -> str:
+        """Return the cache key for a request."""
+        identity = hashlib.sha256(token.encode()).hexdigest() if token else ""
+        return hashlib.sha256(f"{url}\n{accept}\n{identity}".encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Return the cached entry for key, with 'etag' and 'body' keys."""
+        try:
+            with open(os.path.join(self.cache_dir, f"{key}.json")) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not entry.get("etag"):
+            return None
+        try:
+            os.utime(os.path.join(self.cache_dir, f"{key}.json"))
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, url: str, etag: str, body: Any, link: str = "") -> None:
+        """Store a response body, its ETag and its pagination links."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                json.dump({"url": url, "etag": etag, "body": body, "link": link}, f)
+            os.replace(f.name, os.path.join(self.cache_dir, f"{key}.json"))
+        except OSError as err:
+            log_err(f"Couldn't write GitHub API cache: {err}")
+
+    def remove(self, key: str) -> None:
+        """Remove a stale entry."""
+        try:
+            os.unlink(os.path.join(self.cache_dir, f"{key}.json"))
+        except OSError:
+            pass
+
+    def prune(self, max_age: float = 30 * 86400, max_entries: int = 1000) -> None:
+        """Remove entries not used for more than max_age seconds, then the
+        least recently used entries beyond max_entries."""
+        try:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        except OSError:
+            return
+        entries.sort(reverse=True)
+        now = time.time()
+        for index, (mtime, path) in enumerate(entries):
+            if index >= max_entries or now - mtime > max_age:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+class GitHubAPIError(Exception):
+    """Raised when the GitHub API returns an unexpected response."""
+
+    pass
 
 
 class GitHubSession(URLGetter):
     """Handles a session with the GitHub API"""
 
     def __init__(
-        self, curl_path=None, curl_opts=None, github_url=None, token_path=TOKEN_LOCATION
+        self,
+        curl_path=None,
+        curl_opts=None,
+        github_url=None,
+        token_path=TOKEN_LOCATION,
+        cache: GitHubResponseCache | bool | None = None,
     ):
         super().__init__()
         self.env = {}
@@ -53,6 +169,26 @@ class GitHubSession(URLGetter):
         else:
             token_abspath = token_path
         self.token = self._get_token(token_path=token_abspath)
+        # GET responses are cached and revalidated unless disabled with the
+        # GITHUB_API_CACHE preference or by passing cache=False.
+        if cache is None and get_pref("GITHUB_API_CACHE") is not False:
+            cache = GitHubResponseCache()
+            if cache.cache_dir not in PRUNED_CACHE_DIRS:
+                PRUNED_CACHE_DIRS.add(cache.cache_dir)
+                cache.prune()
+        self.cache = cache
+        self.request_count = 0
+        self.cache_hits = 0
+        self.rate_limit: dict[str, int] = {}
+        self.response_headers: dict[str, str] = {}
+
+    def update_rate_limit(self, header: dict) -> None:
+        """Record GitHub's rate limit headers from a response."""
+        for name, key in RATE_LIMIT_HEADERS.items():
+            try:
+                self.rate_limit[key] = int(header[name])
+            except (KeyError, ValueError):
+                pass
 
     def _get_token(self, token_path: str = TOKEN_LOCATION) -> str | None:
         """Reads token from preferences or provided token path.
@@ -286,6 +422,15 @@ To save the token, paste it to the following prompt.""")
         if query:
             self.env["url"] += "?" + query
 
+        cache_key = None
+        cached = None
+        if self.cache and method == "GET" and not data:
+            cache_key = self.cache.key(self.env["url"], accept, self.token)
+            cached = self.cache.get(cache_key)
+            if cached:
+                headers = dict(headers or {})
+                headers["If-None-Match"] = cached["etag"]
+
         temp_content = tempfile.NamedTemporaryFile().name
         # Prepare curl command
         curl_cmd = self.prepare_curl_cmd(method, accept, headers, data, temp_content)
@@ -293,6 +438,15 @@ To save the token, paste it to the following prompt.""")
         # Execute curl command and parse headers
         raw_headers = self.download_with_curl(curl_cmd)
         header = self.parse_headers(raw_headers)
+        self.response_headers = header
+        self.request_count += 1
+        self.update_rate_limit(header)
+        if header["http_result_code"] == "304" and cached:
+            # Not modified: serve the cached body as a regular response.
+            header.setdefault("link", cached.get("link", ""))
+            self.cache_hits += 1
+            self.http_result_code = 200
+            return (cached["body"], self.http_result_code)
         if header["http_result_code"] != "000":
             self.http_result_code = int(header["http_result_code"])
 
@@ -306,8 +460,114 @@ To save the token, paste it to the following prompt.""")
         except json.JSONDecodeError as e:
             self.output(f"JSONDecodeError: {e}")
 
+        if cache_key:
+            if self.http_result_code == 200 and header.get("etag"):
+                self.cache.put(
+                    cache_key,
+                    self.env["url"],
+                    header["etag"],
+                    resp_data,
+                    header.get("link", ""),
+                )
+            elif cached:
+                self.cache.remove(cache_key)
+
         return (resp_data, self.http_result_code)
 
+    def graphql(self, query: str, variables: dict | None = None) -> tuple[Any, int]:
+        """Return a tuple of the JSON response and HTTP status code of a
+        GraphQL query. The GraphQL API requires a token."""
+        base_url = self.url
+        if base_url.endswith("/api/v3"):
+            # GitHub Enterprise Server
+            self.url = base_url[: -len("/v3")] + "/graphql"
+        else:
+            self.url = base_url + "/graphql"
+        try:
+            return self.call_api(
+                "",
+                method="POST",
+                data={"query": query, "variables": variables or {}},
+                accept="application/json",
+            )
+        finally:
+            self.url = base_url
+
+    def fork(self) -> "GitHubSession":
+        """Return a copy of this session for use on another thread. Its
+        request counts are merged back with join()."""
+        session = copy.copy(self)
+        session.env = dict(self.env)
+        session.request_count = 0
+        session.cache_hits = 0
+        session.download_retries = []
+        session.rate_limit = {}
+        session.response_headers = {}
+        return session
+
+    def join(self, session: "GitHubSession") -> None:
+        """Merge the request counts of a forked session into this one."""
+        self.request_count += session.request_count
+        self.cache_hits += session.cache_hits
+        self.download_retries.extend(session.download_retries)
+        self.rate_limit.update(session.rate_limit)
+
+    def iter_pages(
+        self, endpoint: str, query: str = "", per_page: int = 30, prefetch: int = 0
+    ) -> Iterator[tuple[int, Any]]:
+        """Yield (page number, response) for each page of a paginated GET
+        endpoint, following the Link header until there is no next page.
+
+        With prefetch, up to that many following pages are requested
+        concurrently while the current one is processed. Stopping iteration
+        early cancels any prefetched requests that haven't started yet.
+        Raises GitHubAPIError for any response other than 200."""
+
+        def fetch(session: GitHubSession, page: int) -> tuple[Any, dict]:
+            page_query = f"page={page}&per_page={per_page}"
+            if query:
+                page_query = f"{query}&{page_query}"
+            resp, status = session.call_api(endpoint, query=page_query)
+            if status != 200:
+                raise GitHubAPIError(f"Unexpected GitHub API status code {status}.")
+            return resp, parse_link_header(session.response_headers.get("link"))
+
+        def fetch_forked(page: int) -> tuple[Any, dict, GitHubSession]:
+            session = self.fork()
+            return (*fetch(session, page), session)
+
+        resp, links = fetch(self, 1)
+        yield 1, resp
+        if not prefetch:
+            page = 1
+            while "next" in links:
+                page = page_number(links["next"]) or page + 1
+                resp, links = fetch(self, page)
+                yield page, resp
+            return
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            pending = {}
+            page = 1
+            scheduled = 1
+            while "next" in links:
+                last = page_number(links.get("last", "")) or None
+                while len(pending) < prefetch and (not last or scheduled < last):
+                    scheduled += 1
+                    pending[scheduled] = executor.submit(fetch_forked, scheduled)
+                page += 1
+                if page not in pending:
+                    break
+                resp, links, session = pending.pop(page).result()
+                self.join(session)
+                if not resp:
+                    # Requested past the end of a list without a last link.
+                    break
+                yield page, resp
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
 
 def get_table_row(row_items, col_widths, header=False):
     """Format table row content (e.g. search results) with proper spacing for output.
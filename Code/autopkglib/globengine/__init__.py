@@ -0,0 +1,236 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shell-style path matching for the processors that find items in disk
+images and unpacked payloads.
+
+Patterns are matched like glob.glob, including hidden-file rules, "**" with
+recursive=True and trailing slashes, but the tree is walked one directory at
+a time with os.scandir:
+
+- Literal path components are joined without listing their parent.
+- Only directories that can still lead to a match are entered, and hidden
+  directories are skipped unless the pattern names them.
+- Matches are produced lazily in sorted order, so first_match stops at the
+  first one and last_match keeps only the latest seen, rather than building
+  and sorting a list of every match.
+
+Within a recipe run, directory listings can be cached by passing the
+cache_scope of the recipe's env. A cached listing is used again only while
+the directory's modification time is unchanged, so items added or removed by
+earlier steps are still found. Listings are dropped when the next recipe
+starts, and only the most recently used MAX_CACHED_LISTINGS are kept.
+"""
+
+import fnmatch
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from glob import has_magic
+from typing import Iterator
+
+__all__ = ["cache_scope", "first_match", "glob", "iglob", "last_match"]
+
+_SEPARATORS = re.compile("[" + re.escape(os.sep + (os.altsep or "")) + "]+")
+
+# Most directory listings kept in the cache. The least recently used are
+# dropped beyond this.
+MAX_CACHED_LISTINGS = 10000
+
+# Directory listings cached for the current recipe, keyed by path, in order
+# of use. Each holds the directory's mtime and its (name, is_dir) entries.
+_listings: OrderedDict[str, tuple[int, list[tuple[str, bool]]]] = OrderedDict()
+_listings_scope = None
+
+
+def cache_scope(env) -> tuple | None:
+    """Returns the listing cache scope for a recipe step's env: the run's
+    RUN_ID and the recipe's RECIPE_CACHE_DIR. Returns None, so nothing is
+    cached, outside an autopkg run."""
+    if not env.get("RUN_ID"):
+        return None
+    return (env["RUN_ID"], env.get("RECIPE_CACHE_DIR"))
+
+
+@lru_cache(maxsize=256)
+def _matcher(pattern: str):
+    return re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+
+
+def _join(dirname: str, name: str) -> str:
+    return os.path.join(dirname, name) if dirname else name
+
+
+def _scan(path: str) -> list[tuple[str, bool]]:
+    """Returns the sorted (name, is_dir) entries of directory path, with
+    symlinks to directories counted as directories."""
+    try:
+        with os.scandir(path or os.curdir) as entries:
+            listing = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                listing.append((entry.name, is_dir))
+    except OSError:
+        return []
+    listing.sort()
+    return listing
+
+
+def _listdir(path: str, scope) -> list[tuple[str, bool]]:
+    """Returns the entries of directory path, from the recipe's cache if the
+    directory hasn't changed since it was listed."""
+    global _listings_scope
+    if not scope:
+        return _scan(path)
+    try:
+        mtime = os.stat(path or os.curdir).st_mtime_ns
+    except OSError:
+        return []
+    if scope != _listings_scope:
+        _listings.clear()
+        _listings_scope = scope
+    cached = _listings.get(path)
+    if cached and cached[0] == mtime:
+        _listings.move_to_end(path)
+        return cached[1]
+    listing = _scan(path)
+    _listings[path] = (mtime, listing)
+    _listings.move_to_end(path)
+    while len(_listings) > MAX_CACHED_LISTINGS:
+        _listings.popitem(last=False)
+    return listing
+
+
+class _Pattern:
+    """A glob pattern split into path components."""
+
+    def __init__(self, pattern: str, recursive: bool) -> None:
+        self.pattern = pattern
+        self.recursive = recursive
+        drive, path = os.path.splitdrive(pattern)
+        self.root = drive
+        if path and path[0] in (os.sep, os.altsep):
+            self.root += os.sep
+        parts = [part for part in _SEPARATORS.split(path) if part]
+        # a trailing separator only matches directories
+        self.dironly = bool(path) and path[-1] in (os.sep, os.altsep)
+        # consecutive "**" components match the same paths as one
+        self.parts = []
+        for part in parts:
+            if self.parts and self.is_recursive(self.parts[-1]):
+                if self.is_recursive(part):
+                    continue
+            self.parts.append(part)
+
+    def is_recursive(self, part: str) -> bool:
+        return self.recursive and part == "**"
+
+    def matches(self, cache_scope=None) -> Iterator[str]:
+        if not self.parts:
+            if self.root and os.path.isdir(self.root):
+                yield self.root
+            return
+        yield from self._match(self.root, 0, cache_scope)
+
+    def _result(self, path: str, is_dir: bool) -> Iterator[str]:
+        if not self.dironly:
+            yield path
+        elif is_dir:
+            yield os.path.join(path, "")
+
+    def _match(self, dirname: str, index: int, cache_scope) -> Iterator[str]:
+        part = self.parts[index]
+        last = index == len(self.parts) - 1
+        if self.is_recursive(part):
+            yield from self._match_recursive(dirname, index, cache_scope)
+            return
+        if not has_magic(part):
+            path = _join(dirname, part)
+            if not last:
+                yield from self._match(path, index + 1, cache_scope)
+            elif self.dironly:
+                if os.path.isdir(path):
+                    yield os.path.join(path, "")
+            elif os.path.lexists(path):
+                yield path
+            return
+        match = _matcher(part)
+        hidden = part.startswith(".")
+        for name, is_dir in _listdir(dirname, cache_scope):
+            if name.startswith(".") and not hidden:
+                continue
+            if not match(os.path.normcase(name)):
+                continue
+            if last:
+                yield from self._result(_join(dirname, name), is_dir)
+            elif is_dir:
+                yield from self._match(_join(dirname, name), index + 1, cache_scope)
+
+    def _match_recursive(self, dirname: str, index: int, cache_scope) -> Iterator[str]:
+        """Matches "**": zero or more directories, then the rest of the
+        pattern. As the last component it matches everything below."""
+        if index == len(self.parts) - 1:
+            if dirname:
+                yield os.path.join(dirname, "")
+            yield from self._descend(dirname, cache_scope)
+            return
+        yield from self._match(dirname, index + 1, cache_scope)
+        for name, is_dir in _listdir(dirname, cache_scope):
+            if is_dir and not name.startswith("."):
+                yield from self._match_recursive(
+                    _join(dirname, name), index, cache_scope
+                )
+
+    def _descend(self, dirname: str, cache_scope) -> Iterator[str]:
+        """Yields everything below dirname, for a final "**"."""
+        for name, is_dir in _listdir(dirname, cache_scope):
+            if name.startswith("."):
+                continue
+            path = _join(dirname, name)
+            yield from self._result(path, is_dir)
+            if is_dir:
+                yield from self._descend(path, cache_scope)
+
+
+def iglob(pattern: str, recursive: bool = False, cache_scope=None) -> Iterator[str]:
+    """Yields the paths matching pattern, in sorted order within each
+    directory. Directory listings are cached for the recipe if cache_scope
+    is set."""
+    if not has_magic(pattern):
+        # like glob.glob, return a literal path only if it exists
+        exists = os.path.isdir if pattern.endswith(os.sep) else os.path.lexists
+        if exists(pattern):
+            yield pattern
+        return
+    yield from _Pattern(pattern, recursive).matches(cache_scope)
+
+
+def glob(pattern: str, recursive: bool = False, cache_scope=None) -> list[str]:
+    """Returns a list of the paths matching pattern, like glob.glob."""
+    return list(iglob(pattern, recursive, cache_scope))
+
+
+def first_match(pattern: str, recursive: bool = False, cache_scope=None) -> str | None:
+    """Returns the first path matching pattern, without looking for any
+    others, or None if nothing matches."""
+    return next(iglob(pattern, recursive, cache_scope), None)
+
+
+def last_match(pattern: str, recursive: bool = False, cache_scope=None) -> str | None:
+    """Returns the last of the paths matching pattern when sorted, without
+    keeping a list of them, or None if nothing matches."""
+    return max(iglob(pattern, recursive, cache_scope), default=None)
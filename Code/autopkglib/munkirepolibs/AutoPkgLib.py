@@ -1,14 +1,128 @@
+import errno
 import os
 import plistlib
-import shutil
+import time
+import uuid
+from contextlib import contextmanager
 
 from autopkglib import ProcessorError
+from autopkglib.copyengine import CopyUnavailable, clone_file, stream_file
+from autopkglib.munkirepolibs.CatalogDB import build_catalog_db
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def link_file(src, dst) -> None:
+    """Hard link dst to src."""
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise CopyUnavailable(f"hard link failed: {err.strerror}") from err
+        raise
+
+
+def reserve_item_name(directory, name, ext) -> str:
+    """Creates an empty file named name + ext in directory, or with the first
+    free __N suffix, and returns its name. The file is created with O_EXCL,
+    so concurrent importers can't reserve the same name."""
+    item_name = f"{name}{ext}"
+    index = 0
+    while True:
+        try:
+            fd = os.open(
+                os.path.join(directory, item_name),
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                0o666,
+            )
+        except FileExistsError:
+            # try appending numbers until we have a unique name
+            index += 1
+            item_name = f"{name}__{index}{ext}"
+            continue
+        os.close(fd)
+        return item_name
+
+
+@contextmanager
+def hidden_temp_path(directory, item_name):
+    """Yields an unused hidden path for item_name in directory, and removes
+    anything left at that path afterwards."""
+    path = os.path.join(directory, f".{item_name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield path
+    finally:
+        if os.path.lexists(path):
+            os.unlink(path)
+
+
+def publish_item(path, directory, name, ext) -> str:
+    """Hard links the complete file at path into directory as name + ext, or
+    with the first free __N suffix, and returns its name. Taking the name
+    and publishing the file are one step, so concurrent importers can't
+    take the same name and readers never see an empty or partial file."""
+    item_name = f"{name}{ext}"
+    index = 0
+    while True:
+        try:
+            os.link(path, os.path.join(directory, item_name))
+            return item_name
+        except FileExistsError:
+            # try appending numbers until we have a unique name
+            index += 1
+            item_name = f"{name}__{index}{ext}"
+        except OSError as err:
+            if err.errno not in (errno.EPERM, errno.ENOTSUP, errno.EMLINK):
+                raise
+            # the filesystem has no hard links, so reserve the name instead
+            item_name = reserve_item_name(directory, name, ext)
+            os.replace(path, os.path.join(directory, item_name))
+            return item_name
+
+
+def write_plist_exclusively(data, directory, name, ext) -> str:
+    """Writes data as a plist to a hidden temporary file in directory, then
+    publishes it as name + ext, or with the first free __N suffix, and
+    returns its name."""
+    with hidden_temp_path(directory, f"{name}{ext}") as path:
+        with open(path, "xb") as f:
+            plistlib.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        return publish_item(path, directory, name, ext)
 
 
 class AutoPkgLib:
-    def __init__(self, munki_repo, repo_subdirectory):
+    def __init__(
+        self, munki_repo, repo_subdirectory, allow_hardlink=False, lock_repo=False
+    ):
         self.munki_repo = munki_repo
         self.repo_subdirectory = repo_subdirectory
+        self.allow_hardlink = allow_hardlink
+        self.lock_repo = lock_repo
+        self.copy_stats = {}
+
+    @contextmanager
+    def repo_lock(self):
+        """Holds an exclusive lock on the repo while copying an installer
+        item or pkginfo into it, if lock_repo is set, so autopkg processes
+        importing into the same repo don't pick the same item name."""
+        if not self.lock_repo or fcntl is None:
+            yield
+            return
+        lock_path = os.path.join(self.munki_repo, ".autopkg_import.lock")
+        try:
+            lock_file = open(lock_path, "w")
+        except OSError as err:
+            raise ProcessorError(
+                f"Could not open repo lock {lock_path}: {err.strerror}"
+            ) from err
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
 
     def make_catalog_db(self) -> dict:
         """Reads the 'all' catalog and returns a dict we can use like a
@@ -27,102 +141,7 @@ class AutoPkgLib:
                     f"Error reading 'all' catalog from Munki repo: {err}"
                 )
 
-        pkgid_table = {}
-        app_table = {}
-        installer_item_table = {}
-        hash_table = {}
-        checksum_table = {}
-        files_table = {}
-
-        itemindex = -1
-        for item in catalogitems:
-            itemindex = itemindex + 1
-            name = item.get("name", "NO NAME")
-            vers = item.get("version", "NO VERSION")
-
-            if name == "NO NAME" or vers == "NO VERSION":
-                # skip this item
-                continue
-
-            # add to hash table
-            if "installer_item_hash" in item:
-                if not item["installer_item_hash"] in hash_table:
-                    hash_table[item["installer_item_hash"]] = []
-                hash_table[item["installer_item_hash"]].append(itemindex)
-
-            # add to installer item table
-            if "installer_item_location" in item:
-                installer_item_name = os.path.basename(item["installer_item_location"])
-                if installer_item_name not in installer_item_table:
-                    installer_item_table[installer_item_name] = {}
-                if vers not in installer_item_table[installer_item_name]:
-                    installer_item_table[installer_item_name][vers] = []
-                installer_item_table[installer_item_name][vers].append(itemindex)
-
-            # add to table of receipts
-            for receipt in item.get("receipts", []):
-                try:
-                    if "packageid" in receipt and "version" in receipt:
-                        pkgid = receipt["packageid"]
-                        pkgvers = receipt["version"]
-                        if pkgid not in pkgid_table:
-                            pkgid_table[pkgid] = {}
-                        if pkgvers not in pkgid_table[pkgid]:
-                            pkgid_table[pkgid][pkgvers] = []
-                        pkgid_table[pkgid][pkgvers].append(itemindex)
-                except TypeError:
-                    # skip this receipt
-                    continue
-
-            # add to table of installed applications
-            for install in item.get("installs", []):
-                try:
-                    if install.get("type") in ("application", "bundle"):
-                        if "path" in install:
-                            if "version_comparison_key" in install:
-                                app_version = install[install["version_comparison_key"]]
-                            else:
-                                app_version = install["CFBundleShortVersionString"]
-                            if install["path"] not in app_table:
-                                app_table[install["path"]] = {}
-                            if vers not in app_table[install["path"]]:
-                                app_table[install["path"]][app_version] = []
-                            app_table[install["path"]][app_version].append(itemindex)
-                    if install.get("type") == "file":
-                        if "path" in install:
-                            if "md5checksum" in install:
-                                cksum = install["md5checksum"]
-
-                                if cksum not in list(checksum_table.keys()):
-                                    checksum_table[cksum] = []
-
-                                checksum_table[cksum].append(
-                                    {"path": install["path"], "index": itemindex}
-                                )
-                            else:
-                                path = install["path"]
-
-                                if path not in list(files_table.keys()):
-                                    files_table[path] = []
-
-                                files_table[path].append(
-                                    {"path": install["path"], "index": itemindex}
-                                )
-
-                except (TypeError, KeyError):
-                    # skip this item
-                    continue
-
-        pkgdb = {}
-        pkgdb["hashes"] = hash_table
-        pkgdb["receipts"] = pkgid_table
-        pkgdb["applications"] = app_table
-        pkgdb["installer_items"] = installer_item_table
-        pkgdb["checksums"] = checksum_table
-        pkgdb["files"] = files_table
-        pkgdb["items"] = catalogitems
-
-        return pkgdb
+        return build_catalog_db(catalogitems)
 
     def copy_pkg_to_repo(self, pkginfo, pkg_path) -> str:
         """Copies an item to the appropriate place in the repo.
@@ -140,7 +159,7 @@ class AutoPkgLib:
         destination_path = os.path.join(self.munki_repo, "pkgs", self.repo_subdirectory)
         if not os.path.exists(destination_path):
             try:
-                os.makedirs(destination_path)
+                os.makedirs(destination_path, exist_ok=True)
             except OSError as err:
                 raise ProcessorError(
                     f"Could not create {destination_path}: {err.strerror}"
@@ -162,23 +181,51 @@ class AutoPkgLib:
                 item_name = f"{name}-{item_version}{ext}"
                 destination_pathname = os.path.join(destination_path, item_name)
 
-        index = 0
         name, ext = os.path.splitext(item_name)
-        while os.path.exists(destination_pathname):
-            # try appending numbers until we have a unique name
-            index += 1
-            item_name = f"{name}__{index}{ext}"
-            destination_pathname = os.path.join(destination_path, item_name)
-
-        try:
-            shutil.copy(pkg_path, destination_pathname)
-        except OSError as err:
-            raise ProcessorError(
-                f"Can't copy {pkg_path} to {destination_pathname}: " f"{err.strerror}"
-            )
+        with self.repo_lock(), hidden_temp_path(destination_path, item_name) as path:
+            self.copy_item(pkg_path, path)
+            try:
+                item_name = publish_item(path, destination_path, name, ext)
+            except OSError as err:
+                raise ProcessorError(
+                    f"Could not copy {pkg_path} to {destination_path}: "
+                    f"{err.strerror}"
+                ) from err
 
         return os.path.join(self.munki_repo, "pkgs", self.repo_subdirectory, item_name)
 
+    def copy_item(self, pkg_path, destination_pathname) -> None:
+        """Copies pkg_path to destination_pathname, cloning it if the
+        filesystem supports it, then hard linking it if allowed, and
+        otherwise copying the data. The strategy used, bytes and seconds
+        taken are recorded in copy_stats."""
+        strategies = [("clone", clone_file)]
+        if self.allow_hardlink:
+            strategies.append(("hardlink", link_file))
+        strategies.append(("copy", stream_file))
+
+        start = time.monotonic()
+        for strategy, copy_func in strategies:
+            try:
+                copy_func(pkg_path, destination_pathname)
+            except CopyUnavailable:
+                if os.path.lexists(destination_pathname):
+                    os.unlink(destination_pathname)
+                continue
+            except OSError as err:
+                if os.path.lexists(destination_pathname):
+                    os.unlink(destination_pathname)
+                raise ProcessorError(
+                    f"Can't copy {pkg_path} to {destination_pathname}: "
+                    f"{err.strerror}"
+                ) from err
+            self.copy_stats = {
+                "strategy": strategy,
+                "bytes": os.path.getsize(destination_pathname),
+                "seconds": time.monotonic() - start,
+            }
+            return
+
     def copy_pkginfo_to_repo(self, pkginfo, file_extension="plist") -> str:
         """Saves pkginfo to munki_repo_path/pkgsinfo/subdirectory.
         Returns full path to the pkginfo in the repo."""
@@ -189,7 +236,7 @@ class AutoPkgLib:
         )
         if not os.path.exists(destination_path):
             try:
-                os.makedirs(destination_path)
+                os.makedirs(destination_path, exist_ok=True)
             except OSError as err:
                 raise ProcessorError(
                     f"Could not create {destination_path}: {err.strerror}"
@@ -197,21 +244,17 @@ class AutoPkgLib:
 
         if len(file_extension) > 0:
             file_extension = "." + file_extension.strip(".")
-        pkginfo_name = f"{pkginfo['name']}-{pkginfo['version'].strip()}{file_extension}"
-        pkginfo_path = os.path.join(destination_path, pkginfo_name)
-        index = 0
-        while os.path.exists(pkginfo_path):
-            index += 1
-            pkginfo_name = (
-                f"{pkginfo['name']}-{pkginfo['version']}__{index}{file_extension}"
-            )
-            pkginfo_path = os.path.join(destination_path, pkginfo_name)
-
         try:
-            with open(pkginfo_path, "wb") as f:
-                plistlib.dump(pkginfo, f)
+            with self.repo_lock():
+                pkginfo_name = write_plist_exclusively(
+                    pkginfo,
+                    destination_path,
+                    f"{pkginfo['name']}-{pkginfo['version'].strip()}",
+                    file_extension,
+                )
         except OSError as err:
             raise ProcessorError(
-                f"Could not write pkginfo {pkginfo_path}: {err.strerror}"
-            )
+                f"Could not write pkginfo in {destination_path}: {err.strerror}"
+            ) from err
+        pkginfo_path = os.path.join(destination_path, pkginfo_name)
         return pkginfo_path
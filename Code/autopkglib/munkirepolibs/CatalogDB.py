@@ -0,0 +1,127 @@
+import copy
+import os
+from array import array
+from collections import defaultdict
+
+# Catalog databases shared by every MunkiImporter step in an autopkg run, keyed
+# by run and repo. Only the current run's databases are kept.
+_run_catalog_dbs: dict[tuple, dict] = {}
+
+
+def index_list() -> array:
+    """Returns an empty list of catalog item indexes"""
+    return array("L")
+
+
+def new_catalog_db(catalogitems) -> dict:
+    """Returns a catalog database with empty lookup tables for catalogitems.
+
+    Each table maps the value(s) being looked up to an array of indexes into
+    pkgdb["items"], in ascending order:
+      hashes:          installer_item_hash -> indexes
+      receipts:        packageid -> version -> indexes
+      applications:    path -> version -> indexes
+      installer_items: installer item name -> version -> indexes
+      checksums:       md5checksum -> path -> indexes
+      files:           path -> indexes (installs items without a checksum)"""
+    return {
+        "hashes": defaultdict(index_list),
+        "receipts": defaultdict(lambda: defaultdict(index_list)),
+        "applications": defaultdict(lambda: defaultdict(index_list)),
+        "installer_items": defaultdict(lambda: defaultdict(index_list)),
+        "checksums": defaultdict(lambda: defaultdict(index_list)),
+        "files": defaultdict(index_list),
+        "items": catalogitems,
+    }
+
+
+def build_catalog_db(catalogitems) -> dict:
+    """Returns a catalog database indexing catalogitems"""
+    pkgdb = new_catalog_db(catalogitems)
+    for itemindex, item in enumerate(catalogitems):
+        index_catalog_item(pkgdb, item, itemindex)
+    return pkgdb
+
+
+def index_catalog_item(pkgdb, item, itemindex) -> None:
+    """Adds the catalog item at itemindex to the lookup tables of pkgdb"""
+    name = item.get("name", "NO NAME")
+    vers = item.get("version", "NO VERSION")
+
+    if name == "NO NAME" or vers == "NO VERSION":
+        # skip this item
+        return
+
+    if "installer_item_hash" in item:
+        pkgdb["hashes"][item["installer_item_hash"]].append(itemindex)
+
+    if "installer_item_location" in item:
+        installer_item_name = os.path.basename(item["installer_item_location"])
+        pkgdb["installer_items"][installer_item_name][vers].append(itemindex)
+
+    for receipt in item.get("receipts", []):
+        try:
+            if "packageid" in receipt and "version" in receipt:
+                pkgdb["receipts"][receipt["packageid"]][receipt["version"]].append(
+                    itemindex
+                )
+        except TypeError:
+            # skip this receipt
+            continue
+
+    for install in item.get("installs", []):
+        try:
+            if "path" not in install:
+                continue
+            if install.get("type") in ("application", "bundle"):
+                if "version_comparison_key" in install:
+                    app_version = install[install["version_comparison_key"]]
+                else:
+                    app_version = install["CFBundleShortVersionString"]
+                pkgdb["applications"][install["path"]][app_version].append(itemindex)
+            elif install.get("type") == "file":
+                if "md5checksum" in install:
+                    pkgdb["checksums"][install["md5checksum"]][install["path"]].append(
+                        itemindex
+                    )
+                else:
+                    pkgdb["files"][install["path"]].append(itemindex)
+        except (TypeError, KeyError):
+            # skip this item
+            continue
+
+
+def matching_indexes(index_lists) -> list[int] | None:
+    """Returns the sorted indexes found in every one of index_lists, starting
+    from the shortest. Returns None if any of them is missing or empty."""
+    if not all(index_lists):
+        return None
+    index_lists = sorted(index_lists, key=len)
+    common = set(index_lists[0])
+    for indexes in index_lists[1:]:
+        if not common:
+            break
+        common.intersection_update(indexes)
+    return sorted(common)
+
+
+def add_catalog_item(pkgdb, item) -> None:
+    """Adds a copy of a newly imported pkginfo to pkgdb, so later lookups
+    match it before the repo's catalogs are rebuilt"""
+    item = copy.deepcopy(item)
+    pkgdb["items"].append(item)
+    index_catalog_item(pkgdb, item, len(pkgdb["items"]) - 1)
+
+
+def run_catalog_db(run_id, repo_key, repo_library) -> dict:
+    """Returns the catalog database for repo_key in the autopkg run run_id,
+    building it with repo_library the first time it's needed in the run.
+    Without a run_id a new database is built for every call."""
+    if not run_id:
+        return repo_library.make_catalog_db()
+    key = (run_id, *repo_key)
+    if key not in _run_catalog_dbs:
+        for stale_key in [k for k in _run_catalog_dbs if k[0] != run_id]:
+            del _run_catalog_dbs[stale_key]
+        _run_catalog_dbs[key] = repo_library.make_catalog_db()
+    return _run_catalog_dbs[key]
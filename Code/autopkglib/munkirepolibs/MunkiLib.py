@@ -3,6 +3,7 @@ import sys
 from urllib.parse import urlparse
 
 from autopkglib import ProcessorError
+from autopkglib.munkirepolibs.CatalogDB import build_catalog_db
 
 
 class MunkiLib:
@@ -36,7 +37,9 @@ class MunkiLib:
         return os.path.join(self.munki_repo, path)
 
     def make_catalog_db(self) -> dict:
-        return self.munkiimportlib.make_catalog_db(self.repo)
+        # index the items the same way as AutoPkgLib, so they can be matched
+        # and updated in the same way
+        return build_catalog_db(self.munkiimportlib.make_catalog_db(self.repo)["items"])
 
     def copy_pkg_to_repo(self, pkginfo, pkg_path) -> str:
         uploaded_path = self.munkiimportlib.copy_item_to_repo(
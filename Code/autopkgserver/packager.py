@@ -15,6 +15,9 @@
 # limitations under the License.
 
 
+import ctypes
+import errno
+import fcntl
 import grp
 import os
 import plistlib
@@ -24,15 +27,78 @@ import shutil
 import stat
 import subprocess
 import tempfile
+import time
+from contextlib import contextmanager
 from xml.parsers.expat import ExpatError
 
-__all__ = ["Packager", "PackagerError"]
+__all__ = ["CopyUnavailable", "Packager", "PackagerError"]
+
+APPNAME = "autopkgserver"
+
+
+# Linux ioctl to share a file's extents with another file (a reflink).
+FICLONE = 0x40049409
 
 
 class PackagerError(Exception):
     pass
 
 
+class CopyUnavailable(Exception):
+    """Raised when a copy strategy can't be used for a pkgroot."""
+
+    pass
+
+
+def tree_size(path: str) -> int:
+    """Return the total size in bytes of regular files below path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            info = os.lstat(os.path.join(dirpath, filename))
+            if stat.S_ISREG(info.st_mode):
+                total += info.st_size
+    return total
+
+
+def copy_metadata(src_info: os.stat_result, dst: str) -> None:
+    """Apply ownership, mode and times from src_info to dst."""
+    os.lchown(dst, src_info.st_uid, src_info.st_gid)
+    if not stat.S_ISLNK(src_info.st_mode):
+        os.chmod(dst, stat.S_IMODE(src_info.st_mode))
+        os.utime(dst, ns=(src_info.st_atime_ns, src_info.st_mtime_ns))
+
+
+def build_tree(src: str, dst: str, place_file, file_metadata: bool = True) -> None:
+    """Recreate the directory tree at src below the existing directory dst,
+    creating directories and symlinks and calling place_file(src, dst) for
+    each regular file. Hard links share their metadata with the original, so
+    pass file_metadata=False to leave regular files untouched."""
+    for dirpath, dirnames, filenames in os.walk(src):
+        relpath = os.path.relpath(dirpath, src)
+        target_dir = os.path.normpath(os.path.join(dst, relpath))
+        for name in dirnames + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            info = os.lstat(source)
+            if stat.S_ISLNK(info.st_mode):
+                os.symlink(os.readlink(source), target)
+            elif stat.S_ISDIR(info.st_mode):
+                os.mkdir(target)
+            elif stat.S_ISREG(info.st_mode):
+                place_file(source, target)
+                if not file_metadata:
+                    continue
+            else:
+                raise CopyUnavailable(f"unsupported file type at {source}")
+            copy_metadata(info, target)
+    # Directory times change as their contents are created; fix them last.
+    for dirpath, _, _ in os.walk(src):
+        target_dir = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        if target_dir != os.path.normpath(dst):
+            copy_metadata(os.lstat(dirpath), target_dir)
+
+
 class Packager:
     """Create an Apple installer package.
 
@@ -58,16 +124,32 @@ class Packager:
         self.uid = uid
         self.gid = gid
         self.tmproot = None
+        # Seconds spent in each packaging phase, for request metrics.
+        self.metrics: dict[str, float] = {}
+
+    @contextmanager
+    def timed(self, phase: str):
+        """Add the time spent in the with block to metrics[phase]."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.metrics[phase] = (
+                self.metrics.get(phase, 0.0) + time.monotonic() - start
+            )
 
     def package(self):
         """Main method."""
 
         try:
             self.verify_request()
-            self.copy_pkgroot()
-            self.apply_chown()
-            self.make_component_property_list()
-            return self.create_pkg()
+            with self.timed("copy"):
+                self.copy_pkgroot()
+            with self.timed("chown"):
+                self.apply_chown()
+            with self.timed("build"):
+                self.make_component_property_list()
+                return self.create_pkg()
         finally:
             self.cleanup()
 
@@ -263,18 +345,93 @@ class Packager:
         self.log.info("Packaging request verified")
 
     def copy_pkgroot(self) -> None:
-        """Copy pkgroot to temporary directory."""
+        """Copy pkgroot to temporary directory.
+
+        Strategies are tried in order: cloning (APFS clonefile or Linux
+        reflinks), a hard link tree (only when no chown entries would modify
+        the shared files), and finally a full copy with ditto. Bytes cloned,
+        linked and copied are recorded in metrics."""
 
         self.log.debug("Copying package root")
 
-        self.tmproot = tempfile.mkdtemp()
+        # Each request gets its own temporary root, so concurrent requests
+        # never share a staging directory.
+        self.tmproot = tempfile.mkdtemp(prefix=f"{APPNAME}-")
         self.tmp_pkgroot = os.path.join(self.tmproot, self.name)
-        os.mkdir(self.tmp_pkgroot)
+        pkgroot = self.request["pkgroot"]
+
+        size = tree_size(pkgroot)
+        for strategy in ("clone", "hardlink", "ditto"):
+            try:
+                getattr(self, f"copy_pkgroot_{strategy}")(pkgroot, self.tmp_pkgroot)
+            except CopyUnavailable as err:
+                self.log.debug("Not using %s to copy pkgroot: %s", strategy, err)
+                if os.path.lexists(self.tmp_pkgroot):
+                    shutil.rmtree(self.tmp_pkgroot)
+                continue
+            break
+        self.copy_strategy = strategy
+        key = {"clone": "bytes_cloned", "hardlink": "bytes_linked"}.get(
+            strategy, "bytes_copied"
+        )
+        self.metrics[key] = self.metrics.get(key, 0) + size
+
         os.chmod(self.tmp_pkgroot, 0o1775)
         os.chown(self.tmp_pkgroot, 0, 80)
+
+        self.log.info(
+            "Package root copied to %s using %s (%s bytes)",
+            self.tmp_pkgroot,
+            strategy,
+            size,
+        )
+
+    def copy_pkgroot_clone(self, src: str, dst: str) -> None:
+        """Clone pkgroot without copying data, using clonefile(2) on APFS or
+        FICLONE reflinks on Linux filesystems that support them."""
+        libc = ctypes.CDLL(None, use_errno=True)
+        clonefile = getattr(libc, "clonefile", None)
+        if clonefile is not None:
+            # clonefile clones a whole directory hierarchy, including
+            # ownership since we run as root.
+            if clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+                err = ctypes.get_errno()
+                raise CopyUnavailable(f"clonefile failed: {os.strerror(err)}")
+            return
+
+        def reflink(source: str, target: str) -> None:
+            with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                except OSError as err:
+                    raise CopyUnavailable(f"reflink failed: {err.strerror}") from err
+
+        os.mkdir(dst)
+        build_tree(src, dst, reflink)
+
+    def copy_pkgroot_hardlink(self, src: str, dst: str) -> None:
+        """Build a tree of hard links to the files in pkgroot. Only safe when
+        no chown entries will modify the (shared) files afterwards."""
+        if self.request["chown"]:
+            raise CopyUnavailable("chown entries would modify the original files")
+
+        def link(source: str, target: str) -> None:
+            try:
+                os.link(source, target)
+            except OSError as err:
+                if err.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise CopyUnavailable(f"hard link failed: {err.strerror}") from err
+                raise
+
+        os.mkdir(dst)
+        build_tree(src, dst, link, file_metadata=False)
+
+    def copy_pkgroot_ditto(self, src: str, dst: str) -> None:
+        """Copy pkgroot with ditto."""
+        os.mkdir(dst)
         try:
             p = subprocess.Popen(
-                ("/usr/bin/ditto", self.request["pkgroot"], self.tmp_pkgroot),
+                ("/usr/bin/ditto", src, dst),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True,
@@ -286,12 +443,10 @@ class Packager:
             )
         if p.returncode != 0:
             raise PackagerError(
-                f"Couldn't copy pkgroot from {self.request['pkgroot']} to "
-                f"{self.tmp_pkgroot}: {' '.join(str(err).split())}"
+                f"Couldn't copy pkgroot from {src} to "
+                f"{dst}: {' '.join(str(err).split())}"
             )
 
-        self.log.info("Package root copied to %s", self.tmp_pkgroot)
-
     def apply_chown(self) -> None:
         """Change owner and group, and permissions if the 'mode' key was set."""
 
@@ -0,0 +1,444 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Builds nupkg files without `choco.exe` or `nuget.exe`.
+
+A nupkg is a zip file laid out as an Open Packaging Conventions package, as
+written by `choco pack`:
+
+    _rels/.rels                 Relationships to the nuspec and core properties.
+    <id>.nuspec                 The package manifest.
+    ...                         Every other file below the nuspec's directory.
+    package/services/metadata/core-properties/<guid>.psmdcp
+                                Core properties taken from the nuspec.
+    [Content_Types].xml         The content type of each part.
+
+File data is streamed from disk into the zip. Large files are deflated in
+parallel chunks, like pigz; the rest are deflated in the calling thread.
+"""
+
+import os
+import struct
+import tempfile
+import time
+import uuid
+from html import escape
+from urllib.parse import quote
+from xml.etree import ElementTree as ET
+
+# Files at least this large are compressed by a pool of threads.
+PARALLEL_THRESHOLD = 4 * 1024 * 1024
+# Read size used when streaming files into the package.
+READ_SIZE = 1024 * 1024
+
+# Sizes and offsets from this value up need zip64 records.
+ZIP64_LIMIT = 0xFFFFFFFF
+# Entry counts from this value up need zip64 records.
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Stored in place of sizes, offsets and counts kept in zip64 records.
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+ZIP_DEFLATED = 8
+# General purpose flag for UTF-8 encoded entry names.
+ZIP_UTF8_FLAG = 0x800
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+
+RELATIONSHIP_TYPES = {
+    "manifest": "http://schemas.microsoft.com/packaging/2010/07/manifest",
+    "core-properties": (
+        "http://schemas.openxmlformats.org/package/2006/relationships/"
+        "metadata/core-properties"
+    ),
+}
+RELS_CONTENT_TYPE = "application/vnd.openxmlformats-package.relationships+xml"
+CORE_PROPERTIES_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-package.core-properties+xml"
+)
+# The content type choco pack gives every file in the package.
+DEFAULT_CONTENT_TYPE = "application/octet"
+
+# Characters left as they are in part names, as System.Uri does.
+PART_NAME_SAFE = "/!$&'()*+,;=:@-._~"
+
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>'
+
+
+class NupkgError(Exception):
+    pass
+
+
+def _dos_datetime(timestamp: float) -> tuple[int, int]:
+    """Returns the MS-DOS (time, date) of a timestamp, as stored in zips."""
+    tm = time.localtime(timestamp)
+    if tm.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2),
+        ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday,
+    )
+
+
+def _zip64_extra(*values: int) -> bytes:
+    return struct.pack(f"<HH{len(values)}Q", 1, 8 * len(values), *values)
+
+
+def quoteattr(value: str) -> str:
+    return '"' + escape(value) + '"'
+
+
+def part_name(name: str) -> str:
+    """Returns the escaped zip entry name of a file, given its path relative
+    to the package root."""
+    return quote(name.replace(os.sep, "/"), safe=PART_NAME_SAFE)
+
+
+def read_nuspec_metadata(nuspec_path: str) -> dict[str, str]:
+    """Returns the text of each element in the metadata of a nuspec, keyed by
+    tag name without any namespace."""
+    try:
+        root = ET.parse(nuspec_path).getroot()
+    except (OSError, ET.ParseError) as err:
+        raise NupkgError(f"Can't read nuspec {nuspec_path}: {err}") from err
+    metadata = {}
+    for section in root:
+        if section.tag.rpartition("}")[2] != "metadata":
+            continue
+        for element in section:
+            metadata[element.tag.rpartition("}")[2]] = (element.text or "").strip()
+    for key in ("id", "version"):
+        if not metadata.get(key):
+            raise NupkgError(f"Nuspec {nuspec_path} has no {key}")
+    return metadata
+
+
+class NupkgWriter:
+    """Writes the parts of a nupkg to a zip file.
+
+    Entries are written as they are added. Each local header is written with
+    placeholder sizes and patched once the entry's data is written, so the
+    output must be seekable. close() writes the central directory.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        level: int = 6,
+        workers: int | None = None,
+        parallel_threshold: int = PARALLEL_THRESHOLD,
+    ) -> None:
+        self.fileobj = fileobj
+        self.level = level
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.entries: list[dict] = []
+        self.closed = False
+
+    def _write_entry(self, name: str, mtime: float, size: int, chunks) -> None:
+        """Writes one deflated entry, given its expected size and an iterable
+        of its data."""
+        encoded_name = name.encode("utf-8")
+        # Deflate can grow incompressible data slightly, so leave some margin
+        # like zipfile does.
+        zip64 = size * 1.05 >= ZIP64_LIMIT
+        dos_time, dos_date = _dos_datetime(mtime)
+        offset = self.fileobj.tell()
+        extra = _zip64_extra(0, 0) if zip64 else b""
+        self.fileobj.write(
+            LOCAL_HEADER.pack(
+                0x04034B50,
+                45 if zip64 else 20,
+                ZIP_UTF8_FLAG,
+                ZIP_DEFLATED,
+                dos_time,
+                dos_date,
+                0,
+                0,
+                0,
+                len(encoded_name),
+                len(extra),
+            )
+        )
+        self.fileobj.write(encoded_name + extra)
+
+        # imported here since autopkglib imports this package with its processors
+        from autopkglib.flatpkg import ParallelDeflateWriter
+
+        workers = self.workers if size >= self.parallel_threshold else 1
+        with ParallelDeflateWriter(self.fileobj, self.level, workers) as deflater:
+            for chunk in chunks:
+                deflater.write(chunk)
+        if not zip64 and max(deflater.size, deflater.compressed_size) >= ZIP64_LIMIT:
+            raise NupkgError(f"{name} grew too large while it was added")
+
+        end = self.fileobj.tell()
+        self.fileobj.seek(offset + 14)
+        if zip64:
+            self.fileobj.write(
+                struct.pack("<III", deflater.crc, ZIP64_MARKER, ZIP64_MARKER)
+            )
+            self.fileobj.seek(offset + LOCAL_HEADER.size + len(encoded_name) + 4)
+            self.fileobj.write(
+                struct.pack("<QQ", deflater.size, deflater.compressed_size)
+            )
+        else:
+            self.fileobj.write(
+                struct.pack(
+                    "<III", deflater.crc, deflater.compressed_size, deflater.size
+                )
+            )
+        self.fileobj.seek(end)
+        self.entries.append(
+            {
+                "name": encoded_name,
+                "offset": offset,
+                "zip64": zip64,
+                "crc": deflater.crc,
+                "size": deflater.size,
+                "compressed_size": deflater.compressed_size,
+                "dos_time": dos_time,
+                "dos_date": dos_date,
+            }
+        )
+
+    def add_bytes(self, name: str, data: bytes, mtime: float | None = None) -> None:
+        """Adds data to the package as the zip entry name."""
+        if mtime is None:
+            mtime = time.time()
+        self._write_entry(name, mtime, len(data), [data])
+
+    def add_file(self, name: str, path: str) -> None:
+        """Adds the file at path to the package as the zip entry name,
+        streaming its data from disk."""
+
+        def read_chunks(f):
+            while chunk := f.read(READ_SIZE):
+                yield chunk
+
+        with open(path, "rb") as f:
+            info = os.fstat(f.fileno())
+            self._write_entry(name, info.st_mtime, info.st_size, read_chunks(f))
+
+    def _write_central_directory(self) -> None:
+        start = self.fileobj.tell()
+        for entry in self.entries:
+            zip64_values = []
+            size, compressed_size, offset = (
+                entry["size"],
+                entry["compressed_size"],
+                entry["offset"],
+            )
+            if entry["zip64"]:
+                zip64_values += [size, compressed_size]
+                size = compressed_size = ZIP64_MARKER
+            if offset >= ZIP64_LIMIT:
+                zip64_values.append(offset)
+                offset = ZIP64_MARKER
+            extra = _zip64_extra(*zip64_values) if zip64_values else b""
+            version = 45 if zip64_values else 20
+            self.fileobj.write(
+                CENTRAL_HEADER.pack(
+                    0x02014B50,
+                    version,
+                    version,
+                    ZIP_UTF8_FLAG,
+                    ZIP_DEFLATED,
+                    entry["dos_time"],
+                    entry["dos_date"],
+                    entry["crc"],
+                    compressed_size,
+                    size,
+                    len(entry["name"]),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0,
+                    offset,
+                )
+            )
+            self.fileobj.write(entry["name"] + extra)
+        end = self.fileobj.tell()
+
+        count, length, offset = len(self.entries), end - start, start
+        if (
+            count >= ZIP_FILECOUNT_LIMIT
+            or length >= ZIP64_LIMIT
+            or offset >= ZIP64_LIMIT
+        ):
+            self.fileobj.write(
+                ZIP64_END_RECORD.pack(
+                    0x06064B50,
+                    ZIP64_END_RECORD.size - 12,
+                    45,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    length,
+                    offset,
+                )
+            )
+            self.fileobj.write(ZIP64_END_LOCATOR.pack(0x07064B50, 0, end, 1))
+            count = ZIP64_COUNT_MARKER if count >= ZIP_FILECOUNT_LIMIT else count
+            length = ZIP64_MARKER if length >= ZIP64_LIMIT else length
+            offset = ZIP64_MARKER if offset >= ZIP64_LIMIT else offset
+        self.fileobj.write(
+            END_RECORD.pack(0x06054B50, 0, 0, count, count, length, offset, 0)
+        )
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._write_central_directory()
+
+
+def _relationships(nuspec_name: str, properties_name: str) -> bytes:
+    relationships = "".join(
+        f"<Relationship Type={quoteattr(RELATIONSHIP_TYPES[kind])} "
+        f"Target={quoteattr('/' + part_name(target))} "
+        f'Id="R{uuid.uuid4().hex[:16].upper()}" />'
+        for kind, target in (
+            ("manifest", nuspec_name),
+            ("core-properties", properties_name),
+        )
+    )
+    return (
+        f"{XML_DECLARATION}<Relationships xmlns="
+        '"http://schemas.openxmlformats.org/package/2006/relationships">'
+        f"{relationships}</Relationships>"
+    ).encode("utf-8")
+
+
+def _core_properties(metadata: dict[str, str]) -> bytes:
+    elements = [
+        ("dc:creator", metadata.get("authors", "")),
+        ("dc:description", metadata.get("description", "")),
+        ("dc:identifier", metadata["id"]),
+        ("version", metadata["version"]),
+        ("keywords", metadata.get("tags", "")),
+        ("dc:title", metadata.get("title", "")),
+        ("lastModifiedBy", "AutoPkg"),
+    ]
+    properties = "".join(f"<{tag}>{escape(text)}</{tag}>" for tag, text in elements)
+    return (
+        f"{XML_DECLARATION}<coreProperties "
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:dcterms="http://purl.org/dc/terms/" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns="http://schemas.openxmlformats.org/package/2006/metadata/'
+        f'core-properties">{properties}</coreProperties>'
+    ).encode("utf-8")
+
+
+def _content_types(names: list[str]) -> bytes:
+    types = {
+        "rels": RELS_CONTENT_TYPE,
+        "psmdcp": CORE_PROPERTIES_CONTENT_TYPE,
+    }
+    overrides = []
+    for name in names:
+        extension = os.path.splitext(os.path.basename(name))[1][1:].lower()
+        if extension:
+            types.setdefault(extension, DEFAULT_CONTENT_TYPE)
+        else:
+            overrides.append(name)
+    defaults = "".join(
+        f"<Default Extension={quoteattr(extension)} "
+        f"ContentType={quoteattr(content_type)} />"
+        for extension, content_type in types.items()
+    )
+    overrides = "".join(
+        f"<Override PartName={quoteattr('/' + part_name(name))} "
+        f"ContentType={quoteattr(DEFAULT_CONTENT_TYPE)} />"
+        for name in overrides
+    )
+    return (
+        f"{XML_DECLARATION}<Types xmlns="
+        '"http://schemas.openxmlformats.org/package/2006/content-types">'
+        f"{defaults}{overrides}</Types>"
+    ).encode("utf-8")
+
+
+def package_files(base_dir: str, nuspec_path: str) -> list[str]:
+    """Returns the sorted paths, relative to base_dir, of the files to
+    package. Like choco pack, files and directories starting with "." and
+    nupkg files are left out, as is the nuspec itself."""
+    files = []
+    nuspec_path = os.path.abspath(nuspec_path)
+    for dirpath, dirnames, filenames in os.walk(base_dir):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if (
+                filename.startswith(".")
+                or filename.lower().endswith(".nupkg")
+                or os.path.abspath(path) == nuspec_path
+            ):
+                continue
+            files.append(os.path.relpath(path, base_dir))
+    return sorted(files)
+
+
+def pack_nupkg(
+    nuspec_path: str,
+    output_dir: str,
+    level: int = 6,
+    workers: int | None = None,
+) -> str:
+    """Packages the nuspec and the files in its directory, like `choco pack`,
+    as `<id>.<version>.nupkg` in output_dir. The package is written to a
+    temporary file and moved into place once complete. Returns the path to
+    the package."""
+    metadata = read_nuspec_metadata(nuspec_path)
+    base_dir = os.path.dirname(os.path.abspath(nuspec_path))
+    files = package_files(base_dir, nuspec_path)
+    nuspec_name = f"{metadata['id']}.nuspec"
+    properties_name = (
+        f"package/services/metadata/core-properties/{uuid.uuid4().hex}.psmdcp"
+    )
+    nupkg_name = f"{metadata['id']}.{metadata['version']}.nupkg"
+    nupkg_path = os.path.abspath(os.path.join(output_dir, nupkg_name))
+
+    with tempfile.NamedTemporaryFile(
+        dir=output_dir, prefix=f".{nupkg_name}.", suffix=".tmp", delete=False
+    ) as f:
+        try:
+            writer = NupkgWriter(f, level=level, workers=workers)
+            writer.add_bytes(
+                "_rels/.rels", _relationships(nuspec_name, properties_name)
+            )
+            writer.add_file(part_name(nuspec_name), nuspec_path)
+            for name in files:
+                writer.add_file(part_name(name), os.path.join(base_dir, name))
+            writer.add_bytes(part_name(properties_name), _core_properties(metadata))
+            writer.add_bytes(
+                "[Content_Types].xml", _content_types([nuspec_name, *files])
+            )
+            writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, nupkg_path)
+    return nupkg_path
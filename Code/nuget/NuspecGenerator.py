@@ -12,21 +12,74 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 from collections.abc import Sequence
+from dataclasses import dataclass
 from io import StringIO
-from typing import TextIO
-
-from nuget.generated._nuspec import (
-    GdsCollector_,
-    contentFilesType,
-    dependenciesType,
-    dependency,
-    licenseType,
-    metadataType,
-    package,
+from typing import TYPE_CHECKING, TextIO
+
+if TYPE_CHECKING:
+    from nuget.generated._nuspec import contentFilesType, licenseType
+
+__all__ = ["NuspecDependency", "NuspecGenerator", "NuspecValidationError"]
+
+NUSPEC_NAMESPACE = "http://schemas.microsoft.com/packaging/2015/06/nuspec.xsd"
+
+# Text elements of <metadata> set by NuspecGenerator, in schema order.
+METADATA_TEXT_ELEMENTS = (
+    "id",
+    "version",
+    "title",
+    "authors",
+    "owners",
+    "licenseUrl",
+    "projectUrl",
+    "iconUrl",
+    "description",
+    "summary",
+    "releaseNotes",
+    "copyright",
+    "tags",
+    "icon",
 )
 
-__all__ = ["NuspecGenerator", "NuspecValidationError"]
+INDENT = "    "
+
+_CDATA = re.compile(r"<!\[CDATA\[.*?\]\]>", re.DOTALL)
+_ATTRIBUTE_SPECIAL = re.compile('[&<>"\n]')
+
+
+def _quote_text(value) -> str:
+    """Escapes element text like generateDS does, leaving CDATA sections as
+    they are."""
+    if not value:
+        return ""
+    text = str(value)
+    quoted = []
+    position = 0
+    for match in _CDATA.finditer(text):
+        quoted.append(_escape(text[position : match.start()]))
+        quoted.append(match.group())
+        position = match.end()
+    quoted.append(_escape(text[position:]))
+    return "".join(quoted)
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _quote_attribute(value) -> str:
+    """Escapes and quotes an attribute value like generateDS does."""
+    text = str(value)
+    if _ATTRIBUTE_SPECIAL.search(text) is None:
+        return '"' + text + '"'
+    text = _escape(text).replace("\n", "&#10;")
+    if '"' not in text:
+        return '"' + text + '"'
+    if "'" not in text:
+        return "'" + text + "'"
+    return '"' + text.replace('"', "&quot;") + '"'
 
 
 class NuspecValidationError(Exception):
@@ -39,8 +92,22 @@ class NuspecValidationError(Exception):
         return f"{self.msg}. Problems: {', '.join(self.errors)}"
 
 
-class NuspecGenerator(package):
-    """NuspecGenerator is a thin wrapper around the `_nuspec.package` generated class."""
+@dataclass
+class NuspecDependency:
+    """A dependency of a Nuget package on another package."""
+
+    id: str
+    version: str | None = None
+    include: str | None = None
+    exclude: str | None = None
+
+
+class NuspecGenerator:
+    """NuspecGenerator describes a Nuget package and renders its `.nuspec`.
+
+    XML is written directly, in the same form as the `_nuspec.package` class
+    generated by `generateDS` exports it. The generated module is only
+    imported to validate the definition against the Nuspec schema."""
 
     def __init__(
         self,
@@ -58,51 +125,138 @@ class NuspecGenerator(package):
         copyright: str | None = None,
         tags: str | None = None,
         icon: str | None = None,
-        license: licenseType | None = None,
-        dependencies: Sequence[dependency] | None = None,
-        contentFiles: contentFilesType | None = None,
+        license: "licenseType | None" = None,
+        dependencies: Sequence[NuspecDependency] | None = None,
+        contentFiles: "contentFilesType | None" = None,
     ):
         if not isinstance(title, str):
             raise NuspecValidationError("Argument 'title' must be a string")
 
-        super().__init__(
-            metadataType(
-                id=id,
-                version=version,
-                title=title,
-                authors=authors,
-                owners=owners,
-                licenseUrl=licenseUrl,
-                projectUrl=projectUrl,
-                iconUrl=iconUrl,
-                description=description,
-                summary=summary,
-                releaseNotes=releaseNotes,
-                copyright=copyright,
-                tags=tags,
-                icon=icon,
-                license=license,
-                dependencies=dependenciesType(dependency=dependencies),
-                contentFiles=contentFiles,
+        self.id = id
+        self.version = version
+        self.title = title
+        self.authors = authors
+        self.owners = owners
+        self.licenseUrl = licenseUrl
+        self.projectUrl = projectUrl
+        self.iconUrl = iconUrl
+        self.description = description
+        self.summary = summary
+        self.releaseNotes = releaseNotes
+        self.copyright = copyright
+        self.tags = tags
+        self.icon = icon
+        self.license = license
+        self.dependencies: list[NuspecDependency] = list(dependencies or [])
+        self.contentFiles = contentFiles
+        self._validated_key: tuple | None = None
+        self.validate()
+
+    def generated_package(self):
+        """Returns the definition as an instance of the `_nuspec.package`
+        class generated by `generateDS`."""
+        from nuget.generated import _nuspec
+
+        return _nuspec.package(
+            _nuspec.metadataType(
+                **{name: getattr(self, name) for name in METADATA_TEXT_ELEMENTS},
+                license=self.license,
+                dependencies=_nuspec.dependenciesType(
+                    dependency=[
+                        _nuspec.dependency(
+                            id=dep.id,
+                            version=dep.version,
+                            include=dep.include,
+                            exclude=dep.exclude,
+                        )
+                        for dep in self.dependencies
+                    ]
+                ),
+                contentFiles=self.contentFiles,
             )
         )
-        self.validate()
+
+    def _definition_key(self) -> tuple:
+        """Returns a snapshot of the definition, used to tell whether it has
+        changed since it was last validated."""
+        key = [getattr(self, name) for name in METADATA_TEXT_ELEMENTS]
+        key.append(
+            tuple(
+                (dep.id, dep.version, dep.include, dep.exclude)
+                for dep in self.dependencies
+            )
+        )
+        for element in (self.license, self.contentFiles):
+            out = StringIO()
+            if element is not None:
+                element.export(out, 0)
+            key.append(out.getvalue())
+        return tuple(key)
 
     def validate(self) -> None:
         """Ensures that the definition is well-formed according to the Nuspec
-        XML schema definition. See Scripts\regenerate_nuspec.ds.py for more details."""
+        XML schema definition. See Scripts\regenerate_nuspec.ds.py for more details.
+
+        The result is kept until the definition changes, so an unchanged
+        definition is only validated once."""
+        key = self._definition_key()
+        if key == self._validated_key:
+            return
+        from nuget.generated._nuspec import GdsCollector_
+
         err_collector = GdsCollector_()
-        if not self.validate_(err_collector, recursive=True):
+        if not self.generated_package().validate_(err_collector, recursive=True):
             raise NuspecValidationError(
                 "Invalid NugetPackage specification", *err_collector.get_messages()
             )
+        self._validated_key = key
+
+    def _write_dependencies(self, out: TextIO, level: int) -> None:
+        indent = INDENT * level
+        if not self.dependencies:
+            out.write(f"{indent}<dependencies/>\n")
+            return
+        lines = [f"{indent}<dependencies>\n"]
+        for dep in self.dependencies:
+            line = f"{indent}{INDENT}<mstns:dependency"
+            if dep.id is not None:
+                line += f" id={_quote_attribute(dep.id)}"
+            if dep.version is not None:
+                line += f" version={_quote_attribute(dep.version)}"
+            if dep.include is not None:
+                line += f" include={_quote_attribute(dep.include)}"
+            if dep.exclude is not None:
+                line += f" exclude={_quote_attribute(dep.exclude)}"
+            lines.append(line + "/>\n")
+        lines.append(f"{indent}</dependencies>\n")
+        out.write("".join(lines))
 
     def render_to(self, out: TextIO) -> None:
         """Writes pretty-printed XML of the Nuget package definition to `out`."""
-        # Call validate before export, as the definition may have been changed.
-        # For example, by a call to `NuspecGenerator.metadata.set_dependencies`.
+        # Call validate before rendering, as the definition may have been
+        # changed. For example, by appending to `NuspecGenerator.dependencies`.
+        # An unchanged definition isn't validated again.
         self.validate()
-        self.export(out, level=0)
+        self._write_xml(out)
+
+    def _write_xml(self, out: TextIO) -> None:
+        out.write(
+            '<package xmlns:mstns="' + NUSPEC_NAMESPACE + '" '
+            'xmlns:None="' + NUSPEC_NAMESPACE + '" >\n' + INDENT + "<metadata>\n"
+        )
+        out.write(
+            "".join(
+                f"{INDENT * 2}<{name}>{_quote_text(value)}</{name}>\n"
+                for name in METADATA_TEXT_ELEMENTS
+                if (value := getattr(self, name)) is not None
+            )
+        )
+        if self.license is not None:
+            self.license.export(out, 2, namespacedef_="", name_="license")
+        self._write_dependencies(out, 2)
+        if self.contentFiles is not None:
+            self.contentFiles.export(out, 2, namespacedef_="", name_="contentFiles")
+        out.write(f"{INDENT}</metadata>\n</package>\n")
 
     def render_str(self) -> str:
         """Render pretty-printed XML and return a `str` representation."""
@@ -18,15 +18,18 @@ from .ChocolateyInstallGenerator import (
     ChocolateyInstallGenerator,
     ChocolateyValidationError,
 )
-from .generated._nuspec import dependency as NuspecDependency
-from .NuspecGenerator import NuspecGenerator, NuspecValidationError
+from .NupkgWriter import NupkgError, NupkgWriter, pack_nupkg
+from .NuspecGenerator import NuspecDependency, NuspecGenerator, NuspecValidationError
 
 __all__ = [
     "CHOCO_CHECKSUM_TYPES",
     "CHOCO_FILE_TYPES",
     "ChocolateyInstallGenerator",
     "ChocolateyValidationError",
+    "NupkgError",
+    "NupkgWriter",
     "NuspecDependency",
     "NuspecGenerator",
     "NuspecValidationError",
+    "pack_nupkg",
 ]
@@ -0,0 +1,189 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+bench_catalog_db.py
+
+Compares building a catalog database from a large synthetic Munki 'all'
+catalog, and matching pkginfo against it, using the list-based tables
+MunkiImporter used before 2.9.1 and the current index arrays.
+
+Usage: bench_catalog_db.py [item count] [lookups]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from autopkglib.MunkiImporter import MunkiImporter  # noqa: E402
+from autopkglib.munkirepolibs.CatalogDB import build_catalog_db  # noqa: E402
+
+
+def make_catalog(count: int) -> list[dict]:
+    """Return count catalog items with receipts, apps and installs files."""
+    items = []
+    for i in range(count):
+        name = f"App{i % (count // 10 or 1)}"
+        version = f"1.{i}"
+        items.append(
+            {
+                "name": name,
+                "version": version,
+                "installer_item_hash": f"{i:064x}",
+                "installer_item_location": f"apps/{name}-{version}.pkg",
+                "receipts": [{"packageid": f"com.example.{name}", "version": version}],
+                "installs": [
+                    {
+                        "type": "application",
+                        "path": f"/Applications/{name}.app",
+                        "CFBundleShortVersionString": version,
+                    },
+                    {
+                        "type": "file",
+                        "path": f"/usr/local/bin/{name.lower()}",
+                        "md5checksum": f"{i:032x}",
+                    },
+                    {"type": "file", "path": f"/Library/{name}/{i % 7}.plist"},
+                ],
+            }
+        )
+    return items
+
+
+def legacy_catalog_db(catalogitems):
+    """Build the catalog database as AutoPkgLib.make_catalog_db did."""
+    pkgid_table, app_table, hash_table = {}, {}, {}
+    checksum_table, files_table = {}, {}
+    for itemindex, item in enumerate(catalogitems):
+        vers = item["version"]
+        hash_table.setdefault(item["installer_item_hash"], []).append(itemindex)
+        for receipt in item.get("receipts", []):
+            pkgid_table.setdefault(receipt["packageid"], {}).setdefault(
+                receipt["version"], []
+            ).append(itemindex)
+        for install in item.get("installs", []):
+            if install["type"] == "application":
+                app_version = install["CFBundleShortVersionString"]
+                if install["path"] not in app_table:
+                    app_table[install["path"]] = {}
+                if vers not in app_table[install["path"]]:
+                    app_table[install["path"]][app_version] = []
+                app_table[install["path"]][app_version].append(itemindex)
+            elif "md5checksum" in install:
+                cksum = install["md5checksum"]
+                if cksum not in list(checksum_table.keys()):
+                    checksum_table[cksum] = []
+                checksum_table[cksum].append(
+                    {"path": install["path"], "index": itemindex}
+                )
+            else:
+                path = install["path"]
+                if path not in list(files_table.keys()):
+                    files_table[path] = []
+                files_table[path].append({"path": path, "index": itemindex})
+    return {
+        "hashes": hash_table,
+        "receipts": pkgid_table,
+        "applications": app_table,
+        "checksums": checksum_table,
+        "files": files_table,
+        "items": catalogitems,
+    }
+
+
+def legacy_find(pkgdb, pkginfo):
+    """Match pkginfo by receipts, then file checksums, as MunkiImporter did."""
+    matching_indexes = []
+    for item in pkginfo.get("receipts", []):
+        match = pkgdb["receipts"].get(item["packageid"], {}).get(item["version"])
+        if not match:
+            return None
+        if not matching_indexes:
+            matching_indexes = set(match)
+        else:
+            matching_indexes = matching_indexes.intersection(set(match))
+    if matching_indexes:
+        return [pkgdb["items"][index] for index in list(matching_indexes)]
+    for fileitem in pkginfo.get("installs", []):
+        if "md5checksum" in fileitem and fileitem["md5checksum"] in pkgdb["checksums"]:
+            for cksum_match in pkgdb["checksums"][fileitem["md5checksum"]]:
+                if cksum_match["path"] == fileitem["path"]:
+                    return [pkgdb["items"][cksum_match["index"]]]
+    return None
+
+
+def make_lookups(catalog: list[dict], count: int) -> list[dict]:
+    """Return pkginfo that match catalog items by receipts or checksums."""
+    lookups = []
+    for item in random.Random(0).sample(catalog, min(count, len(catalog))):
+        lookup = {
+            "name": item["name"],
+            "version": item["version"],
+            "installer_item_hash": "new",
+        }
+        if len(lookups) % 2:
+            lookup["receipts"] = item["receipts"] * 3
+        else:
+            lookup["installs"] = [item["installs"][1]]
+        lookups.append(lookup)
+    return lookups
+
+
+class CatalogLibrary:
+    """Stands in for a repo library with an already built catalog database."""
+
+    def __init__(self, pkgdb):
+        self.pkgdb = pkgdb
+
+    def make_catalog_db(self):
+        return self.pkgdb
+
+
+def measure(name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"{name:<24} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lookup_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    catalog = make_catalog(count)
+    lookups = make_lookups(catalog, lookup_count)
+    print(f"{count} catalog items, {len(lookups)} lookups")
+
+    legacy = measure("legacy build", legacy_catalog_db, catalog)
+    pkgdb = measure("indexed build", build_catalog_db, catalog)
+
+    processor = MunkiImporter()
+    processor.env = {}
+    library = CatalogLibrary(pkgdb)
+    measure(
+        "legacy lookups",
+        lambda: [legacy_find(legacy, lookup) for lookup in lookups],
+    )
+    measure(
+        "indexed lookups",
+        lambda: [
+            processor._find_matching_pkginfo(library, lookup) for lookup in lookups
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
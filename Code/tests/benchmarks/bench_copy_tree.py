@@ -0,0 +1,94 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+bench_copy_tree.py
+
+Compares copying a large synthetic app bundle with shutil.copytree (as
+Copier and AppPkgCreator did before 2.9.1) against the copy engine, with
+one thread and with a thread pool.
+
+Usage: bench_copy_tree.py [file count] [directory] [workers]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from autopkglib.copyengine import copy_tree, describe_copy  # noqa: E402
+
+
+def make_bundle(path: str, count: int) -> int:
+    """Create an app bundle with count files of up to 16 KiB in nested
+    directories, plus a symlink per directory. Returns the bytes written."""
+    total = 0
+    for i in range(count):
+        directory = os.path.join(
+            path, "Contents", "Resources", f"r{i % 50}", f"l{i % 500 // 50}"
+        )
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            os.symlink("../../Info.plist", os.path.join(directory, "link"))
+        data = os.urandom(i * 7919 % 16384)
+        with open(os.path.join(directory, f"file{i}"), "wb") as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def measure(name, func, source, dest):
+    start = time.perf_counter()
+    result = func(source, dest)
+    print(f"{name:<24} {time.perf_counter() - start:8.3f}s")
+    shutil.rmtree(dest)
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    directory = sys.argv[2] if len(sys.argv) > 2 else None
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        source = os.path.join(tmp_dir, "Test.app")
+        total = make_bundle(source, count)
+        print(f"{count} files, {total / 2**20:.1f} MiB bundle in {tmp_dir}")
+        dest = os.path.join(tmp_dir, "Copy.app")
+
+        measure(
+            "shutil.copytree",
+            lambda src, dst: shutil.copytree(src, dst, symlinks=True),
+            source,
+            dest,
+        )
+        stats = measure(
+            "copy_tree, 1 thread",
+            lambda src, dst: copy_tree(src, dst, workers=1),
+            source,
+            dest,
+        )
+        stats = measure(
+            f"copy_tree, {workers} threads",
+            lambda src, dst: copy_tree(src, dst, workers=workers),
+            source,
+            dest,
+        )
+        print(describe_copy(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+bench_nuspec.py
+
+Compares importing the nuget package with importing the generateDS module
+it used to load eagerly, and rendering a nuspec with a large dependency list
+through the generated export methods (as NuspecGenerator did before 2.9.1)
+against the direct writer.
+
+Usage: bench_nuspec.py [dependency count] [import runs]
+"""
+
+import os
+import subprocess
+import sys
+import time
+from io import StringIO
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+sys.path.insert(0, CODE_DIR)
+
+from nuget import NuspecDependency, NuspecGenerator  # noqa: E402
+
+
+def import_time(module: str, runs: int) -> float:
+    """Return the fastest time to import module in a new interpreter."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=CODE_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        times.append(float(output))
+    return min(times)
+
+
+def measure(name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"{name:<28} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def generated_export(generated) -> str:
+    out = StringIO()
+    generated.export(out, level=0)
+    return out.getvalue()
+
+
+def direct_render(nuspec) -> str:
+    out = StringIO()
+    nuspec._write_xml(out)
+    return out.getvalue()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    for module in ("nuget", "nuget.generated._nuspec"):
+        print(f"{'import ' + module:<28} {import_time(module, runs):8.3f}s")
+
+    dependencies = [
+        NuspecDependency(id=f"package-{i}", version=f"[{i}.0,{i + 1}.0)")
+        for i in range(count)
+    ]
+    nuspec = NuspecGenerator(
+        id="a-package",
+        version="1.0.0",
+        title="A package",
+        authors="package people",
+        description="A package with many dependencies",
+        dependencies=dependencies,
+    )
+    print(f"{count} dependencies")
+    measure("validate", nuspec.validate)
+    generated = nuspec.generated_package()
+    legacy = measure("generateDS export", generated_export, generated)
+    direct = measure("direct render", direct_render, nuspec)
+    assert legacy == direct, "renderings differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+bench_sparkle_appcast.py
+
+Compares selecting the latest item from a large synthetic Sparkle appcast by
+parsing the whole document (as SparkleUpdateInfoProvider did before 2.9.1)
+against the streaming parser, reporting time and peak memory for each.
+
+Usage: bench_sparkle_appcast.py [item count] [description size]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from autopkglib import APLooseVersion  # noqa: E402
+from autopkglib.SparkleUpdateInfoProvider import (  # noqa: E402
+    DEFAULT_XMLNS,
+    SparkleUpdateInfoProvider,
+)
+
+
+def make_appcast(count: int, description_size: int) -> bytes:
+    """Return an appcast with count items, each with an HTML description."""
+    items = []
+    for i in range(count):
+        version = (i * 7919) % count
+        items.append(
+            f"<item><title>Version {version}</title>"
+            f"<sparkle:version>{version}</sparkle:version>"
+            f"<sparkle:shortVersionString>1.{version}</sparkle:shortVersionString>"
+            f"<description><![CDATA[<p>{'Fixes. ' * (description_size // 7)}</p>]]>"
+            "</description>"
+            f'<enclosure url="https://example.com/App-{version}.zip" length="1"/>'
+            "</item>"
+        )
+    return (
+        f"<?xml version='1.0' encoding='utf-8'?><rss xmlns:sparkle={DEFAULT_XMLNS!r}>"
+        f"<channel><title>App</title>{''.join(items)}</channel></rss>"
+    ).encode()
+
+
+def whole_document(processor, data):
+    """Select the latest item by parsing the whole document at once."""
+    root = ElementTree.fromstring(data)
+    items = [processor.parse_item(elem) for elem in root.findall("channel/item")]
+    items = [item for item in items if item and not item.get("channel")]
+    return max(items, key=lambda x: APLooseVersion(x["version"]))
+
+
+def streaming(processor, data):
+    """Select the latest item with the streaming parser."""
+    items = processor.iter_feed_items(data, descriptions=False)
+    return processor.latest_items(item for item in items if not item.get("channel"))[0]
+
+
+def measure(name, func, processor, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    latest = func(processor, data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<16} {elapsed:8.3f}s  peak {peak / 2**20:8.1f} MiB  "
+        f"latest {latest['version']}"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    description_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    data = make_appcast(count, description_size)
+    print(f"{count} items, {len(data) / 2**20:.1f} MiB appcast")
+
+    processor = SparkleUpdateInfoProvider()
+    processor.env = {}
+    processor.xmlns = DEFAULT_XMLNS
+    measure("whole document", whole_document, processor, data)
+    measure("streaming", streaming, processor, data)
+
+
+if __name__ == "__main__":
+    main()
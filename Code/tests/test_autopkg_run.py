@@ -342,3 +342,96 @@ TestApp2.recipe
                 self.assertIn("message", failure)
                 self.assertEqual(failure["message"], "Test error")
                 self.assertIn("traceback", failure)
+
+    def test_bulk_check_downloads(self):
+        """Only recipes starting with URLDownloader with a static url are checked."""
+        from autopkglib import xattr
+        from autopkglib.URLDownloader import URLDownloader
+
+        download = os.path.join(
+            self.tmp_dir.name, "com.example.a", "downloads", "a.dmg"
+        )
+        os.makedirs(os.path.dirname(download))
+        with open(download, "w") as f:
+            f.write("a")
+        downloader = URLDownloader()
+        downloader.clear_vars()
+        try:
+            xattr.setxattr(download, downloader.xattr_etag, b'"etag-a"')
+        except Exception:
+            self.skipTest("xattr not available on this platform")
+        recipes = {
+            "A.recipe": {
+                "RECIPE_PATH": "/path/to/A.recipe",
+                "Identifier": "com.example.a",
+                "Input": {"BASE": "https://example.com"},
+                "Process": [
+                    {"Processor": "URLDownloader", "Arguments": {"url": "%BASE%/a.dmg"}}
+                ],
+            },
+            "B.recipe": {
+                "RECIPE_PATH": "/path/to/B.recipe",
+                "Identifier": "com.example.b",
+                "Input": {},
+                "Process": [{"Processor": "SparkleUpdateInfoProvider"}],
+            },
+        }
+        checked = {}
+
+        def check_downloads(checks):
+            checked.update(checks)
+            return {key: "HTTP/1.1 304 Not Modified\r\n\r\n" for key in checks}
+
+        with patch.object(
+            autopkg, "get_all_prefs", return_value={"CACHE_DIR": self.tmp_dir.name}
+        ), patch.object(
+            autopkg, "check_downloads", side_effect=check_downloads
+        ), patch.object(
+            autopkg, "log"
+        ):
+            results = autopkg.bulk_check_downloads(recipes, {}, Mock(verbose=0))
+
+        self.assertEqual(list(checked), ["A.recipe"])
+        url, curl_cmd = checked["A.recipe"]
+        self.assertEqual(url, "https://example.com/a.dmg")
+        self.assertIn('If-None-Match: "etag-a"', curl_cmd)
+        self.assertEqual(
+            results,
+            {
+                "A.recipe": {
+                    "url": "https://example.com/a.dmg",
+                    "pathname": download,
+                    "http_result_code": "304",
+                }
+            },
+        )
+
+    def test_is_true(self):
+        """Boolean preferences given as -k strings should be parsed."""
+        for value in (True, 1, "1", "true", "YES", "on"):
+            self.assertTrue(autopkg.is_true(value), value)
+        for value in (None, False, 0, "", "0", "false", "No", "off"):
+            self.assertFalse(autopkg.is_true(value), value)
+
+    def test_rebuild_munki_catalogs(self):
+        """Changed repos are rebuilt once and reported in the summary."""
+        munki_repo = os.path.join(self.tmp_dir.name, "repo")
+        os.makedirs(os.path.join(munki_repo, "pkgsinfo"))
+        with open(os.path.join(munki_repo, "pkgsinfo", "Foo-1.0.plist"), "wb") as f:
+            plistlib.dump({"name": "Foo", "version": "1.0", "catalogs": ["testing"]}, f)
+        summary_results = {}
+
+        with patch.object(
+            autopkg, "get_all_prefs", return_value={"CACHE_DIR": self.tmp_dir.name}
+        ), patch.object(autopkg, "log_err") as mock_log_err:
+            errors = autopkg.rebuild_munki_catalogs(
+                {(munki_repo, "FileRepo"), (self.tmp_dir.name, "FileRepo")},
+                summary_results,
+                Mock(verbose=0),
+            )
+
+        self.assertEqual(errors, 1)
+        mock_log_err.assert_called_once()
+        rows = summary_results["munki_catalog_builder_summary_result"]["data_rows"]
+        self.assertEqual(rows[0]["catalogs"], "all, testing")
+        self.assertTrue(os.path.exists(os.path.join(munki_repo, "catalogs", "all")))
@@ -5,8 +5,9 @@ import json
 import os
 import plistlib
 import unittest
+from tempfile import TemporaryDirectory
 from textwrap import dedent
-from unittest.mock import mock_open, patch
+from unittest.mock import Mock, mock_open, patch
 
 import autopkglib
 
@@ -247,6 +248,46 @@ class TestAutoPkg(unittest.TestCase):
         id = autopkglib.get_identifier_from_recipe_file("fake")
         self.assertIsNone(id)
 
+    def test_undeclared_summary_results_are_reported_once(self):
+        """Summary results a step sets in env should be in its output, even if
+        they aren't declared as output variables."""
+
+        class Retrying(autopkglib.Processor):
+            input_variables = {}
+            output_variables = {}
+
+            def main(self):
+                self.env["download_retries_summary_result"] = {"data": {"n": 1}}
+
+        class Quiet(autopkglib.Processor):
+            input_variables = {}
+            output_variables = {}
+
+            def main(self):
+                pass
+
+        processors = {"Retrying": Retrying, "Quiet": Quiet}
+        with TemporaryDirectory() as cache_dir:
+            packager = autopkglib.AutoPackager(
+                Mock(verbose=0), {"CACHE_DIR": cache_dir}
+            )
+            with patch.object(
+                autopkglib,
+                "get_processor",
+                side_effect=lambda name, verbose=None: processors[name],
+            ):
+                packager.process(
+                    {
+                        "Identifier": "com.example.summary",
+                        "Input": {},
+                        "Process": [{"Processor": "Retrying"}, {"Processor": "Quiet"}],
+                    }
+                )
+        outputs = [result["Output"] for result in packager.results[1:]]
+        self.assertEqual(
+            outputs, [{"download_retries_summary_result": {"data": {"n": 1}}}, {}]
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
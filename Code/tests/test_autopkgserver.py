@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import socketserver
 import sys
+import threading
+import time
 import types
 import unittest
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, patch
 
 # Mock the imports before importing the module
@@ -41,9 +46,12 @@ SOCKET = autopkgserver.SOCKET
 VERSION = autopkgserver.VERSION
 AutoPkgServer = autopkgserver.AutoPkgServer
 AutoPkgServerError = autopkgserver.AutoPkgServerError
+ForkingAutoPkgServer = autopkgserver.ForkingAutoPkgServer
+ThreadingAutoPkgServer = autopkgserver.ThreadingAutoPkgServer
 PkgHandler = autopkgserver.PkgHandler
 chown_structure = autopkgserver.chown_structure
 main = autopkgserver.main
+parse_args = autopkgserver.parse_args
 request_structure = autopkgserver.request_structure
 
 
@@ -285,6 +293,249 @@ class TestAutoPkgServer(unittest.TestCase):
         self.assertIn("Can't open log", str(ctx.exception))
 
 
+class TestPkgHandlerMetrics(unittest.TestCase):
+    """Test class for per-request metrics logging."""
+
+    @patch("autopkgserver.Path.exists", return_value=True)
+    @patch("autopkgserver.Packager")
+    def test_handle_logs_request_metrics(self, mock_packager, mock_exists):
+        """Should log queue wait and packaging phase times for each request."""
+        plist = {
+            "pkgroot": "/tmp/pkgroot",
+            "pkgdir": "/tmp/output",
+            "pkgname": "TestPackage",
+            "pkgtype": "flat",
+            "id": "com.example.test",
+            "version": "1.0.0",
+            "infofile": "",
+            "chown": [],
+            "scripts": "",
+        }
+        packager = mock_packager.return_value
+        packager.package.return_value = "/tmp/output/TestPackage.pkg"
+        packager.metrics = {"copy": 1.5, "chown": 0.25, "build": 3.0}
+        server = MagicMock()
+        server.accepted_at.return_value = time.monotonic() - 2.0
+        request = MagicMock()
+        request.recv.return_value = autopkgserver.plistlib.dumps(plist)
+
+        with patch.object(PkgHandler, "getpeerid", return_value=(501, (20,))):
+            PkgHandler(request=request, client_address="", server=server)
+
+        request.send.assert_called_with(b"OK:/tmp/output/TestPackage.pkg\n")
+        metrics_calls = [
+            c
+            for c in server.log.info.call_args_list
+            if c.args[0].startswith("Request metrics")
+        ]
+        self.assertEqual(len(metrics_calls), 1)
+        args = metrics_calls[0].args
+        self.assertEqual(args[1], "TestPackage")
+        self.assertGreaterEqual(args[2], 2.0)
+        self.assertEqual(args[3:6], (1.5, 0.25, 3.0))
+
+
+class TestPkgHandlerBatch(unittest.TestCase):
+    """Test class for batched packaging requests."""
+
+    def setUp(self):
+        self.plist = {
+            "pkgroot": "/tmp/pkgroot",
+            "pkgdir": "/tmp/output",
+            "pkgname": "TestPackage",
+            "pkgtype": "flat",
+            "id": "com.example.test",
+            "version": "1.0.0",
+            "infofile": "",
+            "chown": [],
+            "scripts": "",
+        }
+        self.server = MagicMock()
+        self.server.accepted_at.return_value = time.monotonic()
+
+    def handle(self, data: bytes) -> bytes:
+        """Run a handler over data and return everything sent back."""
+        request = MagicMock()
+        # Deliver the message in small pieces to exercise reassembly.
+        chunks = [data[i : i + 100] for i in range(0, len(data), 100)] + [b""]
+        request.recv.side_effect = lambda size: chunks.pop(0)
+        with patch.object(PkgHandler, "getpeerid", return_value=(501, (20,))):
+            PkgHandler(request=request, client_address="", server=self.server)
+        sent = [c.args[0] for c in request.send.call_args_list]
+        sent += [c.args[0] for c in request.sendall.call_args_list]
+        return b"".join(sent)
+
+    @patch("autopkgserver.Path.exists", return_value=True)
+    @patch("autopkgserver.Packager")
+    def test_batch_streams_indexed_results(self, mock_packager, mock_exists):
+        """Each request's result should be prefixed with its index."""
+        mock_packager.return_value.package.side_effect = ["/tmp/a.pkg", "/tmp/b.pkg"]
+        mock_packager.return_value.metrics = {}
+        broken = dict(self.plist)
+        del broken["version"]
+        body = autopkgserver.plistlib.dumps([self.plist, broken, self.plist])
+        reply = self.handle(b"BATCH %d\n" % len(body) + body)
+        self.assertEqual(
+            reply.decode().splitlines(),
+            [
+                "0:OK:/tmp/a.pkg",
+                "1:ERROR:Request is missing key 'version'",
+                "2:OK:/tmp/b.pkg",
+                "DONE",
+            ],
+        )
+        # Peer credentials are checked once per connection.
+        self.assertEqual(mock_packager.call_count, 2)
+
+    def test_batch_with_bad_header_is_rejected(self):
+        """A header without a valid size should be reported as malformed."""
+        self.assertEqual(
+            self.handle(b"BATCH lots\n<plist/>"), b"ERROR:Malformed request\n"
+        )
+
+    def test_batch_must_be_an_array(self):
+        """A batch whose root isn't a non-empty array should be rejected."""
+        body = autopkgserver.plistlib.dumps(self.plist)
+        reply = self.handle(b"BATCH %d\n" % len(body) + body)
+        self.assertEqual(reply, b"ERROR:Malformed request\n")
+
+
+class RecordingHandler(socketserver.BaseRequestHandler):
+    """Handler that records how many requests run at the same time."""
+
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    handled = 0
+
+    def handle(self):
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.running -= 1
+            cls.handled += 1
+
+
+class TestConcurrentServers(unittest.TestCase):
+    """Test class for the threading and forking server modes."""
+
+    @patch("autopkgserver.socket.fromfd")
+    def test_threading_server_limits_concurrency(self, mock_fromfd):
+        """Should never handle more than max_requests requests at once."""
+        RecordingHandler.running = RecordingHandler.peak = 0
+        RecordingHandler.handled = 0
+        server = ThreadingAutoPkgServer(3, RecordingHandler, max_requests=2)
+        for _ in range(5):
+            server.process_request(MagicMock(), None)
+        server.server_close()
+
+        self.assertEqual(RecordingHandler.handled, 5)
+        self.assertEqual(RecordingHandler.peak, 2)
+        self.assertEqual(server.active_requests, 0)
+
+    @patch("autopkgserver.socket.fromfd")
+    def test_serial_server_records_accept_time(self, mock_fromfd):
+        """Accept times should be available while handling and then dropped."""
+        seen = []
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                seen.append(self.server.accepted_at(self.request))
+
+        server = AutoPkgServer(3, Handler)
+        request = MagicMock()
+        before = time.monotonic()
+        server.process_request(request, None)
+
+        self.assertGreaterEqual(seen[0], before)
+        self.assertNotIn(id(request), server._accept_times)
+
+    @patch("autopkgserver.socket.fromfd")
+    def test_threading_server_records_queue_wait(self, mock_fromfd):
+        """Requests waiting for a slot should report the time they waited."""
+        waits = []
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                waits.append(time.monotonic() - self.server.accepted_at(self.request))
+                time.sleep(0.05)
+
+        server = ThreadingAutoPkgServer(3, Handler, max_requests=1)
+        requests = [MagicMock() for _ in range(3)]
+        for request in requests:
+            server.process_request(request, None)
+        self.assertEqual(server.active_requests, 3)
+        server.server_close()
+
+        self.assertEqual(len(waits), 3)
+        # The last request waited for the two before it.
+        self.assertGreaterEqual(max(waits), 0.09)
+        self.assertEqual(server.active_requests, 0)
+        self.assertEqual(server._accept_times, {})
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    @patch("autopkgserver.socket.fromfd")
+    def test_forking_server_caps_children(self, mock_fromfd):
+        """Should fork no more than max_requests children at once, and report
+        the time each request waited for a free slot."""
+        with TemporaryDirectory() as tmp_dir:
+
+            class Handler(socketserver.BaseRequestHandler):
+                def handle(self):
+                    wait = time.monotonic() - self.server.accepted_at(self.request)
+                    path = os.path.join(tmp_dir, str(os.getpid()))
+                    with open(path, "w") as f:
+                        f.write(str(wait))
+                    time.sleep(0.2)
+
+            server = ForkingAutoPkgServer(3, Handler, max_requests=2)
+            self.assertEqual(server.max_children, 2)
+            start = time.monotonic()
+            for _ in range(3):
+                server.process_request(MagicMock(), None)
+                self.assertLessEqual(server.active_requests, 2)
+            # The third child could only start once one of the first two exited.
+            self.assertGreaterEqual(time.monotonic() - start, 0.15)
+            server.server_close()
+
+            waits = []
+            for name in os.listdir(tmp_dir):
+                with open(os.path.join(tmp_dir, name)) as f:
+                    waits.append(float(f.read()))
+            self.assertEqual(len(waits), 3)
+            self.assertGreaterEqual(max(waits), 0.15)
+            self.assertEqual(server._accept_times, {})
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    @patch("autopkgserver.socket.fromfd")
+    def test_forking_server_exits_when_idle(self, mock_fromfd):
+        """An idle timeout should be noted and finished children reaped."""
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                pass
+
+        server = ForkingAutoPkgServer(3, Handler, max_requests=2)
+        server.process_request(MagicMock(), None)
+        self.assertEqual(server.active_requests, 1)
+        time.sleep(0.2)
+        server.handle_timeout()
+        self.assertTrue(server.timed_out)
+        self.assertEqual(server.active_requests, 0)
+        server.server_close()
+
+    def test_parse_args_defaults_to_serial(self):
+        """Should keep the serial server unless a mode is given."""
+        options = parse_args([])
+        self.assertEqual(options.mode, "serial")
+        options = parse_args(["--mode", "thread", "--max-requests", "8"])
+        self.assertEqual(options.mode, "thread")
+        self.assertEqual(options.max_requests, 8)
+
+
 class TestMain(unittest.TestCase):
     """Test class for main function."""
 
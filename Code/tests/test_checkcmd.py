@@ -0,0 +1,72 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+from autopkgcmd.checkcmd import check_downloads
+
+# Prints how many copies of itself are running when it starts
+CONCURRENCY_SCRIPT = """
+import os, sys, time
+path = os.path.join(sys.argv[1], str(os.getpid()))
+open(path, "w").close()
+count = len(os.listdir(sys.argv[1]))
+time.sleep(0.3)
+os.remove(path)
+print(f"HTTP/1.1 304 Not Modified\\n{count}")
+"""
+
+
+class TestCheckDownloads(unittest.TestCase):
+    """Test cases for running download checks concurrently."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cmd = [sys.executable, "-c", CONCURRENCY_SCRIPT, self.tmp_dir.name]
+
+    def concurrency(self, results):
+        return max(int(output.splitlines()[-1]) for output in results.values())
+
+    def test_checks_run_concurrently(self):
+        """Checks against different hosts should run at the same time."""
+        checks = {
+            f"r{i}": (f"https://host{i}.example.com/", self.cmd) for i in range(4)
+        }
+        results = check_downloads(checks)
+        self.assertEqual(sorted(results), ["r0", "r1", "r2", "r3"])
+        self.assertTrue(all(r.startswith("HTTP/1.1 304") for r in results.values()))
+        self.assertGreater(self.concurrency(results), 1)
+
+    def test_per_host_limit(self):
+        """No more than per_host checks should run against one host."""
+        checks = {f"r{i}": ("https://example.com/dl", self.cmd) for i in range(3)}
+        results = check_downloads(checks, per_host=1)
+        self.assertEqual(self.concurrency(results), 1)
+
+    def test_failed_checks_return_none(self):
+        """Commands that fail or can't run should give None."""
+        results = check_downloads(
+            {
+                "fails": ("https://a/", [sys.executable, "-c", "exit(22)"]),
+                "missing": ("https://b/", ["/nonexistent/curl"]),
+            }
+        )
+        self.assertEqual(results, {"fails": None, "missing": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,13 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import subprocess
+import sys
 import unittest
+import unittest.mock
 from collections.abc import Sequence
+from io import StringIO
 from textwrap import dedent
 
 from nuget import (
     ChocolateyInstallGenerator,
     ChocolateyValidationError,
+    NuspecDependency,
     NuspecGenerator,
     NuspecValidationError,
 )
@@ -69,6 +75,76 @@ class TestNuspecGenerator(unittest.TestCase):
                 id=None, title="", version="4.4", authors="people", description=""
             )
 
+        # Dependencies added after construction are validated when rendering.
+        pkg = NuspecGenerator(
+            id="test", title="", version="4.4", authors="people", description=""
+        )
+        pkg.dependencies.append(NuspecDependency(id=None))
+        with self.assertRaises(NuspecValidationError):
+            pkg.render_str()
+
+    def test_nuspec_generator_validates_changes_once(self):
+        """An unchanged definition is only validated once."""
+        pkg = NuspecGenerator(
+            id="test", title="", version="4.4", authors="people", description=""
+        )
+        with unittest.mock.patch.object(
+            pkg, "generated_package", wraps=pkg.generated_package
+        ) as mock_generated:
+            pkg.render_str()
+            pkg.render_str()
+            mock_generated.assert_not_called()
+            pkg.dependencies.append(NuspecDependency(id="dep"))
+            pkg.render_str()
+            pkg.render_str()
+            mock_generated.assert_called_once()
+
+    def test_nuspec_generator_matches_generated_export(self):
+        """The direct writer renders exactly what generateDS exports."""
+        from nuget.generated._nuspec import (
+            contentFileEntries,
+            contentFilesType,
+            licenseType,
+        )
+
+        pkg = NuspecGenerator(
+            id="test<1>",
+            title='Test & "software"',
+            version="0.0.1",
+            authors="python",
+            description="Multiple\nlines <![CDATA[<kept>]]> & more",
+            owners="me",
+            projectUrl="https://example.com/?a=1&b=2",
+            summary="",
+            tags="one two",
+            license=licenseType(type_="expression", valueOf_="MIT"),
+            dependencies=[
+                NuspecDependency(id="dep", version="[1.0,2.0)"),
+                NuspecDependency(id="quoted", include='a"b', exclude="c'd\"e\nf"),
+            ],
+            contentFiles=contentFilesType(
+                files=[contentFileEntries(include="**/*", buildAction="None")]
+            ),
+        )
+        expected = StringIO()
+        pkg.generated_package().export(expected, level=0)
+        self.assertEqual(expected.getvalue(), pkg.render_str())
+
+    def test_nuget_import_skips_generated_module(self):
+        """Importing nuget doesn't load the generateDS module."""
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, nuget; print('nuget.generated._nuspec' in sys.modules)",
+            ],
+            cwd=os.path.join(os.path.dirname(__file__), ".."),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        self.assertEqual(output.strip(), "False")
+
 
 class TestChocolateyInstallGenerator(unittest.TestCase):
 
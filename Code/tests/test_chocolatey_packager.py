@@ -17,13 +17,16 @@ import subprocess
 import sys
 import unittest
 import unittest.mock
+import zipfile
 from copy import deepcopy
 from io import BytesIO
 from tempfile import TemporaryDirectory
 from typing import Any
+from xml.etree import ElementTree as ET
 
-from autopkglib import find_binary
+from autopkglib import ProcessorError, find_binary
 from autopkglib.ChocolateyPackager import ChocolateyPackager
+from nuget import NupkgWriter, NuspecGenerator, pack_nupkg
 
 VarDict = dict[str, Any]
 
@@ -128,3 +131,175 @@ class TestChocolateyPackager(unittest.TestCase):
             env, infile=BytesIO(), outfile=BytesIO
         )._write_chocolatey_install(self.test_dir.name)
         self.assertIn("Write-Output 'Test'\n", get_mocked_writes(openfile_mock))
+
+
+class TestNativeNupkg(unittest.TestCase):
+    """Tests for building packages without choco.exe."""
+
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+        self.build_dir = os.path.join(self.test_dir.name, "build")
+        self.output_dir = os.path.join(self.test_dir.name, "output")
+        os.makedirs(os.path.join(self.build_dir, "tools"))
+        os.mkdir(self.output_dir)
+        self.nuspec_path = os.path.join(self.build_dir, "a-package.nuspec")
+        with open(self.nuspec_path, "w") as f:
+            NuspecGenerator(
+                id="a-package",
+                version="1.4.4",
+                title="A & package",
+                authors="package people",
+                description="Yeah",
+                tags="one two",
+            ).render_to(f)
+        self.files = {
+            "tools/chocolateyInstall.ps1": b"Write-Output 'Test'\n",
+            "tools/setup file.exe": os.urandom(1000) + b"setup" * 1000,
+            "tools/setup file.exe.ignore": b"",
+            "tools/LICENSE": b"license",
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.build_dir, name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_pack_nupkg_layout(self):
+        """The package has the parts choco pack writes, in the same order."""
+        for name in (".git/config", ".DS_Store", "old.nupkg"):
+            path = os.path.join(self.build_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("skip")
+        path = pack_nupkg(self.nuspec_path, self.output_dir)
+        self.assertEqual(path, os.path.join(self.output_dir, "a-package.1.4.4.nupkg"))
+        self.assertEqual(os.listdir(self.output_dir), ["a-package.1.4.4.nupkg"])
+
+        with zipfile.ZipFile(path) as nupkg:
+            self.assertIsNone(nupkg.testzip())
+            names = nupkg.namelist()
+            self.assertEqual(
+                names[:6],
+                [
+                    "_rels/.rels",
+                    "a-package.nuspec",
+                    "tools/LICENSE",
+                    "tools/chocolateyInstall.ps1",
+                    "tools/setup%20file.exe",
+                    "tools/setup%20file.exe.ignore",
+                ],
+            )
+            self.assertRegex(
+                names[6], r"^package/services/metadata/core-properties/\w+\.psmdcp$"
+            )
+            self.assertEqual(names[7], "[Content_Types].xml")
+            for name, data in self.files.items():
+                self.assertEqual(nupkg.read(name.replace(" ", "%20")), data)
+
+            types = ET.fromstring(nupkg.read("[Content_Types].xml"))
+            defaults = {
+                item.get("Extension"): item.get("ContentType")
+                for item in types
+                if item.tag.endswith("Default")
+            }
+            self.assertEqual(defaults["nuspec"], "application/octet")
+            self.assertEqual(defaults["exe"], "application/octet")
+            self.assertIn("relationships", defaults["rels"])
+            self.assertIn("core-properties", defaults["psmdcp"])
+            overrides = [
+                item.get("PartName") for item in types if item.tag.endswith("Override")
+            ]
+            self.assertEqual(overrides, ["/tools/LICENSE"])
+
+            rels = ET.fromstring(nupkg.read("_rels/.rels"))
+            targets = {item.get("Type"): item.get("Target") for item in rels}
+            self.assertEqual(
+                targets["http://schemas.microsoft.com/packaging/2010/07/manifest"],
+                "/a-package.nuspec",
+            )
+            self.assertIn("/" + names[6], targets.values())
+
+            properties = nupkg.read(names[6]).decode()
+            self.assertIn("<dc:identifier>a-package</dc:identifier>", properties)
+            self.assertIn("<dc:title>A &amp; package</dc:title>", properties)
+            self.assertIn("<keywords>one two</keywords>", properties)
+
+    def test_parallel_compression(self):
+        """Large files compressed in parallel chunks read back intact."""
+        data = b"".join(os.urandom(64) * 4096 for _ in range(40))
+        out = BytesIO()
+        writer = NupkgWriter(out, level=1, workers=2, parallel_threshold=1024)
+        writer.add_bytes("tools/large.bin", data)
+        writer.add_bytes("tools/small.txt", b"small")
+        writer.close()
+        with zipfile.ZipFile(out) as nupkg:
+            self.assertIsNone(nupkg.testzip())
+            self.assertEqual(nupkg.read("tools/large.bin"), data)
+            self.assertEqual(nupkg.read("tools/small.txt"), b"small")
+            self.assertLess(nupkg.getinfo("tools/large.bin").compress_size, len(data))
+
+    def test_zip64(self):
+        """Entries, offsets and counts past the zip limits use zip64 records."""
+        out = BytesIO()
+        with unittest.mock.patch.multiple(
+            "nuget.NupkgWriter", ZIP64_LIMIT=2000, ZIP_FILECOUNT_LIMIT=3
+        ):
+            writer = NupkgWriter(out)
+            for i in range(4):
+                writer.add_bytes(f"tools/file{i}", os.urandom(1000 * i))
+            writer.close()
+        self.assertIn(b"PK\x06\x06", out.getvalue())
+        with zipfile.ZipFile(out) as nupkg:
+            self.assertIsNone(nupkg.testzip())
+            self.assertEqual(len(nupkg.infolist()), 4)
+            self.assertEqual(nupkg.getinfo("tools/file3").file_size, 3000)
+
+    def test_processor_without_choco(self):
+        """The processor builds the package natively if choco.exe is missing."""
+        installer = os.path.join(self.test_dir.name, "setup.exe")
+        with open(installer, "wb") as f:
+            f.write(b"installer")
+        env = {
+            "RECIPE_CACHE_DIR": self.test_dir.name,
+            "chocoexe_path": os.path.join(self.test_dir.name, "choco.exe"),
+            "id": "a-package",
+            "version": "1.4.4",
+            "title": "A package",
+            "authors": "package people",
+            "description": "Yeah",
+            "installer_path": installer,
+            "installer_type": "exe",
+            "output_directory": self.output_dir,
+            "nupkg_compression_level": 9,
+        }
+        result_env = ChocolateyPackager(
+            env, infile=BytesIO(), outfile=BytesIO()
+        ).process()
+        path = os.path.join(self.output_dir, "a-package.1.4.4.nupkg")
+        self.assertEqual(result_env["nuget_package_path"], path)
+        with zipfile.ZipFile(path) as nupkg:
+            self.assertEqual(nupkg.read("tools/setup.exe"), b"installer")
+            self.assertIn("tools/chocolateyInstall.ps1", nupkg.namelist())
+
+    def test_invalid_compression_level(self):
+        """Compression levels outside 0-9 are rejected."""
+        processor = ChocolateyPackager(
+            {"chocoexe_path": "/nonexistent", "nupkg_compression_level": 10},
+            infile=BytesIO(),
+            outfile=BytesIO(),
+        )
+        with self.assertRaises(ProcessorError):
+            processor.main()
+
+    def test_invalid_dependency(self):
+        """Dependencies with missing or unknown keys are reported clearly."""
+        for dependencies in ([{"version": "1.0"}], [{"id": "a", "versions": "1"}]):
+            processor = ChocolateyPackager(
+                {"id": "test", "dependencies": dependencies},
+                infile=BytesIO(),
+                outfile=BytesIO(),
+            )
+            with self.subTest(dependencies=dependencies):
+                with self.assertRaises(ProcessorError):
+                    processor.nuspec_definition()
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import plistlib
 import unittest
 from tempfile import TemporaryDirectory
 from unittest.mock import Mock, patch
@@ -475,6 +476,224 @@ class TestCodeSignatureVerifier(unittest.TestCase):
         mock_output.assert_any_call("some stdout output")
         mock_output.assert_any_call("some stderr output")
 
+    # Test verification of multiple paths
+    def _make_apps(self, *names):
+        paths = []
+        for name in names:
+            path = os.path.join(self.tmp_dir.name, name)
+            os.makedirs(path)
+            paths.append(path)
+        return paths
+
+    def _sign_apps(self, *apps):
+        """Gives apps a main executable and CodeResources."""
+        for app in apps:
+            contents = os.path.join(app, "Contents")
+            os.makedirs(os.path.join(contents, "MacOS"))
+            os.makedirs(os.path.join(contents, "_CodeSignature"))
+            with open(os.path.join(contents, "Info.plist"), "wb") as f:
+                plistlib.dump({"CFBundleExecutable": "App"}, f)
+            with open(os.path.join(contents, "MacOS", "App"), "wb") as f:
+                f.write(b"executable")
+            with open(
+                os.path.join(contents, "_CodeSignature", "CodeResources"), "w"
+            ) as f:
+                f.write("resources")
+
+    def test_main_verifies_all_matches(self):
+        """With verify_all_matches, every glob match should be verified."""
+        apps = self._make_apps("One.app", "Two.app", "Three.app")
+        self.processor.env.update(
+            {
+                "input_path": os.path.join(self.tmp_dir.name, "*.app"),
+                "verify_all_matches": True,
+                "verification_workers": 2,
+            }
+        )
+        with patch.object(self.processor, "process_code_signature") as mock_process:
+            self.processor.main()
+        self.assertEqual(
+            sorted(c.args[0] for c in mock_process.call_args_list), sorted(apps)
+        )
+
+    def test_verify_paths_reports_every_failure(self):
+        """All paths should be verified even if some fail."""
+        apps = self._make_apps("Good.app", "Bad.app", "Worse.app")
+
+        def process(path, nested=False):
+            if "Good" not in path:
+                raise ProcessorError("invalid signature")
+
+        with patch.object(
+            self.processor, "process_code_signature", side_effect=process
+        ) as mock_process:
+            with self.assertRaisesRegex(ProcessorError, "Bad.app, .*Worse.app"):
+                self.processor.verify_paths(apps)
+        self.assertEqual(mock_process.call_count, 3)
+
+    def test_verify_paths_buffers_worker_output(self):
+        """Output from workers should be grouped under each path."""
+        self.processor.env["verbose"] = 1
+        apps = self._make_apps("One.app", "Two.app")
+
+        def process(path, nested=False):
+            self.processor.output(f"checked {os.path.basename(path)}")
+
+        with patch.object(
+            self.processor, "process_code_signature", side_effect=process
+        ):
+            with patch("builtins.print") as mock_print:
+                self.processor.verify_paths(apps)
+        printed = [c.args[0] for c in mock_print.call_args_list]
+        self.assertEqual(
+            printed[1:],
+            [
+                f"CodeSignatureVerifier: {apps[0]}:",
+                "CodeSignatureVerifier:   checked One.app",
+                f"CodeSignatureVerifier: {apps[1]}:",
+                "CodeSignatureVerifier:   checked Two.app",
+            ],
+        )
+
+    def test_find_nested_items(self):
+        """Nested apps and pkgs should be found, but not inside pkgs."""
+        app = self._make_apps("Outer.app/Contents/Library/LoginItems/Helper.app")[0]
+        outer = os.path.join(self.tmp_dir.name, "Outer.app")
+        resources = os.path.join(outer, "Contents", "Resources")
+        os.makedirs(os.path.join(resources, "Bundle.pkg", "Contents", "Inner.pkg"))
+        open(os.path.join(resources, "Flat.pkg"), "w").close()
+        self.assertEqual(
+            self.processor.find_nested_items(outer),
+            sorted(
+                [
+                    app,
+                    os.path.join(resources, "Bundle.pkg"),
+                    os.path.join(resources, "Flat.pkg"),
+                ]
+            ),
+        )
+
+    def test_cached_verification_is_skipped(self):
+        """Unchanged paths verified with the same options should be skipped."""
+        apps = self._make_apps("One.app", "Two.app")
+        self._sign_apps(*apps)
+        self.processor.env.update(
+            {
+                "RECIPE_CACHE_DIR": self.tmp_dir.name,
+                "cache_verification_results": True,
+                "requirement": "anchor apple",
+            }
+        )
+        with patch.object(self.processor, "process_code_signature") as mock_process:
+            self.processor.verify_paths(apps)
+            self.assertEqual(mock_process.call_count, 2)
+            self.processor.verify_paths(apps)
+            self.assertEqual(mock_process.call_count, 2)
+            # A changed file or changed options invalidate the result.
+            with open(os.path.join(apps[0], "Contents", "MacOS", "App"), "ab") as f:
+                f.write(b"changed")
+            self.processor.verify_paths(apps)
+            self.assertEqual(mock_process.call_count, 3)
+            self.processor.env["requirement"] = "anchor apple generic"
+            self.processor.verify_paths(apps)
+            self.assertEqual(mock_process.call_count, 5)
+
+    def test_changed_bundle_resource_invalidates_cache(self):
+        """A file changed anywhere in a bundle should be verified again."""
+        app = self._make_apps("One.app")
+        self._sign_apps(*app)
+        resource = os.path.join(app[0], "Contents", "Resources", "image.png")
+        os.makedirs(os.path.dirname(resource))
+        open(resource, "w").close()
+        self.processor.env.update(
+            {
+                "RECIPE_CACHE_DIR": self.tmp_dir.name,
+                "cache_verification_results": True,
+            }
+        )
+        with patch.object(self.processor, "process_code_signature") as mock_process:
+            self.processor.verify_paths(app)
+            with open(resource, "w") as f:
+                f.write("tampered")
+            self.processor.verify_paths(app)
+        self.assertEqual(mock_process.call_count, 2)
+
+    def test_unsigned_bundle_is_not_cached(self):
+        """Bundles without CodeResources can't be identified, so aren't cached."""
+        app = self._make_apps("One.app")
+        self.processor.env.update(
+            {
+                "RECIPE_CACHE_DIR": self.tmp_dir.name,
+                "cache_verification_results": True,
+            }
+        )
+        with patch.object(self.processor, "process_code_signature") as mock_process:
+            for _ in range(2):
+                self.processor.verify_paths(app)
+        self.assertEqual(mock_process.call_count, 2)
+
+    def test_cache_disabled_without_recipe_cache_dir(self):
+        """Results should not be written to the working directory."""
+        self.processor.env["cache_verification_results"] = True
+        self.processor.env.pop("RECIPE_CACHE_DIR", None)
+        self.assertIsNone(self.processor.verification_cache_path())
+
+    def test_nested_items_use_nested_requirement(self):
+        """Nested code should be checked against the nested options."""
+        outer = os.path.join(self.tmp_dir.name, "Outer.app")
+        helper = self._make_apps("Outer.app/Contents/Library/Helper.app")[0]
+        self.processor.env.update(
+            {
+                "input_path": outer,
+                "verify_nested": True,
+                "requirement": "identifier outer",
+                "nested_requirement": "identifier helper",
+            }
+        )
+        with patch.object(
+            self.processor, "codesign_verify", return_value=True
+        ) as mock_verify:
+            self.processor.main()
+        calls = {c.args[0]: c for c in mock_verify.call_args_list}
+        self.assertEqual(calls[outer].args[1], "identifier outer")
+        self.assertEqual(calls[helper].args[1], "identifier helper")
+        self.assertTrue(calls[helper].kwargs["strict_verification"])
+        self.assertTrue(calls[helper].kwargs["deep_verification"])
+
+    def test_nested_pkg_uses_nested_authority_names(self):
+        """Nested packages should not be held to the parent's authorities."""
+        self.processor.env.update(
+            {
+                "expected_authority_names": ["Outer"],
+                "nested_expected_authority_names": ["Inner"],
+            }
+        )
+        with patch.object(
+            self.processor, "pkgutil_check_signature", return_value=(True, ["Inner"])
+        ):
+            self.processor.process_installer_package("/Inner.pkg", nested=True)
+            with self.assertRaises(ProcessorError):
+                self.processor.process_installer_package("/Inner.pkg")
+
+    def test_failed_verification_is_not_cached(self):
+        """Failures should be verified again on the next run."""
+        app = self._make_apps("One.app")
+        self.processor.env.update(
+            {
+                "RECIPE_CACHE_DIR": self.tmp_dir.name,
+                "cache_verification_results": True,
+            }
+        )
+        with patch.object(
+            self.processor,
+            "process_code_signature",
+            side_effect=ProcessorError("invalid"),
+        ) as mock_process:
+            for _ in range(2):
+                with self.assertRaises(ProcessorError):
+                    self.processor.verify_paths(app)
+        self.assertEqual(mock_process.call_count, 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,12 @@
 #!/usr/local/autopkg/python
 
+import os
 import plistlib
 import unittest
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, copyengine
 from autopkglib.Copier import Copier
 
 
@@ -108,5 +110,99 @@ class TestCopier(unittest.TestCase):
         )
 
 
+class TestCopyEngine(unittest.TestCase):
+    """Test class for the copy engine shared by Copier and AppPkgCreator."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.source = os.path.join(self.tmp_dir.name, "Test.app")
+        macos = os.path.join(self.source, "Contents", "MacOS")
+        os.makedirs(macos)
+        self.write(os.path.join(self.source, "Contents", "Info.plist"), b"<plist/>")
+        self.write(os.path.join(macos, "Test"), b"binary" * 100, 0o755)
+        for i in range(20):
+            self.write(os.path.join(self.source, "Contents", f"file{i}"), b"x" * i)
+        os.symlink("MacOS/Test", os.path.join(self.source, "Contents", "link"))
+        os.utime(macos, (1000000000, 1000000000))
+
+    def write(self, path, data, mode=0o644):
+        with open(path, "wb") as f:
+            f.write(data)
+        os.chmod(path, mode)
+
+    def assertSameTree(self, source, dest):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dest_dir = os.path.join(dest, os.path.relpath(dirpath, source))
+            self.assertEqual(sorted(os.listdir(dest_dir)), sorted(dirnames + filenames))
+            self.assertEqual(
+                os.stat(dest_dir).st_mtime_ns, os.stat(dirpath).st_mtime_ns
+            )
+            for name in filenames:
+                src, dst = os.path.join(dirpath, name), os.path.join(dest_dir, name)
+                self.assertEqual(os.path.islink(dst), os.path.islink(src))
+                if os.path.islink(src):
+                    self.assertEqual(os.readlink(dst), os.readlink(src))
+                    continue
+                with open(src, "rb") as fsrc, open(dst, "rb") as fdst:
+                    self.assertEqual(fdst.read(), fsrc.read())
+                self.assertEqual(os.stat(dst).st_mode, os.stat(src).st_mode)
+
+    def test_copy_tree(self):
+        """Trees should be copied with symlinks and metadata, in parallel or not."""
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                dest = os.path.join(self.tmp_dir.name, f"dest{workers}", "Test.app")
+                stats = copyengine.copy_item(self.source, dest, workers=workers)
+                self.assertSameTree(self.source, dest)
+                self.assertEqual(stats["files"], 22)
+                self.assertEqual(stats["bytes"], 8 + 600 + sum(range(20)))
+
+    def test_copy_tree_existing_destination(self):
+        """Trees should only be copied to a new destination."""
+        dest = os.path.join(self.tmp_dir.name, "dest")
+        os.mkdir(dest)
+        with self.assertRaises(FileExistsError):
+            copyengine.copy_tree(self.source, dest)
+
+    def test_copy_tree_without_clones(self):
+        """Cloning should only be tried once if it isn't supported."""
+        dest = os.path.join(self.tmp_dir.name, "dest")
+        unavailable = copyengine.CopyUnavailable("no clones here")
+        with (
+            patch.object(copyengine, "_clonefile", return_value=None),
+            patch.object(
+                copyengine, "clone_file", side_effect=unavailable
+            ) as mock_clone,
+        ):
+            stats = copyengine.copy_tree(self.source, dest, workers=1)
+        mock_clone.assert_called_once()
+        self.assertEqual(stats["cloned"], 0)
+        self.assertSameTree(self.source, dest)
+
+    def test_copy_item_file(self):
+        """Files should replace the destination, or be copied into a directory."""
+        source = os.path.join(self.source, "Contents", "MacOS", "Test")
+        dest_dir = os.path.join(self.tmp_dir.name, "dest")
+        os.mkdir(dest_dir)
+        copyengine.copy_item(source, dest_dir)
+        dest = os.path.join(dest_dir, "Test")
+        self.write(dest, b"old")
+        stats = copyengine.copy_item(source, dest)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), b"binary" * 100)
+        self.assertEqual(os.stat(dest).st_mode & 0o777, 0o755)
+        self.assertEqual((stats["files"], stats["bytes"]), (1, 600))
+
+    def test_copier_overwrites_tree(self):
+        """Copier should replace an existing tree when overwriting."""
+        dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(os.path.join(dest, "stale"))
+        processor = Copier()
+        processor.env = {}
+        processor.copy(self.source, dest, overwrite=True)
+        self.assertSameTree(self.source, dest)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,13 @@
 #!/usr/local/autopkg/python
 
+import glob
+import os
 import plistlib
 import unittest
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, globengine
 from autopkglib.FileFinder import FileFinder
 
 
@@ -58,5 +61,104 @@ class TestFileFinder(unittest.TestCase):
         self.assertEqual(self.processor.env["dmg_found_filename"], "whatever")
 
 
+class TestGlobEngine(unittest.TestCase):
+    """Test class for the glob engine shared by FileFinder and Copier."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = self.tmp_dir.name
+        for path in (
+            "Payload/Test.app/Contents/Info.plist",
+            "Payload/Test.app/Contents/MacOS/Test",
+            "Payload/Other.app/Contents/Info.plist",
+            "Payload/.hidden/Hidden.app/Contents/Info.plist",
+            "Payload/Tools/readme.txt",
+            "Payload/.DS_Store",
+        ):
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+        os.symlink("Test.app", os.path.join(self.root, "Payload", "Link.app"))
+
+    def path(self, pattern):
+        return os.path.join(self.root, pattern)
+
+    def count_scans(self):
+        return patch.object(globengine, "_scan", wraps=globengine._scan)
+
+    def test_matches_like_glob(self):
+        """Matches should be the same as glob.glob's."""
+        for pattern in (
+            "Payload/*",
+            "Payload/*/",
+            "Payload/.*",
+            "Payload/**",
+            "Payload/**/",
+            "Payload/**/Info.plist",
+            "Payload/**/*.app/Contents/Info.plist",
+            "Payload/[LO]*.app/**/I*",
+            "Payload/Test.app/Contents/?nfo.plist",
+            "Payload/Missing/*",
+        ):
+            for recursive in (True, False):
+                with self.subTest(pattern=pattern, recursive=recursive):
+                    self.assertEqual(
+                        sorted(globengine.glob(self.path(pattern), recursive)),
+                        sorted(glob.glob(self.path(pattern), recursive=recursive)),
+                    )
+
+    def test_first_and_last_match(self):
+        """first_match should stop early and last_match should sort paths."""
+        pattern = self.path("Payload/**/Info.plist")
+        self.assertEqual(
+            globengine.last_match(pattern, recursive=True),
+            max(glob.glob(pattern, recursive=True)),
+        )
+        with self.count_scans() as mock_scan:
+            first = globengine.first_match(pattern, recursive=True)
+        self.assertEqual(first, self.path("Payload/Link.app/Contents/Info.plist"))
+        self.assertLess(mock_scan.call_count, 4)
+        self.assertIsNone(globengine.first_match(self.path("*.pkg")))
+
+    def test_recipe_listing_cache(self):
+        """Listings should be reused within a recipe until a directory changes."""
+        pattern = self.path("Payload/*/Contents/*.plist")
+        scope = globengine.cache_scope({"RUN_ID": "run1", "RECIPE_CACHE_DIR": "a"})
+        with self.count_scans() as mock_scan:
+            first = globengine.glob(pattern, cache_scope=scope)
+            scans = mock_scan.call_count
+            self.assertEqual(globengine.glob(pattern, cache_scope=scope), first)
+            self.assertEqual(mock_scan.call_count, scans)
+        new_file = self.path("Payload/Other.app/Contents/version.plist")
+        open(new_file, "w").close()
+        os.utime(os.path.dirname(new_file), ns=(0, 0))
+        self.assertIn(new_file, globengine.glob(pattern, cache_scope=scope))
+        self.assertIsNone(globengine.cache_scope({"RECIPE_CACHE_DIR": "a"}))
+        # the next recipe starts with an empty cache
+        next_scope = globengine.cache_scope({"RUN_ID": "run1", "RECIPE_CACHE_DIR": "b"})
+        with self.count_scans() as mock_scan:
+            globengine.glob(pattern, cache_scope=next_scope)
+            self.assertEqual(mock_scan.call_count, scans)
+        self.assertEqual(globengine._listings_scope, next_scope)
+
+    def test_listing_cache_is_bounded(self):
+        """Only the most recently used listings should be kept."""
+        with patch.object(globengine, "MAX_CACHED_LISTINGS", 2):
+            globengine.glob(self.path("Payload/*/Contents/*"), cache_scope=("r", "c"))
+        self.assertEqual(len(globengine._listings), 2)
+
+    def test_globfind(self):
+        """globfind should return the last matching path when sorted."""
+        processor = FileFinder()
+        processor.env = {}
+        self.assertEqual(
+            processor.globfind(self.path("Payload/*.app")),
+            self.path("Payload/Test.app"),
+        )
+        with self.assertRaises(ProcessorError):
+            processor.globfind(self.path("Payload/*.pkg"))
+
+
 if __name__ == "__main__":
     unittest.main()
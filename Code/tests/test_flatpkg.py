@@ -0,0 +1,305 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import os
+import struct
+import unittest
+import zlib
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from xml.etree import ElementTree as ET
+
+from autopkglib.flatpkg import (
+    FlatPackageBuilder,
+    FlatPackageError,
+    ParallelGzipWriter,
+    XarReader,
+    posix_cksum,
+)
+from autopkglib.PkgCreator import PkgCreator
+from tests import get_processor_module
+
+
+def read_cpio(data: bytes) -> dict[str, dict]:
+    """Parse an odc cpio archive into {name: header fields and data}."""
+    entries = {}
+    offset = 0
+    while True:
+        header = data[offset : offset + 76]
+        assert header[:6] == b"070707", header
+        mode = int(header[18:24], 8)
+        uid = int(header[24:30], 8)
+        gid = int(header[30:36], 8)
+        namesize = int(header[59:65], 8)
+        filesize = int(header[65:76], 8)
+        offset += 76
+        name = data[offset : offset + namesize - 1].decode()
+        offset += namesize
+        if name == "TRAILER!!!":
+            return entries
+        entries[name] = {
+            "mode": mode,
+            "uid": uid,
+            "gid": gid,
+            "data": data[offset : offset + filesize],
+        }
+        offset += filesize
+
+
+def read_bom_paths(data: bytes) -> list[str]:
+    """Return the full paths stored in a Bom file, in storage order."""
+    assert data[:8] == b"BOMStore"
+    index_offset, _, vars_offset, _ = struct.unpack(">IIII", data[16:32])
+    (block_count,) = struct.unpack(">I", data[index_offset : index_offset + 4])
+
+    def block(index):
+        address, length = struct.unpack(
+            ">II", data[index_offset + 4 + index * 8 : index_offset + 12 + index * 8]
+        )
+        return data[address : address + length]
+
+    variables = {}
+    (count,) = struct.unpack(">I", data[vars_offset : vars_offset + 4])
+    offset = vars_offset + 4
+    for _ in range(count):
+        index, length = struct.unpack(">IB", data[offset : offset + 5])
+        variables[data[offset + 5 : offset + 5 + length].decode()] = index
+        offset += 5 + length
+
+    tree = block(variables["Paths"])
+    assert tree[:4] == b"tree"
+    (child,) = struct.unpack(">I", tree[8:12])
+    page = block(child)
+    while struct.unpack(">H", page[:2])[0] == 0:
+        page = block(struct.unpack(">I", page[12:16])[0])
+
+    names = {}
+    paths = []
+    while True:
+        is_leaf, count, forward, _ = struct.unpack(">HHII", page[:12])
+        for i in range(count):
+            info1, name_index = struct.unpack(">II", page[12 + i * 8 : 20 + i * 8])
+            path_id = struct.unpack(">I", block(info1)[:4])[0]
+            name_block = block(name_index)
+            parent = struct.unpack(">I", name_block[:4])[0]
+            name = name_block[4:].rstrip(b"\0").decode()
+            names[path_id] = f"{names[parent]}/{name}" if parent else name
+            paths.append(names[path_id])
+        if not forward:
+            return paths
+        page = block(forward)
+
+
+class TestPosixCksum(unittest.TestCase):
+    """Test class for posix_cksum."""
+
+    def test_known_values(self):
+        """Values should match the output of cksum(1)."""
+        self.assertEqual(posix_cksum(b""), 4294967295)
+        self.assertEqual(posix_cksum(b"a"), 1220704766)
+        self.assertEqual(posix_cksum(b"hello world\n"), 3733384285)
+
+
+class TestParallelGzipWriter(unittest.TestCase):
+    """Test class for ParallelGzipWriter."""
+
+    def test_multi_chunk_round_trip(self):
+        """Chunks compressed in parallel should form one valid gzip stream."""
+        data = os.urandom(50000) + b"abcdefgh" * 40000
+        for workers in (1, 4):
+            out = io.BytesIO()
+            with ParallelGzipWriter(out, workers=workers, chunk_size=16384) as gz:
+                for i in range(0, len(data), 7000):
+                    gz.write(data[i : i + 7000])
+            self.assertEqual(gzip.decompress(out.getvalue()), data)
+
+    def test_empty_stream(self):
+        """Closing without writing should produce a valid empty gzip stream."""
+        out = io.BytesIO()
+        ParallelGzipWriter(out, workers=2).close()
+        self.assertEqual(gzip.decompress(out.getvalue()), b"")
+
+
+class TestFlatPackageBuilder(unittest.TestCase):
+    """Test class for FlatPackageBuilder."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.pkgroot = os.path.join(self.tmp_dir.name, "payload")
+        self.pkgdir = os.path.join(self.tmp_dir.name, "out")
+        os.makedirs(os.path.join(self.pkgroot, "Applications", "Test.app", "Contents"))
+        os.makedirs(self.pkgdir)
+        self.big_data = os.urandom(300000)
+        with open(
+            os.path.join(self.pkgroot, "Applications", "Test.app", "Contents", "Big"),
+            "wb",
+        ) as f:
+            f.write(self.big_data)
+        tool = os.path.join(self.pkgroot, "Applications", "Test.app", "tool")
+        with open(tool, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(tool, 0o755)
+        os.symlink(
+            "Contents/Big",
+            os.path.join(self.pkgroot, "Applications", "Test.app", "link"),
+        )
+        self.request = {
+            "pkgroot": self.pkgroot,
+            "pkgdir": self.pkgdir,
+            "pkgname": "Test-1.0",
+            "pkgtype": "flat",
+            "id": "com.example.test",
+            "version": "1.0",
+            "infofile": "",
+            "chown": [{"path": "Applications", "user": "root", "group": "admin"}],
+            "scripts": "",
+        }
+
+    def build(self, **kwargs):
+        return XarReader(FlatPackageBuilder(self.request, **kwargs).build())
+
+    def test_round_trip_members(self):
+        """The xar reader should find all component package members."""
+        reader = self.build(workers=2)
+        self.assertEqual(sorted(reader.names()), ["Bom", "PackageInfo", "Payload"])
+        self.assertTrue(os.path.exists(os.path.join(self.pkgdir, "Test-1.0.pkg")))
+        # No temporary files should be left behind.
+        self.assertEqual(os.listdir(self.pkgdir), ["Test-1.0.pkg"])
+
+    def test_round_trip_payload(self):
+        """The payload should contain the pkgroot with chown applied."""
+        payload = read_cpio(gzip.decompress(self.build().read("Payload")))
+        self.assertEqual(
+            sorted(payload),
+            [
+                ".",
+                "./Applications",
+                "./Applications/Test.app",
+                "./Applications/Test.app/Contents",
+                "./Applications/Test.app/Contents/Big",
+                "./Applications/Test.app/link",
+                "./Applications/Test.app/tool",
+            ],
+        )
+        big = payload["./Applications/Test.app/Contents/Big"]
+        self.assertEqual(big["data"], self.big_data)
+        self.assertEqual((big["uid"], big["gid"]), (0, 80))
+        self.assertEqual(payload["./Applications/Test.app/tool"]["mode"] & 0o777, 0o755)
+        self.assertEqual(
+            payload["./Applications/Test.app/link"]["data"], b"Contents/Big"
+        )
+        self.assertEqual((payload["."]["uid"], payload["."]["gid"]), (0, 80))
+
+    def test_round_trip_bom(self):
+        """The Bom should list every payload path with parents first."""
+        paths = read_bom_paths(self.build().read("Bom"))
+        self.assertEqual(paths[0], ".")
+        self.assertEqual(len(paths), 7)
+        self.assertIn("./Applications/Test.app/Contents/Big", paths)
+        self.assertLess(
+            paths.index("./Applications/Test.app"),
+            paths.index("./Applications/Test.app/Contents"),
+        )
+
+    def test_bom_with_multiple_pages(self):
+        """Trees with more paths than fit in one Bom page should be linked."""
+        many = os.path.join(self.pkgroot, "many")
+        os.makedirs(many)
+        for i in range(1200):
+            open(os.path.join(many, f"file{i:04}"), "w").close()
+        paths = read_bom_paths(self.build().read("Bom"))
+        self.assertEqual(len(paths), 1208)
+        self.assertIn("./many/file1199", paths)
+
+    def test_package_info(self):
+        """PackageInfo should carry identifier, version and payload size."""
+        root = ET.fromstring(self.build().read("PackageInfo"))
+        self.assertEqual(root.tag, "pkg-info")
+        self.assertEqual(root.get("identifier"), "com.example.test")
+        self.assertEqual(root.get("version"), "1.0")
+        self.assertEqual(root.find("payload").get("numberOfFiles"), "7")
+
+    def test_infofile_is_merged(self):
+        """Attributes and elements from infofile should be merged in."""
+        infofile = os.path.join(self.tmp_dir.name, "PackageInfo")
+        with open(infofile, "w") as f:
+            f.write('<pkg-info postinstall-action="restart" version="9"/>')
+        self.request["infofile"] = infofile
+        root = ET.fromstring(self.build().read("PackageInfo"))
+        self.assertEqual(root.get("postinstall-action"), "restart")
+        self.assertEqual(root.get("version"), "1.0")
+
+    def test_scripts_are_archived(self):
+        """A scripts directory should produce a Scripts member."""
+        scripts = os.path.join(self.tmp_dir.name, "scripts")
+        os.makedirs(scripts)
+        with open(os.path.join(scripts, "postinstall"), "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        self.request["scripts"] = scripts
+        reader = self.build()
+        archive = read_cpio(gzip.decompress(reader.read("Scripts")))
+        self.assertIn("./postinstall", archive)
+        root = ET.fromstring(reader.read("PackageInfo"))
+        self.assertEqual(root.find("scripts/postinstall").get("file"), "./postinstall")
+
+    def test_xar_toc_checksum(self):
+        """The heap should start with the SHA-1 of the compressed TOC."""
+        pkg = FlatPackageBuilder(self.request).build()
+        with open(pkg, "rb") as f:
+            data = f.read()
+        toc_length = struct.unpack(">Q", data[8:16])[0]
+        toc = data[28 : 28 + toc_length]
+        import hashlib
+
+        self.assertEqual(
+            data[28 + toc_length : 48 + toc_length], hashlib.sha1(toc).digest()
+        )
+        self.assertIn(b"<xar>", zlib.decompress(toc))
+
+    def test_invalid_chown_path_raises(self):
+        """chown paths containing .. should be rejected."""
+        self.request["chown"] = [{"path": "../etc", "user": 0, "group": 0}]
+        with self.assertRaises(FlatPackageError):
+            FlatPackageBuilder(self.request).build()
+
+    def test_missing_chown_path_raises(self):
+        """chown paths must exist in the pkgroot."""
+        self.request["chown"] = [{"path": "Library/Missing", "user": 0, "group": 0}]
+        with self.assertRaisesRegex(FlatPackageError, "does not exist"):
+            FlatPackageBuilder(self.request).build()
+
+    def test_file_too_large_for_bom_raises(self):
+        """Files whose size doesn't fit in the Bom are rejected, not truncated."""
+        with patch("autopkglib.flatpkg.BOM_MAX_FILESIZE", 1000):
+            with self.assertRaisesRegex(FlatPackageError, "too large"):
+                FlatPackageBuilder(self.request).build()
+        self.assertEqual(os.listdir(self.pkgdir), [])
+
+    def test_pkgcreator_builds_natively_without_pkgbuild(self):
+        """PkgCreator should build in-process when pkgbuild is missing."""
+        processor = PkgCreator(env={"verbose": 0})
+        module = get_processor_module("PkgCreator")
+        with patch.object(module, "PKGBUILD", "/nonexistent/pkgbuild"):
+            with patch.object(processor, "connect") as mock_connect:
+                pkg_path = processor.request_package(self.request)
+        mock_connect.assert_not_called()
+        self.assertEqual(pkg_path, os.path.join(self.pkgdir, "Test-1.0.pkg"))
+        self.assertIn("Payload", XarReader(pkg_path).names())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/local/autopkg/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from autopkglib.github import (
+    GitHubAPIError,
+    GitHubResponseCache,
+    GitHubSession,
+    parse_link_header,
+)
+
+
+class FakeGitHub:
+    """Stands in for curl, answering requests like the GitHub API would."""
+
+    def __init__(self, body, etag='"abc"'):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    def __call__(self, curl_cmd):
+        headers = [
+            curl_cmd[i + 1] for i, arg in enumerate(curl_cmd) if arg == "--header"
+        ]
+        self.requests.append(headers)
+        rate = "X-RateLimit-Limit: 60\nX-RateLimit-Remaining: 42\n"
+        rate += "X-RateLimit-Reset: 1700000000\n"
+        if f"If-None-Match: {self.etag}" in headers:
+            return f"HTTP/2 304 Not Modified\n{rate}\n"
+        output = curl_cmd[curl_cmd.index("--output") + 1]
+        with open(output, "w") as f:
+            json.dump(self.body, f)
+        etag = f"ETag: {self.etag}\n" if self.etag else ""
+        return f"HTTP/2 200 OK\n{etag}{rate}\n"
+
+
+class TestGitHubSessionCache(unittest.TestCase):
+    """Test class for conditional requests in GitHubSession.call_api."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache = GitHubResponseCache(self.tmp_dir.name)
+
+    def session(self, token=None):
+        with patch.object(GitHubSession, "_get_token", return_value=token):
+            return GitHubSession(cache=self.cache)
+
+    def call(self, session, fake, endpoint="/repos/autopkg/autopkg/releases"):
+        with patch.object(session, "download_with_curl", side_effect=fake):
+            return session.call_api(endpoint)
+
+    def test_not_modified_is_served_from_cache(self):
+        """A 304 should return the cached body with a 200 status."""
+        fake = FakeGitHub([{"tag_name": "v1"}])
+        first = self.session()
+        self.assertEqual(self.call(first, fake), ([{"tag_name": "v1"}], 200))
+        second = self.session()
+        self.assertEqual(self.call(second, fake), ([{"tag_name": "v1"}], 200))
+        self.assertNotIn('If-None-Match: "abc"', fake.requests[0])
+        self.assertIn('If-None-Match: "abc"', fake.requests[1])
+        self.assertEqual((second.request_count, second.cache_hits), (1, 1))
+
+    def test_rate_limit_headers_are_tracked(self):
+        """Rate limit headers should be recorded for each response."""
+        session = self.session()
+        self.call(session, FakeGitHub({}))
+        self.assertEqual(
+            session.rate_limit, {"limit": 60, "remaining": 42, "reset": 1700000000}
+        )
+
+    def test_cache_is_keyed_by_token(self):
+        """Responses cached for one token shouldn't be revalidated for another."""
+        fake = FakeGitHub({"private": True})
+        self.call(self.session(token="one"), fake)
+        self.call(self.session(token="two"), fake)
+        self.assertFalse(any(h.startswith("If-None-Match") for h in fake.requests[1]))
+        self.assertEqual(len(os.listdir(self.cache.cache_dir)), 2)
+        # The token itself is never written to the cache.
+        for name in os.listdir(self.cache.cache_dir):
+            with open(os.path.join(self.cache.cache_dir, name)) as f:
+                self.assertNotIn("one", f.read())
+
+    def test_response_without_etag_replaces_cache_entry(self):
+        """A changed response without an ETag should drop the stale entry."""
+        self.call(self.session(), FakeGitHub({"v": 1}))
+        self.call(self.session(), FakeGitHub({"v": 2}, etag=None))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_non_get_requests_are_not_cached(self):
+        """Only GET requests without data should use the cache."""
+        session = self.session()
+        fake = FakeGitHub({})
+        with patch.object(session, "download_with_curl", side_effect=fake):
+            session.call_api("/markdown", method="POST", data={"text": "hi"})
+        self.assertFalse(os.path.exists(self.cache.cache_dir))
+
+    def test_prune_removes_old_and_excess_entries(self):
+        """Entries unused for too long, or beyond the limit, are removed."""
+        for index in range(4):
+            self.cache.put(f"key{index}", "url", '"abc"', {})
+            path = os.path.join(self.cache.cache_dir, f"key{index}.json")
+            os.utime(path, (1000 + index, 1000 + index))
+        # Reading an entry marks it as recently used.
+        self.cache.get("key0")
+        self.cache.prune(max_age=time.time(), max_entries=2)
+        self.assertEqual(
+            sorted(os.listdir(self.cache.cache_dir)), ["key0.json", "key3.json"]
+        )
+        self.cache.prune()
+        self.assertEqual(os.listdir(self.cache.cache_dir), ["key0.json"])
+
+
+class TestGitHubSessionPagination(unittest.TestCase):
+    """Test class for GitHubSession.iter_pages."""
+
+    def setUp(self):
+        self.last_page = 5
+        self.requested = []
+        self.lock = threading.Lock()
+        with patch.object(GitHubSession, "_get_token", return_value=None):
+            self.session = GitHubSession(cache=False)
+
+    def fake_call_api(self, session):
+        """Return a call_api replacement that serves numbered pages."""
+
+        def call_api(endpoint, query=None):
+            page = int(query.split("page=")[1].split("&")[0])
+            with self.lock:
+                self.requested.append(page)
+            links = []
+            if page < self.last_page:
+                links.append(
+                    f'<https://api.github.com{endpoint}?page={page + 1}>; rel="next"'
+                )
+                links.append(
+                    f'<https://api.github.com{endpoint}?page={self.last_page}>; rel="last"'
+                )
+            session.response_headers = {"link": ", ".join(links)}
+            session.request_count += 1
+            return [{"page": page}], 200
+
+        return call_api
+
+    def pages(self, prefetch=0, stop_after=None):
+        original_fork = GitHubSession.fork
+
+        def fork(session):
+            forked = original_fork(session)
+            forked.call_api = self.fake_call_api(forked)
+            return forked
+
+        self.session.call_api = self.fake_call_api(self.session)
+        seen = []
+        with patch.object(GitHubSession, "fork", fork):
+            pages = self.session.iter_pages("/repos/a/b/releases", prefetch=prefetch)
+            for page, resp in pages:
+                self.assertEqual(resp, [{"page": page}])
+                seen.append(page)
+                if page == stop_after:
+                    pages.close()
+                    break
+        return seen
+
+    def test_parse_link_header(self):
+        """Link headers should be parsed into URLs keyed by rel."""
+        links = parse_link_header(
+            '<https://x/?page=2>; rel="next", <https://x/?page=9>; rel="last"'
+        )
+        self.assertEqual(
+            links, {"next": "https://x/?page=2", "last": "https://x/?page=9"}
+        )
+
+    def test_follows_links_serially(self):
+        """Without prefetch, each page should be requested in turn."""
+        self.assertEqual(self.pages(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.requested, [1, 2, 3, 4, 5])
+
+    def test_prefetch_yields_pages_in_order(self):
+        """Prefetched pages should still be yielded in order."""
+        self.assertEqual(self.pages(prefetch=3), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(self.requested), [1, 2, 3, 4, 5])
+        self.assertEqual(self.session.request_count, 5)
+
+    def test_prefetch_stops_at_last_page(self):
+        """Pages beyond the last link should never be requested."""
+        self.last_page = 2
+        self.assertEqual(self.pages(prefetch=4), [1, 2])
+        self.assertEqual(sorted(self.requested), [1, 2])
+
+    def test_early_stop_limits_requests(self):
+        """Stopping early should leave at most prefetch pages requested."""
+        self.last_page = 50
+        self.assertEqual(self.pages(prefetch=2, stop_after=1), [1])
+        self.assertLessEqual(max(self.requested), 3)
+
+    def test_unexpected_status_raises(self):
+        """Non-200 responses should raise GitHubAPIError."""
+        self.session.call_api = lambda endpoint, query=None: (None, 404)
+        with self.assertRaises(GitHubAPIError):
+            list(self.session.iter_pages("/repos/a/b/releases"))
+
+
+if __name__ == "__main__":
+    unittest.main()
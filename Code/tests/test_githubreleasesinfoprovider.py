@@ -2,6 +2,7 @@
 
 import re
 import unittest
+from unittest.mock import patch
 
 from autopkglib import ProcessorError
 from autopkglib.GitHubReleasesInfoProvider import GitHubReleasesInfoProvider
@@ -75,6 +76,120 @@ class TestGitHubReleasesInfoProvider(unittest.TestCase):
         self.processor.main()
         self.assertIsNotNone(test_env["asset_url"])
 
+    def release(self, tag, *asset_names, prerelease=False):
+        """Return a release dict like those returned by the REST API."""
+        return {
+            "prerelease": prerelease,
+            "name": tag,
+            "tag_name": tag,
+            "body": None,
+            "assets": [
+                {
+                    "name": name,
+                    "url": f"https://api.example.com/{tag}/{name}",
+                    "browser_download_url": f"https://example.com/{tag}/{name}",
+                    "created_at": "2024-01-01T00:00:00Z",
+                }
+                for name in asset_names
+            ],
+        }
+
+    @patch("autopkglib.github.GitHubSession")
+    def test_reports_api_usage(self, mock_session):
+        """The processor should summarize API requests and rate limits."""
+        github = mock_session.return_value
+        github.iter_pages.return_value = (
+            page for page in [(1, [self.release("v1.0", "a.dmg")])]
+        )
+        github.request_count = 1
+        github.cache_hits = 1
+        github.rate_limit = {"limit": 60, "remaining": 59}
+        test_env = {"github_repo": "example/test"}
+        test_env.update(self.base_env)
+        self.processor.env = test_env
+        self.processor.main()
+        data = test_env["github_api_summary_result"]["data"]
+        self.assertEqual(data["requests"], "1")
+        self.assertEqual(data["not_modified"], "1")
+        self.assertEqual(data["rate_limit_remaining"], "59/60")
+        self.assertEqual(test_env["version"], "1.0")
+
+    @patch("autopkglib.github.GitHubSession")
+    def test_stops_at_first_page_with_match(self, mock_session):
+        """Later pages should not be requested once an asset matches."""
+        pages_read = []
+
+        def iter_pages(endpoint, per_page, prefetch):
+            for page, releases in [
+                (1, [self.release("v3.0", "a.zip")]),
+                (2, [self.release("v2.0", "a.dmg")]),
+                (3, [self.release("v1.0", "a.dmg")]),
+            ]:
+                pages_read.append(page)
+                yield page, releases
+
+        mock_session.return_value.iter_pages.side_effect = iter_pages
+        test_env = {"github_repo": "example/test", "asset_regex": r".*\.dmg"}
+        test_env.update(self.base_env)
+        self.processor.env = test_env
+        self.processor.main()
+        self.assertEqual(test_env["version"], "2.0")
+        self.assertEqual(pages_read, [1, 2])
+
+    @patch("autopkglib.github.GitHubSession")
+    def test_raises_when_no_asset_matches(self, mock_session):
+        """Exhausting all pages without a match should raise."""
+        mock_session.return_value.iter_pages.return_value = (
+            page for page in [(1, [self.release("v1.0", "a.zip")])]
+        )
+        test_env = {"github_repo": "example/test", "asset_regex": r".*\.dmg"}
+        test_env.update(self.base_env)
+        self.processor.env = test_env
+        with self.assertRaisesRegex(ProcessorError, "No release assets"):
+            self.processor.main()
+
+    @patch("autopkglib.github.GitHubSession")
+    def test_graphql_mode(self, mock_session):
+        """GraphQL listings should be resolved to the full REST release."""
+        github = mock_session.return_value
+        github.token = "token"
+        github.graphql.return_value = (
+            {
+                "data": {
+                    "repository": {
+                        "releases": {
+                            "pageInfo": {"hasNextPage": False, "endCursor": "x"},
+                            "nodes": [
+                                {
+                                    "tagName": "v2.0",
+                                    "isDraft": True,
+                                    "isPrerelease": False,
+                                    "releaseAssets": {"nodes": [{"name": "a.dmg"}]},
+                                },
+                                {
+                                    "tagName": "v1.0",
+                                    "isDraft": False,
+                                    "isPrerelease": False,
+                                    "releaseAssets": {"nodes": [{"name": "a.dmg"}]},
+                                },
+                            ],
+                        }
+                    }
+                }
+            },
+            200,
+        )
+        github.call_api.return_value = (self.release("v1.0", "a.dmg"), 200)
+        test_env = {"github_repo": "example/test", "GITHUB_USE_GRAPHQL": True}
+        test_env.update(self.base_env)
+        self.processor.env = test_env
+        self.processor.main()
+        github.call_api.assert_called_once_with(
+            "/repos/example/test/releases/tags/v1.0"
+        )
+        self.assertEqual(test_env["url"], "https://example.com/v1.0/a.dmg")
+        self.assertEqual(test_env["version"], "1.0")
+
 
 if __name__ == "__main__":
     unittest.main()
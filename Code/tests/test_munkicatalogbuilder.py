@@ -0,0 +1,140 @@
+#!/usr/local/autopkg/python
+
+import os
+import plistlib
+import unittest
+from tempfile import TemporaryDirectory
+
+from autopkglib import ProcessorError
+from autopkglib.MunkiCatalogBuilder import MunkiCatalogBuilder
+
+
+class TestMunkiCatalogBuilder(unittest.TestCase):
+    """Test class for MunkiCatalogBuilder Processor."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.munki_repo = os.path.join(self.tmp_dir.name, "repo")
+        os.makedirs(os.path.join(self.munki_repo, "pkgsinfo", "apps"))
+        self.write_pkginfo("apps/Foo-1.0.plist", "Foo", "1.0", ["testing"])
+        self.write_pkginfo("apps/Bar-2.0.plist", "Bar", "2.0", ["production"])
+
+    def write_pkginfo(self, relpath, name, version, catalogs, **keys):
+        path = os.path.join(self.munki_repo, "pkgsinfo", relpath)
+        pkginfo = {"name": name, "version": version, "catalogs": catalogs, **keys}
+        with open(path, "wb") as f:
+            plistlib.dump(pkginfo, f)
+        # make sure a rewrite within the same clock tick is still noticed
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+
+    def catalog(self, name):
+        with open(os.path.join(self.munki_repo, "catalogs", name), "rb") as f:
+            return [(item["name"], item["version"]) for item in plistlib.load(f)]
+
+    def build(self, **env):
+        processor = MunkiCatalogBuilder()
+        processor.env = {
+            "MUNKI_REPO": self.munki_repo,
+            "MUNKI_REPO_PLUGIN": "FileRepo",
+            "CACHE_DIR": self.tmp_dir.name,
+            **env,
+        }
+        processor.rebuild_catalogs()
+        return processor.env
+
+    def test_builds_catalogs(self):
+        """Every catalog named by a pkginfo should be written, plus all."""
+        self.write_pkginfo(
+            "apps/Baz-1.0.plist", "Baz", "1.0", ["testing", "production"], notes="x"
+        )
+        env = self.build()
+        self.assertEqual(
+            env["munki_catalogs_rebuilt"], ["all", "production", "testing"]
+        )
+        self.assertEqual(
+            self.catalog("all"), [("Bar", "2.0"), ("Baz", "1.0"), ("Foo", "1.0")]
+        )
+        self.assertEqual(self.catalog("testing"), [("Baz", "1.0"), ("Foo", "1.0")])
+        with open(os.path.join(self.munki_repo, "catalogs", "all"), "rb") as f:
+            self.assertNotIn("notes", plistlib.load(f)[1])
+
+    def test_unchanged_repo_is_not_reread(self):
+        """A second build without changes shouldn't rewrite any catalogs."""
+        self.build()
+        env = self.build()
+        self.assertEqual(env["munki_catalogs_rebuilt"], [])
+        self.assertNotIn("munki_catalog_builder_summary_result", env)
+
+    def test_only_affected_catalogs_are_rewritten(self):
+        """Changing a pkginfo should rewrite only its old and new catalogs."""
+        self.write_pkginfo("apps/Qux-1.0.plist", "Qux", "1.0", ["staging"])
+        self.build()
+        self.write_pkginfo("apps/Foo-1.0.plist", "Foo", "1.0", ["production"])
+        env = self.build()
+        self.assertEqual(
+            env["munki_catalogs_rebuilt"], ["all", "production", "testing"]
+        )
+        self.assertEqual(
+            env["munki_catalog_builder_summary_result"]["data"]["pkginfos_read"], "1"
+        )
+        self.assertEqual(self.catalog("production"), [("Bar", "2.0"), ("Foo", "1.0")])
+        # testing has no items left
+        self.assertFalse(
+            os.path.exists(os.path.join(self.munki_repo, "catalogs", "testing"))
+        )
+
+    def test_removed_pkginfo(self):
+        """Deleting a pkginfo should remove it from its catalogs."""
+        self.build()
+        os.unlink(os.path.join(self.munki_repo, "pkgsinfo", "apps", "Bar-2.0.plist"))
+        env = self.build()
+        self.assertEqual(env["munki_catalogs_rebuilt"], ["all", "production"])
+        self.assertEqual(self.catalog("all"), [("Foo", "1.0")])
+
+    def test_deleted_catalog_is_restored(self):
+        """A catalog file deleted since the last build should be rewritten."""
+        self.build()
+        os.unlink(os.path.join(self.munki_repo, "catalogs", "testing"))
+        env = self.build()
+        self.assertEqual(env["munki_catalogs_rebuilt"], ["testing"])
+
+    def test_invalid_pkginfo_is_skipped(self):
+        """Files that aren't pkginfo property lists should be skipped."""
+        with open(os.path.join(self.munki_repo, "pkgsinfo", "README"), "w") as f:
+            f.write("not a plist")
+        self.build()
+        self.assertEqual(self.catalog("all"), [("Bar", "2.0"), ("Foo", "1.0")])
+
+    def test_unreadable_pkginfo_is_skipped(self):
+        """Dangling symlinks and vanished files should be skipped."""
+        os.symlink(
+            os.path.join(self.tmp_dir.name, "missing.plist"),
+            os.path.join(self.munki_repo, "pkgsinfo", "Dangling.plist"),
+        )
+        self.build()
+        self.assertEqual(self.catalog("all"), [("Bar", "2.0"), ("Foo", "1.0")])
+        processor = MunkiCatalogBuilder({})
+        path = os.path.join(self.munki_repo, "pkgsinfo", "Gone.plist")
+        self.assertIsNone(processor.read_pkginfo(path, "Gone.plist", None, None))
+
+    def test_other_repo_plugins_are_skipped(self):
+        """Repos using other plugins shouldn't be touched."""
+        env = self.build(MUNKI_REPO_PLUGIN="GitFileRepo")
+        self.assertNotIn("munki_catalogs_rebuilt", env)
+        self.assertFalse(os.path.exists(os.path.join(self.munki_repo, "catalogs")))
+
+    def test_recipe_step_does_nothing(self):
+        """As a recipe step the processor is deprecated and does nothing."""
+        processor = MunkiCatalogBuilder({"MUNKI_REPO": self.munki_repo})
+        processor.main()
+        self.assertFalse(os.path.exists(os.path.join(self.munki_repo, "catalogs")))
+
+    def test_missing_pkgsinfo_raises(self):
+        """A repo without a pkgsinfo directory should fail."""
+        with self.assertRaises(ProcessorError):
+            self.build(MUNKI_REPO=self.tmp_dir.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 #!/usr/local/autopkg/python
 
+import errno
+import fcntl
 import os
 import plistlib
 import unittest
@@ -9,6 +11,12 @@ from unittest.mock import MagicMock, patch
 
 from autopkglib import ProcessorError
 from autopkglib.MunkiImporter import MunkiImporter
+from autopkglib.munkirepolibs import AutoPkgLib as autopkglib_module
+from autopkglib.munkirepolibs.AutoPkgLib import (
+    AutoPkgLib,
+    CopyUnavailable,
+    reserve_item_name,
+)
 
 
 class TestMunkiImporter(unittest.TestCase):
@@ -527,6 +535,303 @@ class TestMunkiImporter(unittest.TestCase):
         self.assertNotIn("old", summary)
         self.assertIn("data", summary)
 
+    # Test the catalog database shared within a run
+    def test_catalog_db_is_built_once_per_run(self):
+        """Test that MunkiImporter steps in one run share the catalog database."""
+        mock_library = MagicMock()
+        mock_library.make_catalog_db.side_effect = lambda: {
+            "hashes": {"abc123": [0]},
+            "items": [{"name": "TestApp", "version": "1.0.0"}],
+        }
+        pkginfo = self._create_mock_pkginfo()
+
+        for run_id in ("run1", "run1", "run2"):
+            processor = MunkiImporter()
+            processor.env = dict(self.good_env, RUN_ID=run_id)
+            processor._find_matching_pkginfo(mock_library, pkginfo)
+
+        self.assertEqual(mock_library.make_catalog_db.call_count, 2)
+
+    @patch("subprocess.Popen")
+    def test_later_steps_match_items_imported_in_run(self, mock_popen):
+        """Test that an item imported earlier in a run is matched without
+        rebuilding the catalogs."""
+        mock_process = MagicMock()
+        mock_process.communicate.return_value = (
+            plistlib.dumps(self._create_mock_pkginfo()),
+            b"",
+        )
+        mock_process.returncode = 0
+        mock_popen.return_value = mock_process
+
+        results = []
+        for _ in range(2):
+            processor = MunkiImporter()
+            processor.env = dict(self.good_env, RUN_ID="run1", repo_subdirectory="apps")
+            processor.main()
+            results.append(processor.env)
+
+        self.assertTrue(results[0]["munki_repo_changed"])
+        self.assertFalse(results[1]["munki_repo_changed"])
+        self.assertEqual(results[1]["pkg_repo_path"], results[0]["pkg_repo_path"])
+        self.assertEqual(
+            os.listdir(os.path.join(self.munki_repo, "pkgsinfo", "apps")),
+            ["TestApp-1.0.0.plist"],
+        )
+
+    # Test copying installer items into a FileRepo
+    def test_copy_pkg_to_repo(self):
+        """Test that items are copied under a unique name with copy stats."""
+        library = AutoPkgLib(self.munki_repo, "apps")
+        paths = [
+            library.copy_pkg_to_repo({"version": "1.0.0"}, self.pkg_path)
+            for _ in range(2)
+        ]
+        self.assertEqual(
+            [os.path.basename(path) for path in paths],
+            ["TestApp-1.0.0.pkg", "TestApp-1.0.0__1.pkg"],
+        )
+        with open(paths[1]) as f:
+            self.assertEqual(f.read(), "dummy package content")
+        self.assertIn(library.copy_stats["strategy"], ("clone", "copy"))
+        self.assertEqual(library.copy_stats["bytes"], 21)
+
+    def test_copy_pkg_to_repo_hardlink(self):
+        """Test that items are hard linked only when allowed."""
+        unavailable = CopyUnavailable("no clones here")
+        with patch.object(autopkglib_module, "clone_file", side_effect=unavailable):
+            for allow_hardlink, strategy in ((False, "copy"), (True, "hardlink")):
+                library = AutoPkgLib(self.munki_repo, "apps", allow_hardlink)
+                path = library.copy_pkg_to_repo({}, self.pkg_path)
+                self.assertEqual(library.copy_stats["strategy"], strategy)
+                self.assertEqual(
+                    os.path.samefile(path, self.pkg_path), strategy == "hardlink"
+                )
+
+    def test_copy_pkg_to_repo_holds_repo_lock(self):
+        """Test that items are copied while holding the repo lock."""
+        library = AutoPkgLib(self.munki_repo, "apps", lock_repo=True)
+        lock_path = os.path.join(self.munki_repo, ".autopkg_import.lock")
+
+        def copy_item(src, dst):
+            with open(lock_path) as lock_file:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            open(dst, "w").close()
+
+        with patch.object(library, "copy_item", side_effect=copy_item) as mock_copy:
+            library.copy_pkg_to_repo({}, self.pkg_path)
+        mock_copy.assert_called_once()
+
+    def test_copy_pkg_to_repo_never_overwrites(self):
+        """Test that an item taking a name mid-copy isn't overwritten."""
+        library = AutoPkgLib(self.munki_repo, "apps")
+        pkgs = os.path.join(self.munki_repo, "pkgs", "apps")
+        copy_item = library.copy_item
+
+        def racing_copy_item(src, dst):
+            # another importer takes the name while this one copies
+            with open(os.path.join(pkgs, "TestApp-1.0.0.pkg"), "w") as f:
+                f.write("other importer")
+            copy_item(src, dst)
+
+        with patch.object(library, "copy_item", side_effect=racing_copy_item):
+            path = library.copy_pkg_to_repo({"version": "1.0.0"}, self.pkg_path)
+        self.assertEqual(os.path.basename(path), "TestApp-1.0.0__1.pkg")
+        self.assertEqual(
+            sorted(os.listdir(pkgs)), ["TestApp-1.0.0.pkg", "TestApp-1.0.0__1.pkg"]
+        )
+        with open(os.path.join(pkgs, "TestApp-1.0.0.pkg")) as f:
+            self.assertEqual(f.read(), "other importer")
+
+    # Test writing pkginfo files
+    def test_reserve_item_name(self):
+        """Test that names without an extension get __N suffixes too."""
+        pkgsinfo = os.path.join(self.munki_repo, "pkgsinfo")
+        names = [reserve_item_name(pkgsinfo, "TestApp-1.0.0", "") for _ in range(3)]
+        self.assertEqual(
+            names, ["TestApp-1.0.0", "TestApp-1.0.0__1", "TestApp-1.0.0__2"]
+        )
+
+    def test_copy_pkginfo_to_repo(self):
+        """Test that pkginfo files are written whole under unique names."""
+        library = AutoPkgLib(self.munki_repo, "apps")
+        pkginfo = self._create_mock_pkginfo()
+        paths = [library.copy_pkginfo_to_repo(pkginfo) for _ in range(2)]
+        pkgsinfo = os.path.join(self.munki_repo, "pkgsinfo", "apps")
+        self.assertEqual(
+            sorted(os.listdir(pkgsinfo)),
+            ["TestApp-1.0.0.plist", "TestApp-1.0.0__1.plist"],
+        )
+        for path in paths:
+            with open(path, "rb") as f:
+                self.assertEqual(plistlib.load(f), pkginfo)
+            # written with the default file mode, not the temporary file's
+            self.assertTrue(os.stat(path).st_mode & 0o044)
+
+    def test_copy_pkginfo_to_repo_failed_write(self):
+        """Test that a failed write leaves no pkginfo or temporary file."""
+        library = AutoPkgLib(self.munki_repo, "apps")
+        no_space = OSError(errno.ENOSPC, "No space left on device")
+        with patch.object(autopkglib_module.plistlib, "dump", side_effect=no_space):
+            with self.assertRaisesRegex(ProcessorError, "No space left"):
+                library.copy_pkginfo_to_repo(self._create_mock_pkginfo())
+        self.assertEqual(
+            os.listdir(os.path.join(self.munki_repo, "pkgsinfo", "apps")), []
+        )
+
+    def test_copy_pkginfo_to_repo_publishes_complete_file(self):
+        """Test that no pkginfo is visible until it is completely written."""
+        library = AutoPkgLib(self.munki_repo, "apps", lock_repo=True)
+        pkgsinfo = os.path.join(self.munki_repo, "pkgsinfo", "apps")
+        lock_path = os.path.join(self.munki_repo, ".autopkg_import.lock")
+        dump = plistlib.dump
+
+        def checked_dump(data, f):
+            self.assertEqual(
+                [name for name in os.listdir(pkgsinfo) if not name.startswith(".")],
+                [],
+            )
+            with open(lock_path) as lock_file:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            dump(data, f)
+
+        with patch.object(autopkglib_module.plistlib, "dump", checked_dump):
+            path = library.copy_pkginfo_to_repo(self._create_mock_pkginfo())
+        self.assertEqual(os.listdir(pkgsinfo), ["TestApp-1.0.0.plist"])
+        self.assertEqual(path, os.path.join(pkgsinfo, "TestApp-1.0.0.plist"))
+
+    def test_copy_pkginfo_to_repo_without_hard_links(self):
+        """Test that names are reserved instead where hard links fail."""
+        library = AutoPkgLib(self.munki_repo, "apps")
+        pkginfo = self._create_mock_pkginfo()
+        no_links = OSError(errno.EPERM, "Operation not permitted")
+        with patch.object(autopkglib_module.os, "link", side_effect=no_links):
+            paths = [library.copy_pkginfo_to_repo(pkginfo) for _ in range(2)]
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.munki_repo, "pkgsinfo", "apps"))),
+            ["TestApp-1.0.0.plist", "TestApp-1.0.0__1.plist"],
+        )
+        with open(paths[1], "rb") as f:
+            self.assertEqual(plistlib.load(f), pkginfo)
+
+    # Test matching by a hash computed while downloading
+    def write_catalog(self, *items):
+        with open(os.path.join(self.munki_repo, "catalogs", "all"), "wb") as f:
+            plistlib.dump(list(items), f)
+
+    def catalog_item(self, hash_value="abc123", **keys):
+        return {
+            "name": "TestApp",
+            "version": "1.0.0",
+            "installer_item_hash": hash_value,
+            "installer_item_location": "apps/TestApp-1.0.0.pkg",
+            **keys,
+        }
+
+    @patch("subprocess.Popen")
+    def test_download_hash_skips_makepkginfo(self, mock_popen):
+        """Test that an item matching the download's hash skips makepkginfo."""
+        self.write_catalog(self.catalog_item())
+        self.processor.env.update(
+            pathname=self.pkg_path, download_sha256="abc123", repo_subdirectory="apps"
+        )
+        self.processor.main()
+
+        mock_popen.assert_not_called()
+        self.assertFalse(self.processor.env["munki_repo_changed"])
+        self.assertEqual(
+            self.processor.env["pkg_repo_path"],
+            os.path.join(self.munki_repo, "pkgs", "apps", "TestApp-1.0.0.pkg"),
+        )
+
+    def test_known_pkg_sha256(self):
+        """Test that download hashes are only used for the downloaded file."""
+        self.processor.env.update(download_sha256="abc123", pathname=self.pkg_path)
+        self.assertEqual(self.processor._known_pkg_sha256(), "abc123")
+        self.processor.env["pathname"] = os.path.join(self.tmp_dir.name, "other.dmg")
+        self.assertIsNone(self.processor._known_pkg_sha256())
+        self.processor.env["pkg_sha256"] = "ABC123 "
+        self.assertEqual(self.processor._known_pkg_sha256(), "abc123")
+
+    def test_find_items_by_hash_needs_known_architectures(self):
+        """Test that items with differing architectures aren't matched early."""
+        self.write_catalog(
+            self.catalog_item(supported_architectures=["arm64"]),
+            self.catalog_item(supported_architectures=["x86_64"]),
+        )
+        self.processor.env["pkg_sha256"] = "abc123"
+        library = AutoPkgLib(self.munki_repo, "apps")
+        self.assertIsNone(self.processor._find_items_by_hash(library))
+
+        self.processor.env["pkginfo"] = {"supported_architectures": ["x86_64"]}
+        items, archs = self.processor._find_items_by_hash(library)
+        self.assertEqual((len(items), archs), (2, ["x86_64"]))
+
+    # Test matching against the indexed catalog
+    def find_in_catalog(self, pkginfo, *items):
+        self.write_catalog(*items)
+        library = AutoPkgLib(self.munki_repo, "apps")
+        matches = self.processor._find_matching_pkginfo(library, pkginfo)
+        return [(m["name"], m["version"]) for m in matches] if matches else matches
+
+    def app(self, path, version):
+        return {
+            "type": "application",
+            "path": path,
+            "CFBundleShortVersionString": version,
+        }
+
+    def test_find_matching_pkginfo_by_applications(self):
+        """Test that items must match every installed application."""
+        items = [
+            self.catalog_item("h1", installs=[self.app("/A.app", "1")]),
+            self.catalog_item(
+                "h2",
+                version="2",
+                installs=[self.app("/A.app", "1"), self.app("/B.app", "1")],
+            ),
+        ]
+        pkginfo = self._create_mock_pkginfo(hash_value="new")
+        pkginfo["installs"] = [self.app("/A.app", "1"), self.app("/B.app", "1")]
+        self.assertEqual(self.find_in_catalog(pkginfo, *items), [("TestApp", "2")])
+        pkginfo["installs"].append(self.app("/C.app", "1"))
+        self.assertIsNone(self.find_in_catalog(pkginfo, *items))
+
+    def test_find_matching_pkginfo_without_common_applications(self):
+        """Test that applications matched by different items don't match."""
+        items = [
+            self.catalog_item("h1", installs=[self.app("/A.app", "1")]),
+            self.catalog_item("h2", version="2", installs=[self.app("/B.app", "1")]),
+            self.catalog_item(
+                "h3",
+                version="3",
+                installs=[self.app("/A.app", "1"), self.app("/C.app", "1")],
+            ),
+        ]
+        pkginfo = self._create_mock_pkginfo(hash_value="new")
+        pkginfo["installs"] = [
+            self.app("/A.app", "1"),
+            self.app("/B.app", "1"),
+            self.app("/C.app", "1"),
+        ]
+        self.assertIsNone(self.find_in_catalog(pkginfo, *items))
+
+    def test_find_matching_pkginfo_by_files(self):
+        """Test matching by installs file checksums and paths."""
+        checksum_file = {"type": "file", "path": "/bin/tool", "md5checksum": "c1"}
+        plain_file = {"type": "file", "path": "/bin/other"}
+        items = [
+            self.catalog_item("h1", installs=[checksum_file]),
+            self.catalog_item("h2", version="2", installs=[plain_file]),
+        ]
+        pkginfo = {"name": "TestApp", "version": "2", "installer_item_hash": "new"}
+        pkginfo["installs"] = [dict(checksum_file, md5checksum="c2"), plain_file]
+        self.assertEqual(self.find_in_catalog(pkginfo, *items), [("TestApp", "2")])
+        pkginfo["installs"] = [checksum_file]
+        self.assertEqual(self.find_in_catalog(pkginfo, *items), [("TestApp", "1.0.0")])
+
 
 if __name__ == "__main__":
     unittest.main()
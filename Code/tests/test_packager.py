@@ -13,9 +13,11 @@
 # limitations under the License.
 
 import importlib.util
+import os
 import unittest
 from pathlib import Path
-from unittest.mock import MagicMock
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
 
 # Load packager module directly from file to avoid mocking issues
 autopkgserver_path = Path(__file__).parent.parent / "autopkgserver" / "packager.py"
@@ -23,6 +25,7 @@ spec = importlib.util.spec_from_file_location("packager", autopkgserver_path)
 packager_module = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(packager_module)
 Packager = packager_module.Packager
+CopyUnavailable = packager_module.CopyUnavailable
 
 
 class TestPackager(unittest.TestCase):
@@ -60,6 +63,132 @@ class TestPackager(unittest.TestCase):
                 f"Expected length {length}, got {len(result)}: {result}",
             )
 
+    def test_package_records_phase_metrics(self):
+        """Should record time spent copying, chowning and building."""
+        with (
+            patch.object(self.packager, "verify_request"),
+            patch.object(self.packager, "copy_pkgroot"),
+            patch.object(self.packager, "apply_chown"),
+            patch.object(self.packager, "make_component_property_list"),
+            patch.object(self.packager, "create_pkg", return_value="/tmp/x.pkg"),
+            patch.object(self.packager, "cleanup"),
+        ):
+            self.assertEqual(self.packager.package(), "/tmp/x.pkg")
+        self.assertEqual(sorted(self.packager.metrics), ["build", "chown", "copy"])
+
+    def test_timed_accumulates(self):
+        """Repeated phases should add up rather than overwrite."""
+        with self.packager.timed("copy"):
+            pass
+        first = self.packager.metrics["copy"]
+        with self.packager.timed("copy"):
+            pass
+        self.assertGreaterEqual(self.packager.metrics["copy"], first)
+
+
+class TestCopyPkgroot(unittest.TestCase):
+    """Test class for Packager.copy_pkgroot strategies."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.pkgroot = os.path.join(self.tmp_dir.name, "payload")
+        os.makedirs(os.path.join(self.pkgroot, "Applications", "Test.app"))
+        self.app_file = os.path.join(self.pkgroot, "Applications", "Test.app", "bin")
+        with open(self.app_file, "wb") as f:
+            f.write(b"x" * 1000)
+        os.chmod(self.app_file, 0o751)
+        os.symlink("bin", os.path.join(self.pkgroot, "Applications", "Test.app", "ln"))
+        self.request = {"pkgroot": self.pkgroot, "chown": []}
+        self.packager = Packager(
+            log=MagicMock(), request=self.request, name="test", uid=501, gid=20
+        )
+        self.tmproot = os.path.join(self.tmp_dir.name, "tmproot")
+        os.mkdir(self.tmproot)
+        # Staging ownership requires root; the strategies are what's under test.
+        for patcher in (
+            patch.object(
+                packager_module.tempfile, "mkdtemp", return_value=self.tmproot
+            ),
+            patch.object(packager_module.os, "chown"),
+            patch.object(packager_module.os, "lchown"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def copied(self, *parts):
+        return os.path.join(self.tmproot, "test", "Applications", "Test.app", *parts)
+
+    def test_hardlink_when_clone_unavailable(self):
+        """Without chown entries, files should be hard linked, not copied."""
+        with patch.object(
+            self.packager, "copy_pkgroot_clone", side_effect=CopyUnavailable("no")
+        ):
+            self.packager.copy_pkgroot()
+        self.assertEqual(self.packager.copy_strategy, "hardlink")
+        self.assertEqual(
+            os.stat(self.copied("bin")).st_ino, os.stat(self.app_file).st_ino
+        )
+        self.assertEqual(os.readlink(self.copied("ln")), "bin")
+        self.assertEqual(self.packager.metrics, {"bytes_linked": 1000})
+        self.assertEqual(
+            os.stat(os.path.join(self.tmproot, "test")).st_mode & 0o7777, 0o1775
+        )
+
+    def test_chown_entries_prevent_hardlinks(self):
+        """chown would modify the shared inodes, so ditto should be used."""
+        self.request["chown"] = [{"path": "Applications", "user": "root"}]
+        with (
+            patch.object(
+                self.packager, "copy_pkgroot_clone", side_effect=CopyUnavailable("no")
+            ),
+            patch.object(self.packager, "copy_pkgroot_ditto") as mock_ditto,
+            patch.object(packager_module.os, "chmod"),
+        ):
+            self.packager.copy_pkgroot()
+        mock_ditto.assert_called_once_with(
+            self.pkgroot, os.path.join(self.tmproot, "test")
+        )
+        self.assertEqual(self.packager.copy_strategy, "ditto")
+        self.assertEqual(self.packager.metrics, {"bytes_copied": 1000})
+
+    def test_reflink_clone_preserves_tree(self):
+        """A successful clone should reproduce contents and modes."""
+
+        def fake_ioctl(fd, request, src_fd):
+            self.assertEqual(request, packager_module.FICLONE)
+            os.write(fd, os.read(src_fd, 4096))
+
+        with (
+            patch.object(packager_module.ctypes, "CDLL") as mock_cdll,
+            patch.object(packager_module.fcntl, "ioctl", side_effect=fake_ioctl),
+        ):
+            del mock_cdll.return_value.clonefile
+            self.packager.copy_pkgroot()
+        self.assertEqual(self.packager.copy_strategy, "clone")
+        self.assertNotEqual(
+            os.stat(self.copied("bin")).st_ino, os.stat(self.app_file).st_ino
+        )
+        self.assertEqual(os.stat(self.copied("bin")).st_mode & 0o777, 0o751)
+        with open(self.copied("bin"), "rb") as f:
+            self.assertEqual(f.read(), b"x" * 1000)
+        self.assertEqual(self.packager.metrics, {"bytes_cloned": 1000})
+
+    def test_failed_clone_is_cleaned_up(self):
+        """A partial clone should be removed before falling back."""
+        with (
+            patch.object(packager_module.ctypes, "CDLL") as mock_cdll,
+            patch.object(
+                packager_module.fcntl, "ioctl", side_effect=OSError(95, "Not supported")
+            ),
+        ):
+            del mock_cdll.return_value.clonefile
+            self.packager.copy_pkgroot()
+        self.assertEqual(self.packager.copy_strategy, "hardlink")
+        self.assertEqual(
+            os.stat(self.copied("bin")).st_ino, os.stat(self.app_file).st_ino
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -20,8 +20,9 @@ from tempfile import TemporaryDirectory
 from typing import Any
 from unittest.mock import MagicMock, patch
 
-from autopkglib import ProcessorError
+from autopkglib import ProcessorError, flatpkg
 from autopkglib.PkgCreator import PkgCreator
+from tests import get_processor_module
 
 
 class TestPkgCreator(unittest.TestCase):
@@ -156,8 +157,9 @@ class TestPkgCreator(unittest.TestCase):
         with self.assertRaisesRegex(ProcessorError, "Can't find nonexistent_file.txt"):
             self.processor.find_path_for_relpath("nonexistent_file.txt")
 
+    @patch("autopkglib.PkgCreator.os.path.exists", return_value=True)
     @patch("subprocess.Popen")
-    def test_xar_expand_success(self, mock_popen):
+    def test_xar_expand_success(self, mock_popen, mock_exists):
         """Test successful xar expansion."""
         mock_process = MagicMock()
         mock_process.communicate.return_value = ("", "")
@@ -172,8 +174,9 @@ class TestPkgCreator(unittest.TestCase):
         self.assertIn("/usr/bin/xar", args)
         self.assertIn(test_pkg, args)
 
+    @patch("autopkglib.PkgCreator.os.path.exists", return_value=True)
     @patch("subprocess.Popen")
-    def test_xar_expand_failure(self, mock_popen):
+    def test_xar_expand_failure(self, mock_popen, mock_exists):
         """Test xar expansion failure."""
         mock_process = MagicMock()
         mock_process.communicate.return_value = ("", "xar error")
@@ -184,13 +187,35 @@ class TestPkgCreator(unittest.TestCase):
         with self.assertRaisesRegex(ProcessorError, "extraction.*failed"):
             self.processor.xar_expand(test_pkg)
 
+    @patch("autopkglib.PkgCreator.os.path.exists", return_value=True)
     @patch("subprocess.Popen", side_effect=OSError(2, "No such file"))
-    def test_xar_expand_oserror(self, mock_popen):
+    def test_xar_expand_oserror(self, mock_popen, mock_exists):
         """Test xar expansion OSError."""
         test_pkg = self._mkpath("test.pkg")
         with self.assertRaisesRegex(ProcessorError, "xar execution failed"):
             self.processor.xar_expand(test_pkg)
 
+    @patch("autopkglib.PkgCreator.XAR", "/nonexistent/xar")
+    def test_pkg_already_exists_without_xar(self):
+        """Test that PackageInfo is read natively where xar is missing."""
+        pkg_path = self._mkpath("test.pkg")
+        with open(pkg_path, "wb") as f:
+            flatpkg.write_xar(
+                f,
+                [("PackageInfo", b'<pkg-info identifier="com.test" version="1.0.0"/>')],
+            )
+
+        self.assertTrue(
+            self.processor.pkg_already_exists(pkg_path, "com.test", "1.0.0")
+        )
+        self.assertTrue(os.path.exists(pkg_path))
+        self.assertFalse(self.processor.pkg_already_exists(pkg_path, "com.test", "2.0"))
+
+        with open(pkg_path, "w") as f:
+            f.write("fake package")
+        with self.assertRaisesRegex(ProcessorError, "extraction.*failed"):
+            self.processor.xar_expand(pkg_path)
+
     @patch("autopkglib.PkgCreator.xar_expand")
     def test_pkg_already_exists_true(self, mock_xar):
         """Test pkg_already_exists returns True for matching package."""
@@ -297,6 +322,112 @@ class TestPkgCreator(unittest.TestCase):
         with self.assertRaisesRegex(ProcessorError, "Package build failed"):
             self.processor.send_request({"test": "request"})
 
+    def batch_socket(self, reply: str) -> MagicMock:
+        """Return a mock socket whose server streams reply back."""
+        mock_socket = MagicMock()
+        mock_socket.makefile.return_value.__enter__.return_value = iter(
+            reply.splitlines(keepends=True)
+        )
+        self.processor.socket = mock_socket
+        return mock_socket
+
+    def test_send_requests_success(self):
+        """Batch results should be returned in request order."""
+        mock_socket = self.batch_socket("1:OK:/b.pkg\n0:OK:/a.pkg\nDONE\n")
+
+        result = self.processor.send_requests([{"pkgname": "a"}, {"pkgname": "b"}])
+
+        self.assertEqual(result, ["/a.pkg", "/b.pkg"])
+        sent = mock_socket.sendall.call_args.args[0]
+        self.assertTrue(sent.startswith(b"BATCH "))
+
+    def test_send_requests_reports_each_failure(self):
+        """Failed requests in a batch should be named in the error."""
+        self.batch_socket("0:OK:/a.pkg\n1:ERROR:one\n1:ERROR:two\nDONE\n")
+
+        with self.assertRaisesRegex(ProcessorError, "b: one, two"):
+            self.processor.send_requests([{"pkgname": "a"}, {"pkgname": "b"}])
+
+    def test_send_requests_unsupported_by_old_server(self):
+        """Older servers reject the batch header as a malformed request."""
+        self.batch_socket("ERROR:Malformed request\n")
+
+        self.assertIsNone(self.processor.send_requests([{"pkgname": "a"}]))
+
+    def test_request_packages_falls_back_to_single_requests(self):
+        """Without batch support, each request gets its own connection."""
+        module = get_processor_module("PkgCreator")
+        with (
+            patch.object(module.os.path, "exists", return_value=True),
+            patch.object(self.processor, "connect"),
+            patch.object(self.processor, "disconnect"),
+            patch.object(self.processor, "send_requests", return_value=None),
+            patch.object(
+                self.processor, "send_request", side_effect=["/a.pkg", "/b.pkg"]
+            ) as mock_send,
+        ):
+            result = self.processor.request_packages([{"id": "a"}, {"id": "b"}])
+        self.assertEqual(result, ["/a.pkg", "/b.pkg"])
+        self.assertEqual(mock_send.call_count, 2)
+
+    def test_pkg_requests_builds_missing_packages_in_one_batch(self):
+        """pkg_requests should batch every package that needs building."""
+        first = deepcopy(self.minimal_env["pkg_request"])
+        second = dict(first, pkgname="Second", id="com.example.second")
+        third = dict(first, pkgname="Third", id="com.example.third")
+        self.processor.env = {
+            "pkg_requests": [first, second, third],
+            "RECIPE_CACHE_DIR": self.tmp_dir.name,
+        }
+
+        with (
+            patch.object(
+                self.processor,
+                "pkg_already_exists",
+                side_effect=[False, True, False],
+            ),
+            patch.object(
+                self.processor,
+                "request_packages",
+                return_value=["/built/TestPackage.pkg", "/built/Third.pkg"],
+            ) as mock_request,
+        ):
+            self.processor.main()
+
+        mock_request.assert_called_once()
+        built = mock_request.call_args.args[0]
+        self.assertEqual([r["pkgname"] for r in built], ["TestPackage", "Third"])
+        self.assertEqual(
+            self.processor.env["pkg_paths"],
+            [
+                "/built/TestPackage.pkg",
+                self._mkpath("Second.pkg"),
+                "/built/Third.pkg",
+            ],
+        )
+        self.assertEqual(self.processor.env["pkg_path"], "/built/Third.pkg")
+        self.assertTrue(self.processor.env["new_package_request"])
+
+    def test_pkg_requests_skips_batch_when_all_exist(self):
+        """No batch should be sent when every package already exists."""
+        self.processor.env = {
+            "pkg_requests": [deepcopy(self.minimal_env["pkg_request"])],
+            "RECIPE_CACHE_DIR": self.tmp_dir.name,
+        }
+
+        with (
+            patch.object(self.processor, "pkg_already_exists", return_value=True),
+            patch.object(self.processor, "request_packages") as mock_request,
+        ):
+            self.processor.main()
+
+        mock_request.assert_not_called()
+        self.assertEqual(
+            self.processor.env["pkg_paths"], [self._mkpath("TestPackage.pkg")]
+        )
+        self.assertFalse(self.processor.env["new_package_request"])
+        self.assertNotIn("pkg_creator_summary_result", self.processor.env)
+
     def test_disconnect(self):
         """Test disconnection from autopkgserver."""
         mock_socket = MagicMock()
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import unittest
 from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, patch
@@ -452,6 +453,70 @@ class TestSparkleUpdateInfoProvider(unittest.TestCase):
 
         self.assertEqual(self.processor.xmlns, "http://custom.namespace/sparkle")
 
+    # Test streaming parsing
+    def _create_large_appcast(self, count, description_size=0):
+        """Create an appcast with count items in shuffled version order."""
+        xmlns = "http://www.andymatuschak.org/xml-namespaces/sparkle"
+        items = []
+        for i in range(count):
+            version = (i * 7919) % count
+            items.append(
+                f"<item><title>{version}</title>"
+                f"<sparkle:version>{version}</sparkle:version>"
+                f"<description>{'x' * description_size}</description>"
+                f'<enclosure url="https://example.com/app-{version}.zip"/></item>'
+            )
+        return (
+            f"<?xml version='1.0' encoding='utf-8'?><rss xmlns:sparkle={xmlns!r}>"
+            f"<channel><title>App</title>{''.join(items)}</channel></rss>"
+        )
+
+    def test_iter_feed_items_matches_whole_document_parse(self):
+        """Items should be parsed across chunk boundaries, as str or bytes."""
+        self.processor.xmlns = "http://www.andymatuschak.org/xml-namespaces/sparkle"
+        feed = self._create_large_appcast(500, description_size=300)
+        module = sys.modules[SparkleUpdateInfoProvider.__module__]
+        with patch.object(module, "FEED_CHUNK_SIZE", 1000):
+            from_str = list(self.processor.iter_feed_items(feed))
+            from_bytes = list(self.processor.iter_feed_items(feed.encode()))
+        self.assertEqual(len(from_str), 500)
+        self.assertEqual(from_str, from_bytes)
+        self.assertEqual(from_str[1]["version"], "419")
+        self.assertEqual(len(from_str[0]["description_data"]), 300)
+
+    def test_iter_feed_items_can_skip_descriptions(self):
+        """Descriptions should be omitted when not needed."""
+        self.processor.xmlns = "http://www.andymatuschak.org/xml-namespaces/sparkle"
+        feed = self._create_large_appcast(3, description_size=10)
+        items = list(self.processor.iter_feed_items(feed, descriptions=False))
+        self.assertFalse(any("description_data" in item for item in items))
+
+    def test_iter_feed_items_raises_on_truncated_feed(self):
+        """A feed that is cut short should still be a parsing error."""
+        self.processor.xmlns = "http://www.andymatuschak.org/xml-namespaces/sparkle"
+        feed = self._create_large_appcast(10)
+        with self.assertRaisesRegex(ProcessorError, "Error parsing XML"):
+            list(self.processor.iter_feed_items(feed[:-20]))
+
+    def test_latest_items_keeps_feed_order_for_ties(self):
+        """Items with equal versions should be returned in feed order."""
+        items = [
+            {"version": "1.0", "url": "a"},
+            {"version": "2.0", "url": "b"},
+            {"version": "2.0", "url": "c"},
+            {"version": "1.5", "url": "d"},
+        ]
+        latest = self.processor.latest_items(iter(items), count=3)
+        self.assertEqual([item["url"] for item in latest], ["b", "c", "d"])
+
+    def test_main_selects_latest_from_large_feed(self):
+        """main() should find the highest version in a large shuffled feed."""
+        feed = self._create_large_appcast(2000, description_size=50)
+        with patch.object(self.processor, "get_feed_data", return_value=feed):
+            self.processor.main()
+        self.assertEqual(self.processor.env["version"], "1999")
+        self.assertEqual(self.processor.env["url"], "https://example.com/app-1999.zip")
+
 
 if __name__ == "__main__":
     unittest.main()
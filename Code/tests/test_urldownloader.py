@@ -15,12 +15,14 @@
 import json
 import os
 import tempfile
+import time
 import unittest
 from hashlib import md5, sha1, sha256
 from unittest.mock import patch
 
-from autopkglib import BUNDLE_ID
+from autopkglib import BUNDLE_ID, ProcessorError
 from autopkglib.URLDownloader import URLDownloader
+from tests import get_processor_module
 
 
 class TestURLDownloader(unittest.TestCase):
@@ -670,5 +672,234 @@ class TestURLDownloader(unittest.TestCase):
         self.assertTrue(BUNDLE_ID in self.processor.xattr_etag)
 
 
+class TestURLDownloaderDownloads(unittest.TestCase):
+    """Test class for URLDownloader.main against a fake server."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.download_dir = os.path.join(self.tmp_dir.name, "downloads")
+        self.requests = []
+        try:
+            os.makedirs(self.download_dir)
+            probe = os.path.join(self.download_dir, "probe")
+            open(probe, "w").close()
+            from autopkglib import xattr as autopkg_xattr
+
+            autopkg_xattr.setxattr(probe, f"user.{BUNDLE_ID}.probe", b"1")
+            os.remove(probe)
+        except Exception:
+            self.skipTest("xattr not available on this platform")
+
+    def run_downloader(self, version, disposition=False, **env):
+        """Run URLDownloader against a server whose current file is App-version."""
+
+        def fake_download(curl_cmd, text=True):
+            self.requests.append(curl_cmd)
+            etag = f'"etag-{version}"'
+            if f"If-None-Match: {etag}" in curl_cmd:
+                return "HTTP/1.1 304 Not Modified\r\n\r\n"
+            with open(curl_cmd[curl_cmd.index("--output") + 1], "w") as f:
+                f.write(version)
+            headers = f"HTTP/1.1 200 OK\r\nETag: {etag}\r\n"
+            if disposition:
+                headers += (
+                    f'Content-Disposition: attachment; filename="App-{version}.dmg"\r\n'
+                )
+                return headers + "\r\n"
+            return (
+                "HTTP/1.1 302 Found\r\n"
+                f"Location: https://cdn.example.com/App-{version}.dmg\r\n\r\n"
+                + headers
+                + "\r\n"
+            )
+
+        processor = URLDownloader()
+        processor.env = {
+            "url": "https://example.com/latest",
+            "download_dir": self.download_dir,
+            "prefetch_filename": True,
+            "CHECK_FILESIZE_ONLY": False,
+            **env,
+        }
+        with patch.object(processor, "download_with_curl", side_effect=fake_download):
+            processor.main()
+        return processor.env
+
+    def test_filename_from_redirect_in_one_request(self):
+        """The filename should come from the download's own redirect."""
+        env = self.run_downloader("1.0")
+        self.assertEqual(len(self.requests), 1)
+        self.assertNotIn("--head", self.requests[0])
+        self.assertEqual(
+            env["pathname"], os.path.join(self.download_dir, "App-1.0.dmg")
+        )
+        self.assertTrue(env["download_changed"])
+        with open(env["pathname"]) as f:
+            self.assertEqual(f.read(), "1.0")
+        # Only the download itself should be left in download_dir.
+        self.assertEqual(os.listdir(self.download_dir), ["App-1.0.dmg"])
+
+    def test_unchanged_download_is_conditional(self):
+        """A second run should revalidate the file previously saved for url."""
+        self.run_downloader("1.0")
+        env = self.run_downloader("1.0")
+        self.assertIn('If-None-Match: "etag-1.0"', self.requests[1])
+        self.assertFalse(env["download_changed"])
+        self.assertEqual(
+            env["pathname"], os.path.join(self.download_dir, "App-1.0.dmg")
+        )
+
+    def test_new_version_gets_new_filename(self):
+        """A changed download should be saved under its new filename."""
+        self.run_downloader("1.0")
+        env = self.run_downloader("2.0", disposition=True)
+        self.assertTrue(env["download_changed"])
+        self.assertEqual(
+            env["pathname"], os.path.join(self.download_dir, "App-2.0.dmg")
+        )
+        self.assertEqual(env["etag"], '"etag-2.0"')
+        self.assertEqual(
+            sorted(os.listdir(self.download_dir)), ["App-1.0.dmg", "App-2.0.dmg"]
+        )
+        self.run_downloader("2.0", disposition=True)
+        self.assertIn('If-None-Match: "etag-2.0"', self.requests[2])
+
+    def test_check_curl_cmd_is_conditional_head(self):
+        """The check command should be a HEAD request with the stored ETag."""
+        env = self.run_downloader("1.0")
+        processor = URLDownloader()
+        processor.env = {
+            "url": "https://example.com/latest",
+            "download_dir": self.download_dir,
+            "prefetch_filename": True,
+        }
+        curl_cmd = processor.prepare_check_curl_cmd()
+        self.assertIn("--head", curl_cmd)
+        self.assertIn('If-None-Match: "etag-1.0"', curl_cmd)
+        self.assertEqual(processor.env["pathname"], env["pathname"])
+
+    def test_check_curl_cmd_needs_a_previous_download(self):
+        """Without a previous download or a static url there is nothing to check."""
+        processor = URLDownloader()
+        processor.env = {
+            "url": "https://example.com/a.dmg",
+            "download_dir": self.download_dir,
+        }
+        self.assertIsNone(processor.prepare_check_curl_cmd())
+        processor.env = {"url": "%SPARKLE_URL%", "download_dir": self.download_dir}
+        self.assertIsNone(processor.prepare_check_curl_cmd())
+
+    def test_unchanged_check_result_skips_request(self):
+        """A 304 from the check before the run should skip the request."""
+        first = self.run_downloader("1.0")
+        processor = URLDownloader()
+        processor.env = {
+            "url": "https://example.com/latest",
+            "download_dir": self.download_dir,
+            "prefetch_filename": True,
+            "CHECK_FILESIZE_ONLY": False,
+            "DOWNLOAD_CHECK_RESULT": {
+                "url": "https://example.com/latest",
+                "pathname": first["pathname"],
+                "http_result_code": "304",
+            },
+        }
+        with patch.object(processor, "download_with_curl") as mock_download:
+            processor.main()
+        mock_download.assert_not_called()
+        self.assertFalse(processor.env["download_changed"])
+        self.assertEqual(processor.env["pathname"], first["pathname"])
+
+    def test_download_sha256(self):
+        """The digest should be an output, stored, and reused when unchanged."""
+        env = self.run_downloader("1.0", COMPUTE_HASHES=True)
+        self.assertEqual(env["download_sha256"], sha256(b"1.0").hexdigest())
+        self.assertEqual(env["download_md5"], md5(b"1.0").hexdigest())
+        env = self.run_downloader("1.0")
+        self.assertFalse(env["download_changed"])
+        self.assertEqual(env["download_sha256"], sha256(b"1.0").hexdigest())
+
+    def test_stored_sha256_ignores_changed_file(self):
+        """A stored digest is only used while the file is unchanged."""
+        module = get_processor_module("URLDownloader")
+        env = self.run_downloader("1.0")
+        path = env["pathname"]
+        self.assertEqual(module.stored_sha256(path), sha256(b"1.0").hexdigest())
+        os.utime(path, ns=(0, 0))
+        self.assertIsNone(module.stored_sha256(path))
+        # An unchanged download with a stale digest is hashed again
+        env = self.run_downloader("1.0")
+        self.assertFalse(env["download_changed"])
+        self.assertEqual(env["download_sha256"], sha256(b"1.0").hexdigest())
+        self.assertEqual(module.stored_sha256(path), sha256(b"1.0").hexdigest())
+        with patch.object(module.xattr, "listxattr", side_effect=OSError):
+            self.assertIsNone(module.stored_sha256(path))
+        self.assertIsNone(module.stored_sha256(path + ".missing"))
+
+    def test_expected_sha256_mismatch_fails(self):
+        """A download with the wrong digest should fail and not be kept."""
+        self.run_downloader("1.0")
+        with self.assertRaises(ProcessorError):
+            self.run_downloader("2.0", disposition=True, expected_sha256="0" * 64)
+        self.assertEqual(os.listdir(self.download_dir), ["App-1.0.dmg"])
+        env = self.run_downloader(
+            "2.0", disposition=True, expected_sha256=sha256(b"2.0").hexdigest().upper()
+        )
+        self.assertTrue(env["download_changed"])
+
+    def test_hasher_follows_growing_file(self):
+        """DownloadHasher should hash a file as it is written and rewritten."""
+        module = get_processor_module("URLDownloader")
+        path = os.path.join(self.download_dir, "growing")
+        open(path, "wb").close()
+        hasher = module.DownloadHasher(path, ("sha256", "md5"))
+        hasher.start()
+        with open(path, "wb") as f:
+            f.write(b"partial" * 1000)
+            f.flush()
+            time.sleep(0.2)
+            # Start over, as curl does when it retries
+            f.seek(0)
+            f.truncate()
+            time.sleep(0.2)
+            for _ in range(50):
+                f.write(b"x" * 10000)
+                f.flush()
+        data = b"x" * 500000
+        self.assertEqual(
+            hasher.hexdigests(),
+            {"sha256": sha256(data).hexdigest(), "md5": md5(data).hexdigest()},
+        )
+
+    def test_hasher_rehashes_file_rewritten_in_place(self):
+        """Bytes changed after they were hashed should be read again."""
+        module = get_processor_module("URLDownloader")
+        path = os.path.join(self.download_dir, "rewritten")
+        with open(path, "wb") as f:
+            f.write(b"a" * 1000)
+        hasher = module.DownloadHasher(path)
+        hasher.start()
+        time.sleep(0.2)
+        with open(path, "r+b") as f:
+            f.write(b"b" * 1000)
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(
+            hasher.hexdigests(), {"sha256": sha256(b"b" * 1000).hexdigest()}
+        )
+
+    def test_hasher_rehashes_restarted_download(self):
+        """A restarted transfer should never trust the streamed digest."""
+        module = get_processor_module("URLDownloader")
+        path = os.path.join(self.download_dir, "restarted")
+        with open(path, "wb") as f:
+            f.write(b"data")
+        hasher = module.DownloadHasher(path)
+        hasher.start()
+        with patch.object(module, "hash_file", return_value={}) as mock_hash:
+            hasher.hexdigests(restarted=True)
+        mock_hash.assert_called_once_with(path, ("sha256",))
+
+
 if __name__ == "__main__":
     unittest.main()
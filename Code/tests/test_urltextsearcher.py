@@ -1,12 +1,19 @@
 #!/usr/local/autopkg/python
 
+import os
 import plistlib
+import sys
+import threading
+import time
 import unittest
+from tempfile import TemporaryDirectory
 from textwrap import dedent
 from unittest.mock import patch
 
 from autopkglib import ProcessorError
+from autopkglib.URLGetter import DownloadScheduler, RetryPolicy, parse_rate
 from autopkglib.URLTextSearcher import NO_MATCH_MESSAGE, URLTextSearcher
+from tests import get_processor_module
 
 
 class TestURLTextSearcher(unittest.TestCase):
@@ -116,5 +123,447 @@ class TestURLTextSearcher(unittest.TestCase):
         self.assertEqual(self.processor.env["path"], self.match["path"])
 
 
+class TestURLTextSearcherResponseCache(unittest.TestCase):
+    """Test class for the run-scoped response cache used by URLTextSearcher."""
+
+    web_page = '<a href="http://someserver.url/first.dmg">first</a>'
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def fake_download(self, curl_cmd, text=True):
+        with self.lock:
+            self.calls += 1
+        time.sleep(0.05)
+        return self.web_page
+
+    def search(self, **env):
+        processor = URLTextSearcher()
+        processor.env = {
+            "re_pattern": "http://.*.dmg",
+            "result_output_var_name": "match",
+            "url": "https://example.com/downloads",
+            "CACHE_DIR": self.tmp_dir.name,
+            "RUN_ID": "run1",
+            **env,
+        }
+        with patch.object(
+            processor, "download_with_curl", side_effect=self.fake_download
+        ):
+            processor.main()
+        self.assertEqual(processor.env["match"], "http://someserver.url/first.dmg")
+
+    def test_identical_requests_fetch_once(self):
+        """A second identical request in the same run should use the cache."""
+        self.search()
+        self.search()
+        self.assertEqual(self.calls, 1)
+
+    def test_cache_is_keyed_by_request(self):
+        """Different headers, curl options or runs should fetch again."""
+        self.search()
+        self.search(request_headers={"User-Agent": "AutoPkg"})
+        self.search(curl_opts=["--max-time", "10"])
+        self.search(RUN_ID="run2")
+        self.assertEqual(self.calls, 4)
+
+    def test_expired_entries_are_refetched(self):
+        """Entries older than URL_RESPONSE_CACHE_TTL should be ignored."""
+        self.search(URL_RESPONSE_CACHE_TTL=60)
+        cache_dir = os.path.join(self.tmp_dir.name, "URLResponses", "run1")
+        for name in os.listdir(cache_dir):
+            os.utime(os.path.join(cache_dir, name), (0, 0))
+        self.search(URL_RESPONSE_CACHE_TTL=60)
+        self.assertEqual(self.calls, 2)
+
+    def test_cache_disabled(self):
+        """Without a run ID, or with a TTL of 0, nothing should be cached."""
+        self.search(RUN_ID=None)
+        self.search(RUN_ID=None)
+        self.search(URL_RESPONSE_CACHE_TTL=0)
+        self.assertEqual(self.calls, 3)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir.name, "URLResponses"))
+        )
+
+    @unittest.skipIf(os.name == "nt", "Requires fcntl")
+    def test_concurrent_requests_fetch_once(self):
+        """Concurrent identical requests should wait for the first fetch."""
+        threads = [threading.Thread(target=self.search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+
+
+class TestURLTextSearcherStreaming(unittest.TestCase):
+    """Test class for URLTextSearcher's stream_search mode."""
+
+    def setUp(self):
+        self.processor = URLTextSearcher()
+        self.processor.env = {
+            "re_pattern": r"https://example\.com/(?P<name>App-[\d.]+)\.dmg",
+            "result_output_var_name": "match",
+            "url": "https://example.com/downloads",
+            "stream_search": True,
+            "stream_search_overlap": 64,
+        }
+        self.chunks_read = 0
+
+    def search(self, data: bytes, chunk_size=16):
+        def iter_curl_output(curl_cmd):
+            for i in range(0, len(data), chunk_size):
+                self.chunks_read += 1
+                yield data[i : i + chunk_size]
+
+        with patch.object(
+            self.processor, "iter_curl_output", side_effect=iter_curl_output
+        ):
+            self.processor.main()
+
+    def test_match_across_chunk_boundaries(self):
+        """Matches split across several chunks should be found."""
+        self.search(b"x" * 1000 + b"<a href='https://example.com/App-1.2.3.dmg'>")
+        self.assertEqual(self.processor.env["name"], "App-1.2.3")
+        self.assertEqual(self.processor.env["match"], "App-1.2.3")
+
+    def test_stops_reading_after_match(self):
+        """The rest of the response shouldn't be read once a match is found."""
+        self.search(b"https://example.com/App-1.0.dmg" + b"x" * 10000)
+        self.assertEqual(self.processor.env["name"], "App-1.0")
+        self.assertLess(self.chunks_read, 10)
+
+    def test_match_is_not_cut_short(self):
+        """Matches still growing at the end of a window should be completed."""
+        self.processor.env["re_pattern"] = r"App-[\d.]+"
+        self.search(b"x" * 100 + b"App-1.2.3.4.5.6.7 ", chunk_size=4)
+        self.assertEqual(self.processor.env["match"], "App-1.2.3.4.5.6.7")
+
+    def test_multibyte_characters_split_across_chunks(self):
+        """Characters split between chunks should be decoded correctly."""
+        self.processor.env["re_pattern"] = "caf\u00e9-(?P<v>\\d+)"
+        self.search("\u00fc".encode() * 50 + "caf\u00e9-42 ".encode(), chunk_size=3)
+        self.assertEqual(self.processor.env["v"], "42")
+
+    def test_no_match_raises(self):
+        """A response without a match should raise ProcessorError."""
+        with self.assertRaises(ProcessorError) as err:
+            self.search(b"x" * 1000)
+        self.assertIn(NO_MATCH_MESSAGE, str(err.exception))
+
+    def test_patterns_are_compiled_once(self):
+        """The compiled pattern should be shared between processors."""
+        module = get_processor_module("URLTextSearcher")
+        module.compile_pattern.cache_clear()
+        for _ in range(3):
+            self.search(b"https://example.com/App-1.0.dmg ")
+        self.assertEqual(module.compile_pattern.cache_info().misses, 1)
+
+    def test_iter_curl_output(self):
+        """Output should be streamed, and failures should raise."""
+        chunks = self.processor.iter_curl_output(
+            [sys.executable, "-c", "print('a' * 200000)"], chunk_size=4096
+        )
+        self.assertEqual(b"".join(chunks), b"a" * 200000 + os.linesep.encode())
+        with self.assertRaises(ProcessorError):
+            list(
+                self.processor.iter_curl_output(
+                    [sys.executable, "-c", "import sys; sys.exit(6)"]
+                )
+            )
+
+    def test_iter_curl_output_close_stops_process(self):
+        """Closing the generator early should stop the process."""
+        chunks = self.processor.iter_curl_output(
+            [
+                sys.executable,
+                "-c",
+                "import sys, time\nwhile True:\n"
+                "    sys.stdout.write('a' * 1024); sys.stdout.flush(); time.sleep(0.01)",
+            ]
+        )
+        next(chunks)
+        start = time.monotonic()
+        chunks.close()
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class TestURLGetterDownloadScheduler(unittest.TestCase):
+    """Test class for scheduling downloads with DownloadScheduler."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.processor = URLTextSearcher()
+        self.processor.env = {
+            "re_pattern": "x+",
+            "result_output_var_name": "match",
+            "url": "https://example.com/page",
+            "CACHE_DIR": self.tmp_dir.name,
+            "DOWNLOAD_MAX_PER_HOST": 2,
+        }
+
+    def test_parse_rate(self):
+        """Rates should accept curl's K, M and G suffixes."""
+        self.assertEqual(parse_rate("2048"), 2048)
+        self.assertEqual(parse_rate("1.5k"), 1536)
+        self.assertEqual(parse_rate("2M"), 2 * 1024**2)
+        self.assertEqual(parse_rate(None), 0)
+        with self.assertRaises(ProcessorError):
+            parse_rate("fast")
+
+    def test_disabled_by_default(self):
+        """Without limits set, transfers shouldn't be scheduled."""
+        del self.processor.env["DOWNLOAD_MAX_PER_HOST"]
+        self.assertIsNone(self.processor.download_scheduler())
+
+    def test_per_host_limit(self):
+        """No more than max_per_host transfers should run against one host."""
+        scheduler = DownloadScheduler(self.tmp_dir.name, max_per_host=2)
+        lock = threading.Lock()
+        running = {"example.com": 0, "other.com": 0}
+        peak = dict(running)
+
+        def transfer(url):
+            with scheduler.transfer(url) as record:
+                with lock:
+                    running[record["host"]] += 1
+                    peak[record["host"]] = max(
+                        peak[record["host"]], running[record["host"]]
+                    )
+                time.sleep(0.1)
+                with lock:
+                    running[record["host"]] -= 1
+
+        threads = [
+            threading.Thread(target=transfer, args=(f"https://{host}/dl",))
+            for host in ["example.com"] * 5 + ["other.com"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak, {"example.com": 2, "other.com": 1})
+
+    def test_staggered_transfers_stay_under_bandwidth(self):
+        """Transfers starting and finishing at different times should share
+        the bandwidth limit without exceeding it."""
+        bandwidth = 256 * 1024
+        scheduler = DownloadScheduler(self.tmp_dir.name, bandwidth=bandwidth)
+        received = []
+        lock = threading.Lock()
+
+        def transfer(delay, size):
+            time.sleep(delay)
+            with scheduler.transfer("https://example.com/dl") as record:
+                self.assertEqual(record["limit_rate"], bandwidth)
+                for _ in range(size // 8192):
+                    time.sleep(record["throttle"](8192))
+                    with lock:
+                        received.append((time.monotonic(), 8192))
+
+        threads = [
+            threading.Thread(target=transfer, args=args)
+            for args in [(0, 64 * 1024), (0.1, 128 * 1024), (0.2, 96 * 1024)]
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        burst = bandwidth * get_processor_module("URLGetter").BANDWIDTH_BURST
+        total = 0
+        for when, size in sorted(received):
+            total += size
+            # Allow a chunk of slack for timer granularity
+            self.assertLessEqual(
+                total, burst + bandwidth * (when - start) + 8192 * len(threads)
+            )
+        self.assertEqual(total, 288 * 1024)
+
+    def test_throttled_curl_is_paused(self):
+        """A curl writing to a file faster than the limit should be paused."""
+        self.processor.env["DOWNLOAD_BANDWIDTH_LIMIT"] = "512K"
+        output = os.path.join(self.tmp_dir.name, "download")
+        fast_curl = [
+            sys.executable,
+            "-c",
+            "import sys, time\n"
+            "with open(sys.argv[sys.argv.index('-o') + 1], 'wb') as f:\n"
+            "    for _ in range(20):\n"
+            "        f.write(b'x' * 32768); f.flush(); time.sleep(0.01)",
+            "-o",
+            output,
+            "https://example.com/dl",
+        ]
+        start = time.monotonic()
+        self.processor.execute_curl_attempt(fast_curl, text=False)
+        elapsed = time.monotonic() - start
+        self.assertEqual(os.path.getsize(output), 640 * 1024)
+        # 640K at 512K/s, less the burst allowance
+        self.assertGreater(elapsed, 0.8)
+        self.assertEqual(
+            self.processor.download_metrics["example.com"]["bytes"], 640 * 1024
+        )
+
+    def test_metrics_are_reported(self):
+        """Scheduled transfers should be summarized in the run report."""
+        self.processor.env["DOWNLOAD_BANDWIDTH_LIMIT"] = "1M"
+        curl_cmd = [sys.executable, "-c", "print('x' * 99)", "https://example.com/a"]
+        with patch.object(self.processor, "prepare_curl_cmd", return_value=curl_cmd):
+            self.processor.main()
+        self.assertEqual(self.processor.env["match"], "x" * 99)
+        summary = self.processor.env["download_scheduler_summary_result"]
+        self.assertEqual(summary["data"]["hosts"], "example.com")
+        self.assertEqual(summary["data"]["requests"], "1")
+        self.assertEqual(self.processor.download_metrics["example.com"]["bytes"], 100)
+        self.assertNotIn(
+            "download_scheduler_summary_result", self.processor.output_variables
+        )
+
+
+# Fails with the exit code and stderr given as arguments until it has been
+# run the given number of times, counting runs in a file. Failed responses
+# are a 503 with Retry-After, dumped where curl's --dump-header says; exit
+# code 0 stands in for curl without --fail.
+FLAKY_CURL = """
+import sys
+count_file, failures, code, error = sys.argv[1:5]
+header_file = sys.argv[sys.argv.index("--dump-header") + 1]
+with open(count_file, "a+") as f:
+    f.seek(0)
+    runs = len(f.read())
+    f.write(".")
+if runs < int(failures):
+    if code in ("0", "22"):
+        status = error.split("returned error: ")[-1] if "returned" in error else "503"
+        with open(header_file, "w") as f:
+            f.write(f"HTTP/1.1 {status} Failed\\nRetry-After: 5\\n\\n")
+    sys.stderr.write(error)
+    if code == "0":
+        print("unavailable")
+    sys.exit(int(code))
+with open(header_file, "w") as f:
+    f.write("HTTP/1.1 200 OK\\n\\n")
+print("found it")
+"""
+
+
+class TestURLGetterRetries(unittest.TestCase):
+    """Test class for retrying failed curl commands."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.count_file = os.path.join(self.tmp_dir.name, "runs")
+        self.processor = URLTextSearcher()
+        self.processor.env = {
+            "re_pattern": "found (it)",
+            "result_output_var_name": "match",
+            "url": "https://example.com/page",
+            "DOWNLOAD_RETRY_ATTEMPTS": 3,
+        }
+        sleep = patch.object(get_processor_module("URLGetter").time, "sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def curl_cmd(self, failures, code=22, error="curl: (22) returned error: 503"):
+        return [
+            sys.executable,
+            "-c",
+            FLAKY_CURL,
+            self.count_file,
+            str(failures),
+            str(code),
+            error,
+            "https://example.com/page",
+        ]
+
+    def runs(self):
+        with open(self.count_file) as f:
+            return len(f.read())
+
+    def test_retryable_failures(self):
+        """Only transient curl failures and HTTP statuses should be retried."""
+        policy = RetryPolicy(status_codes="502, 503")
+        self.assertEqual(policy.reason(22, "returned error: 503"), "HTTP 503")
+        self.assertIsNone(policy.reason(22, "returned error: 404"))
+        self.assertEqual(policy.reason(7, "Failed to connect"), "curl exit code 7")
+        self.assertIsNone(policy.reason(3, "URL malformed"))
+
+    def test_delay(self):
+        """Delays should back off with jitter, honoring Retry-After."""
+        policy = RetryPolicy(backoff=2, max_delay=10)
+        for attempt in range(1, 6):
+            self.assertLessEqual(policy.delay(attempt), min(10, 2**attempt))
+        self.assertEqual(policy.delay(1, "HTTP/1.1 429\nRetry-After: 7\n"), 7)
+        self.assertEqual(policy.delay(1, "Retry-After: 120\n"), 10)
+        date = "Retry-After: Wed, 21 Oct 2015 07:28:00 GMT\n"
+        self.assertLessEqual(policy.delay(1, date), 2)
+
+    def test_transient_failure_is_retried(self):
+        """A request that fails transiently should succeed on a later attempt."""
+        with patch.object(
+            self.processor, "prepare_curl_cmd", return_value=self.curl_cmd(2)
+        ):
+            self.processor.main()
+        self.assertEqual(self.processor.env["match"], "it")
+        self.assertEqual(self.runs(), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        summary = self.processor.env["download_retries_summary_result"]
+        self.assertEqual(summary["data"]["retries"], "2")
+        self.assertEqual(summary["data"]["reasons"], "HTTP 503")
+
+    def test_permanent_failure_is_not_retried(self):
+        """Failures that won't go away should fail on the first attempt."""
+        curl_cmd = self.curl_cmd(1, error="curl: (22) returned error: 404")
+        with self.assertRaises(ProcessorError):
+            self.processor.download_with_curl(curl_cmd)
+        self.assertEqual(self.runs(), 1)
+        self.sleep.assert_not_called()
+
+    def test_attempts_are_limited(self):
+        """The last failure should be raised once attempts run out."""
+        with self.assertRaises(ProcessorError):
+            self.processor.download_with_curl(self.curl_cmd(5, code=56, error=""))
+        self.assertEqual(self.runs(), 3)
+
+    def test_streamed_output_is_retried(self):
+        """iter_curl_output should retry failures before any output."""
+        curl_cmd = self.curl_cmd(1, code=56, error="")
+        output = b"".join(self.processor.iter_curl_output(curl_cmd))
+        self.assertEqual(output.strip(), b"found it")
+        self.assertEqual(self.runs(), 2)
+
+    def test_status_is_retried_without_fail(self):
+        """Retryable statuses should be retried even if curl succeeds, after
+        the delay asked for by Retry-After."""
+        output, _, _ = self.processor.execute_curl(self.curl_cmd(2, code=0, error=""))
+        self.assertEqual(output.strip(), "found it")
+        self.assertEqual(self.runs(), 3)
+        self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [5, 5])
+
+    def test_streamed_status_is_retried_without_fail(self):
+        """iter_curl_output should retry a retryable status before yielding
+        its body, after the delay asked for by Retry-After."""
+        curl_cmd = self.curl_cmd(1, code=0, error="")
+        output = b"".join(self.processor.iter_curl_output(curl_cmd))
+        self.assertEqual(output.strip(), b"found it")
+        self.assertEqual(self.runs(), 2)
+        self.sleep.assert_called_once_with(5)
+
+    def test_last_attempt_returns_response_without_fail(self):
+        """Without --fail, the last response is returned as curl would."""
+        output, _, returncode = self.processor.execute_curl(
+            self.curl_cmd(5, code=0, error="")
+        )
+        self.assertEqual((output.strip(), returncode), ("unavailable", 0))
+        self.assertEqual(self.runs(), 3)
+
+
 if __name__ == "__main__":
     unittest.main()